@@ -0,0 +1,248 @@
+"""
+fit gaussian mixtures to all of the psf images of an object at once
+
+The psf images are small, so the per-image overhead of fitting them one
+at a time dominates.  Here the images with the same shape are stacked
+and the EM iterations are done for the whole stack with numpy.
+"""
+from __future__ import print_function
+import numpy
+
+# ngmix imports
+from ngmix.gmix import GMix
+from ngmix.em import EM_RANGE_ERROR, EM_MAXITER
+
+class BatchEMPSFFitter(object):
+    """
+    EM fits of an ngauss gaussian mixture to a list of psf observations
+
+        fitter = BatchEMPSFFitter(3, maxiter=5000, tol=1.0e-6, ntry=2)
+        fitters = fitter.go(psf_obs_list)
+
+    go returns a fitter for each psf obs in order, with get_result() and
+    get_gmix() methods like the ngmix fitters.
+
+    As in ngmix, the image is shifted to be positive, a small constant sky
+    is added and the image is normalized to unit sum.  The sky is fit along
+    with the gaussians, so the fluxes of the gaussians sum to one minus the
+    fraction of the image in the sky.
+    """
+    def __init__(self, ngauss, maxiter=5000, tol=1.0e-6, ntry=1, Tguess_key='Tguess'):
+        self.ngauss = ngauss
+        self.maxiter = maxiter
+        self.tol = tol
+        self.ntry = ntry
+        self.Tguess_key = Tguess_key
+
+    def go(self, psf_obs_list):
+        """
+        fit all of the psf observations, returning a fitter for each
+        """
+        fitters = [None]*len(psf_obs_list)
+
+        # stack the images by shape
+        groups = {}
+        for i,psf_obs in enumerate(psf_obs_list):
+            groups.setdefault(psf_obs.image.shape,[]).append(i)
+
+        for shape,inds in groups.items():
+            obs = [psf_obs_list[i] for i in inds]
+            pars,flags,numiter = self._fit_group(obs)
+
+            for j,i in enumerate(inds):
+                fitters[i] = BatchEMPSFFit(pars[j],flags[j],numiter[j])
+
+        return fitters
+
+    def _fit_group(self, psf_obs_list):
+        """
+        fit a list of psf obs with images of the same shape
+        """
+        nobs = len(psf_obs_list)
+        nrows,ncols = psf_obs_list[0].image.shape
+        rows,cols = numpy.mgrid[0:nrows,0:ncols]
+        rows = rows.ravel()
+        cols = cols.ravel()
+
+        npix = rows.size
+        images = numpy.zeros((nobs,npix))
+        v = numpy.zeros((nobs,npix))
+        u = numpy.zeros((nobs,npix))
+        area = numpy.zeros(nobs)
+        Tguess = numpy.zeros(nobs)
+
+        for i,psf_obs in enumerate(psf_obs_list):
+            jac = psf_obs.jacobian
+            row0,col0 = jac.get_cen()
+            drow = rows - row0
+            dcol = cols - col0
+            v[i,:] = jac.get_dvdrow()*drow + jac.get_dvdcol()*dcol
+            u[i,:] = jac.get_dudrow()*drow + jac.get_dudcol()*dcol
+            area[i] = abs(jac.get_dudrow()*jac.get_dvdcol() - jac.get_dudcol()*jac.get_dvdrow())
+
+            images[i,:] = psf_obs.image.ravel()
+            Tguess[i] = psf_obs.meta.get(self.Tguess_key,4.0*area[i])
+
+        # shift to positive and add a small sky, as ngmix does, then
+        # normalize to unit sum with the sky as a fraction of the total
+        images -= images.min(axis=1)[:,numpy.newaxis]
+        sky = 0.001*images.max(axis=1)
+        w, = numpy.where(sky <= 0.0)
+        if w.size > 0:
+            sky[w] = 1.0e-6
+        images += sky[:,numpy.newaxis]
+
+        counts = images.sum(axis=1)
+        images /= counts[:,numpy.newaxis]
+        psky = sky*npix/counts
+
+        pars = numpy.zeros((nobs,self.ngauss,6))
+        flags = numpy.zeros(nobs,dtype='i4') + EM_MAXITER
+        numiter = numpy.zeros(nobs,dtype='i4')
+
+        todo = numpy.arange(nobs)
+        for itry in xrange(self.ntry):
+            guess = self._get_guess(Tguess[todo],itry)
+            tpars,tflags,tnumiter = self._run_em(images[todo],psky[todo],v[todo],u[todo],area[todo],guess)
+
+            pars[todo] = tpars
+            flags[todo] = tflags
+            numiter[todo] = tnumiter
+
+            todo = todo[tflags != 0]
+            if todo.size == 0:
+                break
+
+        return pars,flags,numiter
+
+    def _get_guess(self, Tguess, itry):
+        """
+        guess [p, v, u, irr, irc, icc] for each gaussian, with equal
+        fluxes summing to one and spread in size about Tguess, perturbed
+        for each retry
+        """
+        nobs = Tguess.size
+        ngauss = self.ngauss
+
+        fac = 2.0**(numpy.arange(ngauss) - 0.5*(ngauss-1))
+        guess = numpy.zeros((nobs,ngauss,6))
+        guess[:,:,0] = 1.0/ngauss
+        guess[:,:,3] = 0.5*Tguess[:,numpy.newaxis]*fac
+        guess[:,:,5] = guess[:,:,3]
+
+        if itry > 0:
+            sigma = numpy.sqrt(0.5*Tguess)[:,numpy.newaxis]
+            guess[:,:,1] = 0.1*sigma*numpy.random.uniform(low=-1.0,high=1.0,size=(nobs,ngauss))
+            guess[:,:,2] = 0.1*sigma*numpy.random.uniform(low=-1.0,high=1.0,size=(nobs,ngauss))
+            guess[:,:,3] *= 1.0 + 0.1*numpy.random.uniform(low=-1.0,high=1.0,size=(nobs,ngauss))
+            guess[:,:,5] *= 1.0 + 0.1*numpy.random.uniform(low=-1.0,high=1.0,size=(nobs,ngauss))
+
+        return guess
+
+    def _run_em(self, images, psky, v, u, area, guess):
+        """
+        run the EM iterations for the stack of unit sum images until T
+        converges for all of them
+
+        psky is the starting fraction of each image in the sky, which is
+        spread evenly over the pixels and updated in each iteration
+        """
+        nobs,npix = images.shape
+        psky = psky.copy()
+
+        p = guess[:,:,0].copy()
+        vcen = guess[:,:,1].copy()
+        ucen = guess[:,:,2].copy()
+        irr = guess[:,:,3].copy()
+        irc = guess[:,:,4].copy()
+        icc = guess[:,:,5].copy()
+
+        flags = numpy.zeros(nobs,dtype='i4') + EM_MAXITER
+        numiter = numpy.zeros(nobs,dtype='i4')
+        active = numpy.ones(nobs,dtype=bool)
+
+        T_last = (p*(irr+icc)).sum(axis=1)/p.sum(axis=1)
+
+        for itr in xrange(self.maxiter):
+            det = irr*icc - irc*irc
+            bad = active & ((det <= 0.0).any(axis=1) | (p <= 0.0).any(axis=1))
+            if bad.any():
+                flags[bad] = EM_RANGE_ERROR
+                active &= ~bad
+
+            w, = numpy.where(active)
+            if w.size == 0:
+                break
+
+            d = det[w]
+            wv = v[w,numpy.newaxis,:] - vcen[w,:,numpy.newaxis]
+            wu = u[w,numpy.newaxis,:] - ucen[w,:,numpy.newaxis]
+            chi2 = (icc[w,:,numpy.newaxis]*wv*wv
+                    - 2.0*irc[w,:,numpy.newaxis]*wv*wu
+                    + irr[w,:,numpy.newaxis]*wu*wu)/d[:,:,numpy.newaxis]
+
+            norm = p[w]*area[w,numpy.newaxis]/(2.0*numpy.pi*numpy.sqrt(d))
+            gvals = norm[:,:,numpy.newaxis]*numpy.exp(-0.5*chi2)
+
+            nsky = psky[w]/npix
+            igrat = images[w]/(gvals.sum(axis=1) + nsky[:,numpy.newaxis])
+            resp = gvals*igrat[:,numpy.newaxis,:]
+
+            psum = resp.sum(axis=2)
+            bad = (psum <= 0.0).any(axis=1)
+            psum[bad] = 1.0
+
+            wv = v[w,numpy.newaxis,:]
+            wu = u[w,numpy.newaxis,:]
+            new_vcen = (resp*wv).sum(axis=2)/psum
+            new_ucen = (resp*wu).sum(axis=2)/psum
+            wv = wv - new_vcen[:,:,numpy.newaxis]
+            wu = wu - new_ucen[:,:,numpy.newaxis]
+
+            p[w] = psum
+            psky[w] = nsky*igrat.sum(axis=1)
+            vcen[w] = new_vcen
+            ucen[w] = new_ucen
+            irr[w] = (resp*wv*wv).sum(axis=2)/psum
+            irc[w] = (resp*wv*wu).sum(axis=2)/psum
+            icc[w] = (resp*wu*wu).sum(axis=2)/psum
+
+            numiter[w] = itr+1
+
+            T = (p[w]*(irr[w]+icc[w])).sum(axis=1)/p[w].sum(axis=1)
+            conv = numpy.abs(T/T_last[w] - 1.0) < self.tol
+            T_last[w] = T
+
+            flags[w[bad]] = EM_RANGE_ERROR
+            flags[w[conv & ~bad]] = 0
+            active[w[conv | bad]] = False
+
+        pars = numpy.zeros((nobs,self.ngauss,6))
+        pars[:,:,0] = p
+        pars[:,:,1] = vcen
+        pars[:,:,2] = ucen
+        pars[:,:,3] = irr
+        pars[:,:,4] = irc
+        pars[:,:,5] = icc
+
+        return pars,flags,numiter
+
+class BatchEMPSFFit(object):
+    """
+    the result of the fit to a single psf image
+    """
+    def __init__(self, pars, flags, numiter):
+        self._pars = pars.ravel()
+        self._result = {'flags':flags,
+                        'numiter':numiter,
+                        'pars':self._pars}
+
+    def get_result(self):
+        return self._result
+
+    def get_gmix(self):
+        """
+        the fitted mixture, normalized as in ngmix EM so the fluxes sum to
+        one minus the sky fraction
+        """
+        return GMix(pars=self._pars)
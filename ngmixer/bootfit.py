@@ -2,13 +2,15 @@ from __future__ import print_function
 import time
 import numpy
 import os
+import weakref
+import collections
 import scipy.stats
 
 # local imports
 from .defaults import DEFVAL, PDEFVAL, NO_ATTEMPT, \
     PSF_FIT_FAILURE, GAL_FIT_FAILURE, \
     LOW_PSF_FLUX, PSF_FLUX_FIT_FAILURE, \
-    NBR_HAS_NO_PSF_FIT, METACAL_FAILURE
+    NBR_HAS_NO_PSF_FIT, METACAL_FAILURE, LOW_TRIAGE_S2N
 from .fitting import BaseFitter
 from .util import Namer, print_pars
 from .render_ngmix_nbrs import RenderNGmixNbrs
@@ -40,6 +42,20 @@ def get_bootstrapper(obs, type='boot', **keys):
 
     return boot
 
+class PSFFitFromData(object):
+    """
+    stands in for the fitter of a psf fit read from a previous run
+    """
+    def __init__(self, gmix):
+        self._gmix = gmix
+        self._result = {'flags':0}
+
+    def get_result(self):
+        return self._result
+
+    def get_gmix(self):
+        return self._gmix.copy()
+
 class NGMixBootFitter(BaseFitter):
     """
     Use an ngmix bootstrapper
@@ -82,9 +98,72 @@ class NGMixBootFitter(BaseFitter):
         # lensfit sens from samples or B&A PQR
         self['do_shear'] = self.get('do_shear',False)
 
+        # reuse the psf fits for each observation across fit models and
+        # MOF iterations; the psf images never change
+        self['cache_psf_fits'] = self.get('cache_psf_fits',True)
+
+        # keep the rendered nbrs images for each observation and only
+        # render them again when their fits change; the caches use at most
+        # nbrs_cache_max_bytes, dropping the least recently used ones, and
+        # the sum of the nbrs images is remade from scratch every
+        # nbrs_sum_refresh updates
+        self['cache_nbrs_images'] = self.get('cache_nbrs_images',False)
+        self['nbrs_cache_max_bytes'] = self.get('nbrs_cache_max_bytes',500*1024**2)
+        self['nbrs_sum_refresh'] = self.get('nbrs_sum_refresh',10)
+
+        # only render each nbr where it is above this fraction of the noise,
+        # so the nbrs subtracted pixels are within this fraction of the noise
+        # of the full render for each nbr; None renders the full stamp
+        self['nbrs_render_noise_frac'] = self.get('nbrs_render_noise_frac',None)
+
+        # run a cheap fit first and use its s2n to pick the models and
+        # ntry for the object
+        self._set_triage()
+
+        # fit em psf models to all of the psf images of an object at once
+        self['batch_psf_fits'] = self.get('batch_psf_fits',False)
+
+        # take the psf fits from the epoch_data of a previous run, e.g. the
+        # MOF run, refitting only epochs that are missing or flagged there
+        self['psf_fits_file'] = self.get('psf_fits_file',None)
+
+        # guess the pars of a model from another model already fit for the
+        # object, e.g. {'dev':'exp','cm':'exp'}
+        self['guess_chain'] = self.get('guess_chain',{})
+
+        # guess the pars from the model_fits of a previous run, matched by id
+        self['guess_fits_file'] = self.get('guess_fits_file',None)
+
     def _set_models(self):
         self['fit_models'] = self.get('fit_models',list(self['model_pars'].keys()))
 
+    def _set_triage(self):
+        """
+        triage:
+            model: 'gauss'   # cheap model to fit, or 'psf' for the psf flux
+            ntry: 1
+            levels:          # by increasing min_s2n
+                - {min_s2n: 5.0, fit_models: ['exp'], ntry: 1}
+                - {min_s2n: 20.0}
+
+        The object gets the last level whose min_s2n its s2n reaches.  A
+        level fits all of the fit_models with the max_pars ntry by default.
+        Objects below the first level only get psf fits.
+        """
+        triage = self.get('triage',None)
+        self['triage'] = triage
+        if triage is None:
+            return
+
+        triage['model'] = triage.get('model','gauss')
+        triage['ntry'] = triage.get('ntry',1)
+        for level in triage['levels']:
+            level['fit_models'] = level.get('fit_models',self['fit_models'])
+            level['ntry'] = level.get('ntry',None)
+            for model in level['fit_models']:
+                assert model in self['fit_models'],\
+                    "triage model %s is not in fit_models" % model
+
     def _get_namer(self, model, coadd):
         if coadd and (self['fit_me_galaxy'] or self['use_coadd_prefix']):
             n = Namer('coadd_%s' % model)
@@ -179,7 +258,7 @@ class NGMixBootFitter(BaseFitter):
 
         # FIXME - removed if, this might have sid effects?
         #if 'fit_data' not in mb_obs_list.meta:
-        mb_obs_list.update_meta_data({'fit_data':self._make_struct(coadd)})
+        mb_obs_list.update_meta_data({'fit_data':self._get_struct_template(coadd).copy()})
         self.data = mb_obs_list.meta['fit_data']
 
         if self['make_plots']:
@@ -188,16 +267,31 @@ class NGMixBootFitter(BaseFitter):
                 os.makedirs(self.plot_dir)
 
         fit_flags = 0
-        for model in self['fit_models']:
-            print('    fitting: %s' % model)
+        fit_models = self['fit_models']
+        self.triage_ntry = None
+        if self['triage'] is not None:
+            # the triage fit sees the same images as the model fits, with
+            # the nbrs subtracted and masked
+            triage_model = self['triage']['model']
+            if triage_model not in fit_models:
+                triage_model = fit_models[0]
+            self._prep_nbrs(triage_model,mb_obs_list,new_mb_obs_list,coadd,
+                            nbrs_fit_data,nbrs_meta_data)
+
+            level, boot = self._triage(new_mb_obs_list,coadd,nbrs_fit_data)
+            if level is not None:
+                if level < 0:
+                    fit_models = []
+                    fit_flags |= LOW_TRIAGE_S2N
+                else:
+                    fit_models = self['triage']['levels'][level]['fit_models']
+                    self.triage_ntry = self['triage']['levels'][level]['ntry']
 
-            if self['model_nbrs'] and nbrs_fit_data is not None:
-                # put back nbrs info if needed
-                if nbrs_meta_data is not None:
-                    self._restore_nbrs_meta_data(mb_obs_list,nbrs_meta_data,coadd=coadd)
+        for model in fit_models:
+            print('    fitting: %s' % model)
 
-                # render nbrs
-                self._render_nbrs(model,new_mb_obs_list,coadd,nbrs_fit_data)
+            self._prep_nbrs(model,mb_obs_list,new_mb_obs_list,coadd,
+                            nbrs_fit_data,nbrs_meta_data)
 
             model_flags, boot = self._guess_and_run_boot(model,
                                                          new_mb_obs_list,
@@ -215,6 +309,11 @@ class NGMixBootFitter(BaseFitter):
             else:
                 break
 
+        if len(fit_models) == 0:
+            # only the psfs were fit in the triage
+            self._fill_epoch_data(mb_obs_list,boot.mb_obs_list)
+            self._do_psf_stats(mb_obs_list,coadd)
+
         self._fill_nimage_used(mb_obs_list,boot.mb_obs_list,coadd)
 
         if self['model_nbrs']:
@@ -222,6 +321,78 @@ class NGMixBootFitter(BaseFitter):
 
         return fit_flags
 
+    def _prep_nbrs(self,model,mb_obs_list,new_mb_obs_list,coadd,nbrs_fit_data,nbrs_meta_data):
+        """
+        subtract the nbrs fit with model and mask the rest
+        """
+        if self['model_nbrs'] and nbrs_fit_data is not None:
+            # put back nbrs info if needed
+            if nbrs_meta_data is not None:
+                self._restore_nbrs_meta_data(mb_obs_list,nbrs_meta_data,coadd=coadd)
+
+            # render nbrs
+            self._render_nbrs(model,new_mb_obs_list,coadd,nbrs_fit_data)
+        elif self['model_nbrs']:
+            # no fits of the nbrs yet, but mask the ones which will
+            # never be fit with this object
+            self._mask_fixed_nbrs(new_mb_obs_list)
+
+    def _triage(self,new_mb_obs_list,coadd,nbrs_fit_data=None):
+        """
+        get the triage level of the object from the s2n of a cheap fit
+
+        in MOF nbrs passes the level is taken from the nbrs fit data, so
+        it is fixed by the first pass
+
+        returns the level, -1 if below all levels or None if the fits
+        failed, and the bootstrapper with the psf fits
+        """
+        triage = self['triage']
+
+        boot = self._get_bootstrapper(triage['model'],new_mb_obs_list)
+        self.boot = boot
+
+        n = self._get_namer('', coadd)
+
+        s2n = None
+        try:
+            self._fit_psfs(coadd)
+
+            if (nbrs_fit_data is not None
+                    and n('triage_level') in nbrs_fit_data.dtype.names):
+                ind = new_mb_obs_list.meta['cen_ind']
+                if nbrs_fit_data[n('triage_level')][ind] != DEFVAL:
+                    s2n = nbrs_fit_data[n('triage_s2n')][ind]
+            elif triage['model'] == 'psf':
+                if self._fit_psf_flux(coadd) == 0:
+                    s2n = numpy.nanmax(self.data[self._get_namer('psf', coadd)('flux_s2n')])
+            else:
+                prior = self['model_pars'].get(triage['model'],{}).get('prior',None)
+                boot.fit_max(triage['model'],
+                             self['max_pars'],
+                             prior=prior,
+                             ntry=triage['ntry'])
+                res = boot.get_max_fitter().get_result()
+                if res['flags'] == 0:
+                    s2n = res['s2n_w']
+
+        except (BootPSFFailure,BootGalFailure,GMixRangeError) as err:
+            print("    triage fit failed: %s" % str(err))
+
+        if s2n is None:
+            return None, boot
+
+        level = -1
+        for i,lev in enumerate(triage['levels']):
+            if s2n >= lev['min_s2n']:
+                level = i
+
+        print('    triage s2n: %g level: %d' % (s2n,level))
+        self.data[n('triage_level')][0] = level
+        self.data[n('triage_s2n')][0] = s2n
+
+        return level, boot
+
     def _guess_and_run_boot(self,model,new_mb_obs_list,coadd,nbrs_fit_data=None):
         n=self._get_namer(model, coadd)
 
@@ -240,51 +411,29 @@ class NGMixBootFitter(BaseFitter):
             if (nbrs_fit_data[n('flags')][ind] == 0
                 and nbrs_fit_data['flags'][ind] == 0):
 
-                guess = nbrs_fit_data[n('pars')][ind]
-
-                # lots of pain to get good guesses...
-                # the ngmix ParsGuesser does this
-                #    for pars 0 through 3 inclusive - uniform between -width to +width
-                #    for pars 4 through the end - guess = pars*(1+width*uniform(low=-1,high=1))
-                # thus for pars 4 through the end, I divide the error by the pars so that guess is
-                #  between 1-frac_err to 1+frac_err where frac_err = err/pars
-                # I also scale the errors by scale
-                scale = 0.5
-
-                # get the errors (cov in this case)
-                guess_errs = numpy.diag(nbrs_fit_data[n('max_pars_cov')][ind]).copy()
+                guess,guess_errs,guess_TdbyTe = self._get_guess_from_fit_data(model,n,nbrs_fit_data,ind)
 
-                #if less than zero, set to zero
-                w, = numpy.where(guess_errs < 0.0)
-                if w.size > 0:
-                    guess_errs[w[:]] = 0.0
+        # then a previous run of this model
+        if guess is None and self['guess_fits_file'] is not None:
+            guess_fits,guess_index = self._get_guess_fits()
+            ind = guess_index.get(new_mb_obs_list.meta['id'],-1)
 
-                # take sqrt
-                guess_errs = numpy.sqrt(guess_errs)*scale
+            if (ind >= 0
+                and n('pars') in guess_fits.dtype.names
+                and guess_fits[n('flags')][ind] == 0
+                and guess_fits['flags'][ind] == 0):
 
-                # get pars to scale by
-                # don't divide by zero! - if zero set to 0.1 (default val in ngmix)
-                w, = numpy.where(guess == 0.0)
-                guess_scale = guess.copy()
-                if w.size > 0:
-                    guess_scale[w] = 0.1
-                w = numpy.arange(4,guess.size,1)
+                print('    guessing from previous fit')
+                guess,guess_errs,guess_TdbyTe = self._get_guess_from_fit_data(model,n,guess_fits,ind)
 
-                # final equation - need sqrt then apply scale and then divide by pars
-                guess_errs[w[:]] = guess_errs[w]/numpy.abs(guess_scale[w])
+        # then a model already fit for this object
+        if guess is None and model in self['guess_chain']:
+            from_model = self['guess_chain'][model]
+            fn = self._get_namer(from_model, coadd)
 
-                # don't guess to wide for the shear
-                if guess_errs[2] > 0.1:
-                    guess_errs[2] = 0.1
-
-                if guess_errs[3] > 0.1:
-                    guess_errs[3] = 0.1
-
-                print_pars(guess,front='    guess pars:  ')
-                print_pars(guess_errs,front='    guess errs:  ')
-
-                if model == 'cm':
-                    guess_TdbyTe = nbrs_fit_data[n('TdByTe')][ind]
+            if from_model in self['fit_models'] and self.data[fn('flags')][0] == 0:
+                print('    guessing from %s' % from_model)
+                guess,guess_errs,guess_TdbyTe = self._get_guess_from_fit_data(from_model,fn,self.data,0)
 
         if model == 'cm':
             return self._run_boot(model,new_mb_obs_list,coadd,
@@ -296,6 +445,79 @@ class NGMixBootFitter(BaseFitter):
                                   guess=guess,
                                   guess_widths=guess_errs)
 
+    def _get_guess_from_fit_data(self,model,n,fit_data,ind):
+        """
+        get a guess and its widths from a row of fit data for model
+        """
+        guess = fit_data[n('pars')][ind].copy()
+        guess_errs = self._get_guess_widths(guess,fit_data[n('max_pars_cov')][ind])
+
+        print_pars(guess,front='    guess pars:  ')
+        print_pars(guess_errs,front='    guess errs:  ')
+
+        guess_TdbyTe = 1.0
+        if model == 'cm':
+            guess_TdbyTe = fit_data[n('TdByTe')][ind]
+
+        return guess,guess_errs,guess_TdbyTe
+
+    def _get_guess_widths(self,guess,pars_cov):
+        """
+        get the widths for a guess from the cov of the fit it came from
+        """
+        # lots of pain to get good guesses...
+        # the ngmix ParsGuesser does this
+        #    for pars 0 through 3 inclusive - uniform between -width to +width
+        #    for pars 4 through the end - guess = pars*(1+width*uniform(low=-1,high=1))
+        # thus for pars 4 through the end, I divide the error by the pars so that guess is
+        #  between 1-frac_err to 1+frac_err where frac_err = err/pars
+        # I also scale the errors by scale
+        scale = 0.5
+
+        # get the errors (cov in this case)
+        guess_errs = numpy.diag(pars_cov).copy()
+
+        #if less than zero, set to zero
+        w, = numpy.where(guess_errs < 0.0)
+        if w.size > 0:
+            guess_errs[w[:]] = 0.0
+
+        # take sqrt
+        guess_errs = numpy.sqrt(guess_errs)*scale
+
+        # get pars to scale by
+        # don't divide by zero! - if zero set to 0.1 (default val in ngmix)
+        w, = numpy.where(guess == 0.0)
+        guess_scale = guess.copy()
+        if w.size > 0:
+            guess_scale[w] = 0.1
+        w = numpy.arange(4,guess.size,1)
+
+        # final equation - need sqrt then apply scale and then divide by pars
+        guess_errs[w[:]] = guess_errs[w]/numpy.abs(guess_scale[w])
+
+        # don't guess to wide for the shear
+        if guess_errs[2] > 0.1:
+            guess_errs[2] = 0.1
+
+        if guess_errs[3] > 0.1:
+            guess_errs[3] = 0.1
+
+        return guess_errs
+
+    def _get_guess_fits(self):
+        """
+        read the model fits of a previous run to guess from, with an index
+        from id to row
+        """
+        if not hasattr(self,'_guess_fits'):
+            import fitsio
+            print('reading guesses from: %s' % self['guess_fits_file'])
+            self._guess_fits = fitsio.read(self['guess_fits_file'],ext='model_fits')
+            self._guess_index = dict((id,i) for i,id in enumerate(self._guess_fits['id'].tolist()))
+
+        return self._guess_fits,self._guess_index
+
     def _fill_nbrs_data(self,mb_obs_list):
         nd = len(mb_obs_list.meta['nbrs_ids'])
 
@@ -307,7 +529,7 @@ class NGMixBootFitter(BaseFitter):
             for obs in obs_list:
                 # if we use this obs, grab nbrs
                 if obs.meta['flags'] == 0:
-                    od = self.get_default_nbrs_data(nd+1)
+                    od = numpy.repeat(self._get_nbrs_template(),nd+1)
 
                     # do nbrs
                     for i in xrange(nd):
@@ -351,6 +573,58 @@ class NGMixBootFitter(BaseFitter):
                     # add to metadata
                     obs.update_meta_data({'nbrs_data':od})
 
+    def _get_nbrs_meta_index(self,nbrs_meta_data):
+        """
+        index the nbrs meta data by (id,nbr_id,band_num,cutout_index)
+
+        the index is built once per nbrs_meta_data table, keys found in
+        more than one row map to -1
+        """
+        if getattr(self,'_nbrs_meta_data',None) is not nbrs_meta_data:
+            index = {}
+            keys = zip(nbrs_meta_data['id'].tolist(),
+                       nbrs_meta_data['nbr_id'].tolist(),
+                       nbrs_meta_data['band_num'].tolist(),
+                       nbrs_meta_data['cutout_index'].tolist())
+            for row,key in enumerate(keys):
+                if key in index:
+                    index[key] = -1
+                else:
+                    index[key] = row
+
+            self._nbrs_meta_data = nbrs_meta_data
+            self._nbrs_meta_index = index
+            self._nbrs_meta_rows = {}
+            self._nbrs_meta_rows_id = None
+
+        return self._nbrs_meta_index
+
+    def _get_nbrs_meta_row(self,nbrs_meta_data,row):
+        """
+        get the flags, jacobian and psf obs for a row of the nbrs meta data
+
+        the objects are cached since the same rows are restored for each
+        model of an object
+        """
+        if row not in self._nbrs_meta_rows:
+            flags = nbrs_meta_data['nbr_flags'][row]
+            if flags == 0:
+                jac = Jacobian(row=nbrs_meta_data['nbr_jac_row0'][row],
+                               col=nbrs_meta_data['nbr_jac_col0'][row],
+                               dudrow=nbrs_meta_data['nbr_jac_dudrow'][row],
+                               dudcol=nbrs_meta_data['nbr_jac_dudcol'][row],
+                               dvdrow=nbrs_meta_data['nbr_jac_dvdrow'][row],
+                               dvdcol=nbrs_meta_data['nbr_jac_dvdcol'][row])
+                psf_gmix = GMix(pars=nbrs_meta_data['nbr_psf_fit_pars'][row,:])
+                psf_obs = Observation(numpy.zeros((1,1)),gmix=psf_gmix)
+            else:
+                jac = None
+                psf_obs = Observation(numpy.zeros((1,1)))
+
+            self._nbrs_meta_rows[row] = (flags,jac,psf_obs)
+
+        return self._nbrs_meta_rows[row]
+
     def _restore_nbrs_meta_data(self,mb_obs_list,nbrs_meta_data,coadd=False):
         """
         restore the nbrs info - reverse of _fill_nbrs_data function
@@ -363,6 +637,13 @@ class NGMixBootFitter(BaseFitter):
 
         cen_id = mb_obs_list.meta['id']
 
+        index = self._get_nbrs_meta_index(nbrs_meta_data)
+
+        # only keep the cached rows of the current object
+        if self._nbrs_meta_rows_id != cen_id:
+            self._nbrs_meta_rows = {}
+            self._nbrs_meta_rows_id = cen_id
+
         for band,obs_list in enumerate(mb_obs_list):
             band_num = obs_list.meta['band_num']
 
@@ -372,29 +653,14 @@ class NGMixBootFitter(BaseFitter):
                 # if we use this obs, grab nbrs
                 if obs.meta['flags'] == 0:
                     # do central
-                    q, = numpy.where((nbrs_meta_data['id'] == cen_id) &
-                                     (nbrs_meta_data['nbr_id'] == cen_id) &
-                                     (nbrs_meta_data['band_num'] == band_num) &
-                                     (nbrs_meta_data['cutout_index'] == cutout_index))
+                    row = index.get((cen_id,cen_id,band_num,cutout_index),-1)
 
-                    if len(q) != 1:
+                    if row < 0:
                         raise ValueError('cen not found in nbrs_meta_data during restore!'\
                                              ' - cen_id = %d, band = %d, cutout_index = %d' \
                                              % (cen_id,band_num,cutout_index))
 
-                    cen_flags = nbrs_meta_data['nbr_flags'][q[0]]
-                    if cen_flags == 0:
-                        cen_jac = Jacobian(row=nbrs_meta_data['nbr_jac_row0'][q[0]],
-                                       col=nbrs_meta_data['nbr_jac_col0'][q[0]],
-                                       dudrow=nbrs_meta_data['nbr_jac_dudrow'][q[0]],
-                                       dudcol=nbrs_meta_data['nbr_jac_dudcol'][q[0]],
-                                       dvdrow=nbrs_meta_data['nbr_jac_dvdrow'][q[0]],
-                                       dvdcol=nbrs_meta_data['nbr_jac_dvdcol'][q[0]])
-                        cen_psf_gmix = GMix(pars=nbrs_meta_data['nbr_psf_fit_pars'][q[0],:])
-                        cen_psf_obs = Observation(numpy.zeros((1,1)),gmix=cen_psf_gmix)
-                    else:
-                        cen_psf_obs = Observation(numpy.zeros((1,1)))
-                        cen_jac = None
+                    cen_flags,cen_jac,cen_psf_obs = self._get_nbrs_meta_row(nbrs_meta_data,row)
 
                     obs.update_meta_data({'cen_flags':cen_flags,
                                           'cen_jac':cen_jac,
@@ -409,31 +675,17 @@ class NGMixBootFitter(BaseFitter):
                         nbrs_id = mb_obs_list.meta['nbrs_ids'][i]
 
                         # find the nbr
-                        q, = numpy.where((nbrs_meta_data['id'] == cen_id) &
-                                         (nbrs_meta_data['nbr_id'] == nbrs_id) &
-                                         (nbrs_meta_data['band_num'] == band_num) &
-                                         (nbrs_meta_data['cutout_index'] == cutout_index))
+                        row = index.get((cen_id,nbrs_id,band_num,cutout_index),-1)
 
-                        if len(q) != 1:
+                        if row < 0:
                             raise ValueError('more than one nbr or no nbr found in nbrs_meta_data during restore!'\
                                                  ' - cen_id = %d, nbrs_id = %d, band = %d, cutout_index = %d' \
                                                  % (cen_id,nbrs_id,band_num,cutout_index))
 
-                        nbrs_flags.append(nbrs_meta_data['nbr_flags'][q[0]])
-                        if nbrs_meta_data['nbr_flags'][q[0]] == 0:
-                            jac = Jacobian(row=nbrs_meta_data['nbr_jac_row0'][q[0]],
-                                           col=nbrs_meta_data['nbr_jac_col0'][q[0]],
-                                           dudrow=nbrs_meta_data['nbr_jac_dudrow'][q[0]],
-                                           dudcol=nbrs_meta_data['nbr_jac_dudcol'][q[0]],
-                                           dvdrow=nbrs_meta_data['nbr_jac_dvdrow'][q[0]],
-                                           dvdcol=nbrs_meta_data['nbr_jac_dvdcol'][q[0]])
-                            nbrs_jacs.append(jac)
-                            psf_gmix = GMix(pars=nbrs_meta_data['nbr_psf_fit_pars'][q[0],:])
-                            psf_obs = Observation(numpy.zeros((1,1)),gmix=psf_gmix)
-                            nbrs_psfs.append(psf_obs)
-                        else:
-                            nbrs_psfs.append(Observation(numpy.zeros((1,1))))
-                            nbrs_jacs.append(None)
+                        flags,jac,psf_obs = self._get_nbrs_meta_row(nbrs_meta_data,row)
+                        nbrs_flags.append(flags)
+                        nbrs_jacs.append(jac)
+                        nbrs_psfs.append(psf_obs)
 
                     obs.update_meta_data({'nbrs_jacs':nbrs_jacs,
                                           'nbrs_psfs':nbrs_psfs,
@@ -447,6 +699,7 @@ class NGMixBootFitter(BaseFitter):
         print('    rendering nbrs')
 
         if len(mb_obs_list.meta['nbrs_inds']) == 0:
+            self._mask_fixed_nbrs(mb_obs_list)
             return
 
         n=self._get_namer(model, coadd)
@@ -502,6 +755,15 @@ class NGMixBootFitter(BaseFitter):
                         nbrs_psf_gmixes.append(None)
                 nbrs_jacs = obs.meta['nbrs_jacs']
 
+                render_cache = None
+                if self['cache_nbrs_images']:
+                    render_cache = self._get_nbrs_render_cache(obs,pars_tag,len(nbrs_inds))
+
+                # the per nbr images are only needed for the cache and the
+                # intrinsic profile variance, otherwise render them all in
+                # one pass
+                total = render_cache is None and self['intr_prof_var_fac'] == 0.0
+
                 # call the nbrs code
                 cenim, nbrs_imgs, nbrs_masks = RenderNGmixNbrs._render_nbrs(model, band,
                                                                             obs.image.shape,
@@ -511,7 +773,11 @@ class NGMixBootFitter(BaseFitter):
                                                                             pars_tag, fit_flags_tag, nbrs_fit_data,
                                                                             unmodeled_nbrs_masking_type=self['unmodeled_nbrs_masking_type'],
                                                                             verbose=True,
-                                                                            fracdev_tag=fracdev_tag,TdByTe_tag=TdByTe_tag)
+                                                                            fracdev_tag=fracdev_tag,TdByTe_tag=TdByTe_tag,
+                                                                            cache=None if render_cache is None else render_cache['imgs'],
+                                                                            total=total,
+                                                                            render_tol=self._get_nbrs_render_tol(obs),
+                                                                            fixed_nbrs_numbers=mb_obs_list.meta.get('fixed_nbrs_numbers',None))
 
                 # do central
                 if cenim is not None:
@@ -526,12 +792,19 @@ class NGMixBootFitter(BaseFitter):
                         varim += self['intr_prof_var_fac']*cenim*cenim
 
                 # now do nbrs
-                nbrsim = numpy.zeros_like(cenim)
-                for curr_nbrsim in nbrs_imgs:
-                    if curr_nbrsim is not None:
-                        nbrsim += curr_nbrsim
+                if total:
+                    nbrsim = nbrs_imgs
+                elif render_cache is not None:
+                    nbrsim = self._update_nbrs_sum(render_cache,nbrs_imgs,cenim)
+                else:
+                    nbrsim = numpy.zeros_like(cenim)
+                    for curr_nbrsim in nbrs_imgs:
+                        if curr_nbrsim is not None:
+                            nbrsim += curr_nbrsim
 
-                        if self['intr_prof_var_fac'] > 0.0:
+                if self['intr_prof_var_fac'] > 0.0:
+                    for curr_nbrsim in nbrs_imgs:
+                        if curr_nbrsim is not None:
                             varim += self['intr_prof_var_fac']*curr_nbrsim*curr_nbrsim
 
                 masked_pix = numpy.zeros_like(cenim)
@@ -556,9 +829,9 @@ class NGMixBootFitter(BaseFitter):
                 else:
                     assert False,'nbrs model method %s not implemented!' % self['model_nbrs_method']
 
-                # mask unmodeled nbrs
-                new_weight = obs.weight_orig.copy()
-                new_weight *= masked_pix
+                # mask unmodeled nbrs, working in a buffer kept with the obs
+                new_weight = self._get_weight_scratch(obs)
+                numpy.multiply(obs.weight_orig,masked_pix,out=new_weight)
 
                 if self['intr_prof_var_fac'] > 0.0:
                     qnz = numpy.where(new_weight != 0.0)
@@ -570,6 +843,150 @@ class NGMixBootFitter(BaseFitter):
                 if self['make_plots']:
                     self._plot_nbrs_model(band,model,obs,nbrsim,cenim,coadd)
 
+    def _mask_fixed_nbrs(self,mb_obs_list):
+        """
+        mask the nbrs cut from the fof of the object with the seg map
+
+        these nbrs are never fit with the object, so they are masked even
+        when there are no nbrs to render
+        """
+        fixed_nbrs_numbers = mb_obs_list.meta.get('fixed_nbrs_numbers',[])
+        if len(fixed_nbrs_numbers) == 0:
+            return
+
+        for obs_list in mb_obs_list:
+            for obs in obs_list:
+                if obs.meta['flags'] != 0:
+                    continue
+
+                masked_pix = numpy.ones(obs.weight_orig.shape)
+                for nbr_number in fixed_nbrs_numbers:
+                    RenderNGmixNbrs._mask_nbr_seg(obs.seg,
+                                                  nbr_number,
+                                                  masked_pix,
+                                                  unmodeled_nbrs_masking_type=self['unmodeled_nbrs_masking_type'])
+
+                new_weight = self._get_weight_scratch(obs)
+                numpy.multiply(obs.weight_orig,masked_pix,out=new_weight)
+                obs.weight = new_weight
+
+    def _get_nbrs_render_tol(self,obs):
+        """
+        get the render tolerance for the nbrs of the obs, nbrs_render_noise_frac
+        times the noise from the median of the original weight map
+
+        it is kept with the obs since the weight_orig does not change
+        """
+        if self['nbrs_render_noise_frac'] is None:
+            return None
+
+        render_tol = getattr(obs,'nbrs_render_tol',None)
+        if render_tol is None:
+            wt = obs.weight_orig
+            w = numpy.where(wt > 0)
+            if w[0].size == 0:
+                return None
+
+            noise = 1.0/numpy.sqrt(numpy.median(wt[w]))
+            render_tol = self['nbrs_render_noise_frac']*noise
+            obs.nbrs_render_tol = render_tol
+
+        return render_tol
+
+    def _get_weight_scratch(self,obs):
+        """
+        get a buffer for the nbrs masked weight map of the obs
+
+        it is reused for every rendering of the nbrs, unless it is the
+        weight_orig itself
+        """
+        scratch = getattr(obs,'weight_scratch',None)
+        if (scratch is None
+                or scratch.shape != obs.weight_orig.shape
+                or scratch is obs.weight_orig):
+            scratch = numpy.zeros(obs.weight_orig.shape,dtype='f8')
+            obs.weight_scratch = scratch
+        return scratch
+
+    def _get_nbrs_render_cache(self,obs,pars_tag,nnbrs):
+        """
+        get the cache of rendered nbrs images of the obs for pars_tag
+
+        The caches of all observations are kept under nbrs_cache_max_bytes
+        by dropping the least recently used ones. None is returned if the
+        cache would not fit by itself.
+        """
+        # one image for the central, each nbr and the sum
+        nbytes = (nnbrs+2)*obs.image.nbytes
+        if nbytes > self['nbrs_cache_max_bytes']:
+            return None
+
+        lru = getattr(self,'_nbrs_cache_lru',None)
+        if lru is None:
+            lru = collections.OrderedDict()
+            self._nbrs_cache_lru = lru
+            self._nbrs_cache_nbytes = 0
+
+        key = (id(obs),pars_tag)
+        if key in lru:
+            ref,old_nbytes = lru.pop(key)
+            self._nbrs_cache_nbytes -= old_nbytes
+            if ref() is not obs:
+                # a new obs with the id of a deleted one
+                ref = weakref.ref(obs)
+        else:
+            ref = weakref.ref(obs)
+
+        # make room, oldest first
+        while len(lru) > 0 and self._nbrs_cache_nbytes + nbytes > self['nbrs_cache_max_bytes']:
+            (old_id,old_pars_tag),(old_ref,old_nbytes) = lru.popitem(last=False)
+            self._nbrs_cache_nbytes -= old_nbytes
+            old_obs = old_ref()
+            if old_obs is not None:
+                old_obs.meta.get('nbrs_render_cache',{}).pop(old_pars_tag,None)
+
+        lru[key] = (ref,nbytes)
+        self._nbrs_cache_nbytes += nbytes
+
+        if 'nbrs_render_cache' not in obs.meta:
+            obs.update_meta_data({'nbrs_render_cache':{}})
+        caches = obs.meta['nbrs_render_cache']
+        if pars_tag not in caches:
+            caches[pars_tag] = {'imgs':{},'nbrs_imgs':None,'nbrsim':None,'nupdate':0}
+        return caches[pars_tag]
+
+    def _update_nbrs_sum(self,render_cache,nbrs_imgs,cenim):
+        """
+        update the sum of the nbrs images kept in render_cache
+
+        Only the images that are not the same arrays as in the last call
+        are subtracted and added. The sum is made from scratch every
+        nbrs_sum_refresh updates so round off does not build up.
+        """
+        old_imgs = render_cache['nbrs_imgs']
+        nbrsim = render_cache['nbrsim']
+        render_cache['nupdate'] += 1
+        if (nbrsim is None
+                or len(old_imgs) != len(nbrs_imgs)
+                or render_cache['nupdate'] >= self['nbrs_sum_refresh']):
+            nbrsim = numpy.zeros_like(cenim)
+            old_imgs = [None]*len(nbrs_imgs)
+            render_cache['nupdate'] = 0
+
+        for old_img,curr_nbrsim in zip(old_imgs,nbrs_imgs):
+            if curr_nbrsim is old_img:
+                continue
+
+            if old_img is not None:
+                nbrsim -= old_img
+            if curr_nbrsim is not None:
+                nbrsim += curr_nbrsim
+
+        render_cache['nbrs_imgs'] = list(nbrs_imgs)
+        render_cache['nbrsim'] = nbrsim
+
+        return nbrsim
+
     def _plot_nbrs_model(self,band,model,obs,nbrsim,cenim,coadd):
         """
         plot nbrs model
@@ -674,7 +1091,7 @@ class NGMixBootFitter(BaseFitter):
 
                 if obs.meta['flags'] != 0:
                     obs.update_meta_data({'fit_flags':obs.meta['flags']})
-                    ed = self._make_epoch_struct()
+                    ed = self._get_epoch_struct_template().copy()
                     ed['psf_fit_flags'] = obs.meta['flags']
                     obs.update_meta_data({'fit_data':ed})
                     continue
@@ -682,7 +1099,7 @@ class NGMixBootFitter(BaseFitter):
                 if obs.meta['flags'] == 0 and obs.has_psf():
                     psf_obs = obs.get_psf()
 
-                    ed = self._make_epoch_struct()
+                    ed = self._get_epoch_struct_template().copy()
                     ed['npix'] = obs.image.size
                     ed['wsum'] = obs.weight.sum()
                     ed['wmax'] = obs.weight.max()
@@ -879,13 +1296,43 @@ class NGMixBootFitter(BaseFitter):
 
         min_s2n = self.get('min_psf_model_s2n',None)
 
-        boot.fit_psfs(psf_pars['model'],
-                      None,
-                      Tguess_key='Tguess',
-                      ntry=psf_pars['ntry'],
-                      fit_pars=fit_pars,
-                      norm_key='psf_norm',
-                      min_s2n=min_s2n)
+        if self['cache_psf_fits'] and self._restore_psf_fits(boot):
+            print('        using cached PSF fits')
+        else:
+            mb_obs_list = boot.mb_obs_list
+
+            if self['psf_fits_file'] is not None:
+                nfit = self._set_psf_fits_from_file(boot)
+            else:
+                nfit = None
+
+            if nfit == 0:
+                print('        using PSF fits from %s' % self['psf_fits_file'])
+            elif nfit is not None:
+                # only fit the psfs without a gmix from the file
+                boot.fit_psfs(psf_pars['model'],
+                              None,
+                              Tguess_key='Tguess',
+                              ntry=psf_pars['ntry'],
+                              fit_pars=fit_pars,
+                              skip_already_done=True,
+                              norm_key='psf_norm',
+                              min_s2n=min_s2n)
+            elif (self['batch_psf_fits']
+                    and psf_pars['model'][0:2] == 'em'
+                    and min_s2n is None):
+                self._batch_fit_psfs(boot, psf_pars, fit_pars)
+            else:
+                boot.fit_psfs(psf_pars['model'],
+                              None,
+                              Tguess_key='Tguess',
+                              ntry=psf_pars['ntry'],
+                              fit_pars=fit_pars,
+                              norm_key='psf_norm',
+                              min_s2n=min_s2n)
+
+            if self['cache_psf_fits']:
+                self._cache_psf_fits(mb_obs_list, boot.mb_obs_list)
 
         # check for no obs in a band if PSF fit fails
         for band,obs_list in enumerate(boot.mb_obs_list):
@@ -895,6 +1342,167 @@ class NGMixBootFitter(BaseFitter):
         if self['make_plots']:
             self._do_psf_plots(boot, coadd)
 
+    def _set_psf_fits_from_file(self, boot):
+        """
+        set the psf gmix of each of the bootstrapper's observations from
+        the epoch_data in psf_fits_file
+
+        returns the number of observations that are missing or flagged in
+        the file, which still need to be fit.  If there are none, then
+        boot.mb_obs_list is replaced as after boot.fit_psfs
+        """
+        epoch_data,index = self._get_psf_fits()
+
+        obj_id = boot.mb_obs_list.meta['id']
+
+        nfit = 0
+        for obs_list in boot.mb_obs_list:
+            band_num = obs_list.meta['band_num']
+            for obs in obs_list:
+                row = index.get((obj_id,band_num,obs.meta['cutout_index']),-1)
+
+                if row < 0 or epoch_data['psf_fit_flags'][row] != 0:
+                    nfit += 1
+                    continue
+
+                psf_obs = obs.get_psf()
+                gmix = GMix(pars=epoch_data['psf_fit_pars'][row])
+                psf_obs.set_gmix(gmix)
+                psf_obs.update_meta_data({'fitter':PSFFitFromData(gmix)})
+
+        if nfit == 0:
+            new_mb_obs_list = MultiBandObsList()
+            for obs_list in boot.mb_obs_list:
+                new_obs_list = ObsList()
+                for obs in obs_list:
+                    new_obs_list.append(obs)
+                new_mb_obs_list.append(new_obs_list)
+            new_mb_obs_list.update_meta_data(boot.mb_obs_list.meta)
+
+            boot.mb_obs_list = new_mb_obs_list
+
+        return nfit
+
+    def _get_psf_fits(self):
+        """
+        read the epoch_data of psf_fits_file, with an index from
+        (id,band_num,cutout_index) to row
+        """
+        if not hasattr(self,'_psf_fits'):
+            import fitsio
+            print('reading PSF fits from: %s' % self['psf_fits_file'])
+            epoch_data = fitsio.read(self['psf_fits_file'],ext='epoch_data')
+
+            npars = epoch_data['psf_fit_pars'].shape[1]
+            if npars != self.get_num_pars_psf():
+                raise ValueError("psf fits in %s have %d pars but the psf "
+                                 "model %s has %d" % (self['psf_fits_file'],npars,
+                                                      self['psf_pars']['model'],
+                                                      self.get_num_pars_psf()))
+
+            keys = zip(epoch_data['id'].tolist(),
+                       epoch_data['band_num'].tolist(),
+                       epoch_data['cutout_index'].tolist())
+            self._psf_fits = epoch_data
+            self._psf_fits_index = dict((key,i) for i,key in enumerate(keys))
+
+        return self._psf_fits,self._psf_fits_index
+
+    def _batch_fit_psfs(self, boot, psf_pars, fit_pars):
+        """
+        fit the em psf model to the psf images of all of the bootstrapper's
+        observations at once
+
+        like boot.fit_psfs, observations with failed psf fits are removed
+        from boot.mb_obs_list
+        """
+        from .batchpsf import BatchEMPSFFitter
+
+        if fit_pars is None:
+            fit_pars = {}
+
+        fitter = BatchEMPSFFitter(int(psf_pars['model'][2:]),
+                                  maxiter=fit_pars.get('maxiter',5000),
+                                  tol=fit_pars.get('tol',1.0e-6),
+                                  ntry=psf_pars['ntry'],
+                                  Tguess_key='Tguess')
+
+        psf_obs_list = [obs.get_psf() for obs_list in boot.mb_obs_list for obs in obs_list]
+        fitters = fitter.go(psf_obs_list)
+
+        new_mb_obs_list = MultiBandObsList()
+        i = 0
+        for obs_list in boot.mb_obs_list:
+            new_obs_list = ObsList()
+            for obs in obs_list:
+                psf_obs = obs.get_psf()
+                psf_obs.update_meta_data({'fitter':fitters[i]})
+
+                if fitters[i].get_result()['flags'] == 0:
+                    gmix = fitters[i].get_gmix()
+                    if 'psf_norm' in psf_obs.meta:
+                        gmix.set_psum(psf_obs.meta['psf_norm'])
+                    psf_obs.set_gmix(gmix)
+                    new_obs_list.append(obs)
+
+                i += 1
+            new_mb_obs_list.append(new_obs_list)
+        new_mb_obs_list.update_meta_data(boot.mb_obs_list.meta)
+
+        boot.mb_obs_list = new_mb_obs_list
+
+    def _cache_psf_fits(self, mb_obs_list, new_mb_obs_list):
+        """
+        save the psf fit of each observation in its meta data
+
+        observations that are not in new_mb_obs_list had failed psf fits
+        """
+        model = self['psf_pars']['model']
+        for band,obs_list in enumerate(mb_obs_list):
+            for obs in obs_list:
+                psf_obs = obs.get_psf()
+                if obs in new_mb_obs_list[band] and psf_obs.has_gmix():
+                    gmix = psf_obs.get_gmix()
+                else:
+                    gmix = None
+
+                cache = {'model':model,
+                         'gmix':gmix,
+                         'fitter':psf_obs.meta.get('fitter',None)}
+                obs.update_meta_data({'psf_fit_cache':cache})
+
+    def _restore_psf_fits(self, boot):
+        """
+        restore the cached psf fits for all of the bootstrapper's
+        observations
+
+        returns False without changing anything if any observation has no
+        cached fit
+        """
+        model = self['psf_pars']['model']
+        for obs_list in boot.mb_obs_list:
+            for obs in obs_list:
+                cache = obs.meta.get('psf_fit_cache',None)
+                if cache is None or cache['model'] != model:
+                    return False
+
+        new_mb_obs_list = MultiBandObsList()
+        for obs_list in boot.mb_obs_list:
+            new_obs_list = ObsList()
+            for obs in obs_list:
+                cache = obs.meta['psf_fit_cache']
+                if cache['gmix'] is not None:
+                    psf_obs = obs.get_psf()
+                    psf_obs.set_gmix(cache['gmix'])
+                    if cache['fitter'] is not None:
+                        psf_obs.update_meta_data({'fitter':cache['fitter']})
+                    new_obs_list.append(obs)
+            new_mb_obs_list.append(new_obs_list)
+        new_mb_obs_list.update_meta_data(boot.mb_obs_list.meta)
+
+        boot.mb_obs_list = new_mb_obs_list
+        return True
+
     def _do_psf_plots(self, boot, coadd):
         if (('made_psf_plots' not in self.mb_obs_list.meta) or
                  ('made_psf_plots' in self.mb_obs_list.meta and
@@ -1213,6 +1821,10 @@ class NGMixBootFitter(BaseFitter):
                (n('psfrec_T'),'f8'),
                (n('psfrec_g'),'f8', 2)]
 
+        if self.get('triage',None) is not None:
+            dt += [(n('triage_level'),'i4'),
+                   (n('triage_s2n'),'f8')]
+
         if nband==1:
             fcov_shape=(nband,)
         else:
@@ -1277,6 +1889,10 @@ class NGMixBootFitter(BaseFitter):
         data[n('psfrec_T')] = DEFVAL
         data[n('psfrec_g')] = DEFVAL
 
+        if self['triage'] is not None:
+            data[n('triage_level')] = DEFVAL
+            data[n('triage_s2n')] = DEFVAL
+
         fname, Tname=self._get_lnames()
 
         models=self._get_all_models(coadd)
@@ -1349,6 +1965,15 @@ class NGMixBootFitter(BaseFitter):
 
         return dt
 
+    def _get_nbrs_template(self):
+        """
+        a default row of nbrs data, made once
+        """
+        if getattr(self,'_nbrs_template',None) is None:
+            self._nbrs_template = self.get_default_nbrs_data()
+
+        return self._nbrs_template
+
     def get_default_nbrs_data(self,n=1):
         dt = self.get_nbrs_data_dtype()
         d = numpy.zeros(n,dtype=dt)
@@ -1360,6 +1985,33 @@ class NGMixBootFitter(BaseFitter):
         return d
 
 class MaxNGMixBootFitter(NGMixBootFitter):
+    def _setup(self):
+        super(MaxNGMixBootFitter,self)._setup()
+
+        # retry the max like fits only when they fail
+        #
+        #   adaptive_ntry:
+        #       max_ntry: 8
+        #
+        # The first fit uses one try, and the tries are doubled after each
+        # failure, up to max_ntry tries in total.  A fit that converges
+        # with a bad covariance matrix counts as a failure.
+        adaptive_ntry = self.get('adaptive_ntry',None)
+        if adaptive_ntry is not None:
+            adaptive_ntry['max_ntry'] = adaptive_ntry.get('max_ntry',4*self['max_pars']['ntry'])
+        self['adaptive_ntry'] = adaptive_ntry
+
+    def _get_max_ntry(self):
+        """
+        the most tries for a fit, from the triage level if it sets one
+        """
+        if getattr(self,'triage_ntry',None) is not None:
+            return self.triage_ntry
+        elif self['adaptive_ntry'] is not None:
+            return self['adaptive_ntry']['max_ntry']
+        else:
+            return self['max_pars']['ntry']
+
     def _fit_max(self, model, guess=None, boot=None, **kwargs):
         """
         do a maximum likelihood fit
@@ -1373,33 +2025,91 @@ class MaxNGMixBootFitter(NGMixBootFitter):
         max_pars=self['max_pars']
         prior=self['model_pars'][model]['prior']
 
-        guess_widths = kwargs.get('guess_widths',None)
+        ntry=self._get_max_ntry()
+
+        fit_kw={'prior':prior,
+                'guess':guess,
+                'guess_widths':kwargs.get('guess_widths',None)}
 
         # now with prior
         if model == 'cm' and 'guess_TdbyTe' in kwargs:
-            boot.fit_max(model,
-                         max_pars,
-                         prior=prior,
-                         ntry=max_pars['ntry'],
-                         guess=guess,
-                         guess_TdbyTe=kwargs['guess_TdbyTe'],
-                         guess_widths=guess_widths)
+            fit_kw['guess_TdbyTe']=kwargs['guess_TdbyTe']
+
+        self.max_ntry_used=0
+        if self['adaptive_ntry'] is not None:
+            self._fit_max_adaptive(model, boot, ntry, **fit_kw)
         else:
+            self.max_ntry_used=ntry
             boot.fit_max(model,
                          max_pars,
-                         prior=prior,
-                         ntry=max_pars['ntry'],
-                         guess=guess,
-                         guess_widths=guess_widths)
+                         ntry=ntry,
+                         **fit_kw)
 
+            res=boot.get_max_fitter().get_result()
+            self.max_ntry_used=res.get('ntry',ntry)
 
         if self['replace_cov']:
             print("        replacing cov")
             cov_pars=self['cov_pars']
             boot.try_replace_cov(cov_pars)
 
+    def _fit_max_adaptive(self, model, boot, max_ntry, **kwargs):
+        """
+        fit with one try, doubling the tries after each failure until a fit
+        has a good covariance matrix or max_ntry tries are used
+
+        the last fit raises the failure as usual
+        """
+
+        ntry=1
+        while True:
+            ntry=min(ntry, max_ntry-self.max_ntry_used)
+
+            if self.max_ntry_used + ntry >= max_ntry:
+                self.max_ntry_used += ntry
+                boot.fit_max(model, self['max_pars'], ntry=ntry, **kwargs)
+                return
+
+            try:
+                boot.fit_max(model, self['max_pars'], ntry=ntry, **kwargs)
+            except (BootGalFailure,GMixRangeError) as err:
+                print("        max fit failed with ntry %d: %s" % (ntry,err))
+                self.max_ntry_used += ntry
+                ntry *= 2
+                continue
+
+            res=boot.get_max_fitter().get_result()
+            self.max_ntry_used += res.get('ntry',ntry)
+            if self._max_fit_ok(res):
+                return
+
+            print("        max fit has a bad cov with ntry %d" % ntry)
+            ntry *= 2
+
+    def _max_fit_ok(self, res):
+        """
+        the fit converged and the covariance matrix is finite with positive
+        variances
+        """
+        if res['flags'] != 0 or 'pars_cov' not in res:
+            return False
+
+        pars_cov=res['pars_cov']
+        return (numpy.all(numpy.isfinite(pars_cov))
+                and numpy.all(numpy.diag(pars_cov) > 0))
+
+    def _set_max_ntry(self, model, coadd):
+        if self['adaptive_ntry'] is None:
+            return
+
+        n=self._get_namer(model, coadd)
+        self.data[n('max_ntry')][0] = getattr(self,'max_ntry_used',0)
+
     def _fit_galaxy(self, model, coadd, guess=None, **kwargs):
-        self._fit_max(model,guess=guess,**kwargs)
+        try:
+            self._fit_max(model,guess=guess,**kwargs)
+        finally:
+            self._set_max_ntry(model,coadd)
 
         self.boot.set_round_s2n()
 
@@ -1411,6 +2121,26 @@ class MaxNGMixBootFitter(NGMixBootFitter):
                               model, coadd, 'max')
             self._plot_images(self.new_mb_obs_list.meta['id'], model, coadd)
 
+    def _get_fit_data_dtype(self,coadd):
+        dt=super(MaxNGMixBootFitter,self)._get_fit_data_dtype(coadd)
+
+        if self['adaptive_ntry'] is not None:
+            for model in self._get_all_models(coadd):
+                n=Namer(model)
+                dt += [(n('max_ntry'),'i4')]
+
+        return dt
+
+    def _make_struct(self,coadd):
+        d = super(MaxNGMixBootFitter,self)._make_struct(coadd)
+
+        if self['adaptive_ntry'] is not None:
+            for model in self._get_all_models(coadd):
+                n=Namer(model)
+                d[n('max_ntry')] = DEFVAL
+
+        return d
+
 class ISampNGMixBootFitter(MaxNGMixBootFitter):
     def _setup(self):
         super(ISampNGMixBootFitter,self)._setup()
@@ -1419,7 +2149,10 @@ class ISampNGMixBootFitter(MaxNGMixBootFitter):
         self['verbose'] = True
 
     def _fit_galaxy(self, model, coadd, guess=None, **kwargs):
-        self._fit_max(model,guess=guess)
+        try:
+            self._fit_max(model,guess=guess)
+        finally:
+            self._set_max_ntry(model,coadd)
         self._do_isample(model)
         self._add_shear_info(model)
 
@@ -1539,6 +2272,20 @@ class MetacalNGMixBootFitter(MaxNGMixBootFitter):
             print("setting separate metacal prior")
             set_priors(self['metacal_pars'])
 
+        # start the fits to the sheared images from the max like fit to the
+        # original images
+        #
+        #   metacal_guess_from_max: True
+        #
+        # This is off by default because the metacal pars then depend on
+        # the max like fit, so outputs made with and without it cannot be
+        # mixed in a shear catalog.  When on, the sheared fits start near
+        # their solutions and fewer of them need more than one try; when
+        # off, each sheared fit starts from the usual random guess, which
+        # costs roughly one extra try per sheared image for faint objects.
+        # The PSF fits are reused either way, see _get_metacal_psf_Tguess.
+        self['metacal_guess_from_max'] = self.get('metacal_guess_from_max',False)
+
     def _get_metacal_bootstrapper(self, model, mb_obs_list):
         """
         get the bootstrapper for fitting psf through galaxy
@@ -1612,10 +2359,16 @@ class MetacalNGMixBootFitter(MaxNGMixBootFitter):
         else:
             print("        not replacing masked pixels")
 
+        max_model = model
         metacal_pars, model, prior, psf_pars, psf_fit_pars = \
                 self._get_metacal_stuff(model)
         max_pars=self['max_pars']
-        Tguess=boot.mb_obs_list[0][0].psf.gmix.get_T()
+        Tguess=self._get_metacal_psf_Tguess(boot)
+
+        if self['metacal_guess_from_max'] and model == max_model:
+            guesser=self._get_metacal_guesser(boot)
+        else:
+            guesser=None
 
         # new bootstrapper for metacal
         mcal_boot=self._get_metacal_bootstrapper(
@@ -1623,18 +2376,30 @@ class MetacalNGMixBootFitter(MaxNGMixBootFitter):
             boot.mb_obs_list,
         )
 
+        fit_kw={'psf_fit_pars':psf_fit_pars,
+                'prior':prior,
+                'metacal_pars':self['metacal_pars'],
+                'guesser':guesser}
+
         try:
 
-            mcal_boot.fit_metacal(
-                psf_pars['model'],
-                model,
-                max_pars,
-                Tguess,
-                psf_fit_pars=psf_fit_pars,
-                prior=prior,
-                ntry=max_pars['ntry'],
-                metacal_pars=self['metacal_pars'],
-            )
+            if self['adaptive_ntry'] is not None:
+                self._fit_metacal_adaptive(mcal_boot,
+                                           psf_pars['model'],
+                                           model,
+                                           max_pars,
+                                           Tguess,
+                                           metacal_obs=metacal_obs,
+                                           **fit_kw)
+            else:
+                mcal_boot.fit_metacal(
+                    psf_pars['model'],
+                    model,
+                    max_pars,
+                    Tguess,
+                    ntry=self._get_max_ntry(),
+                    **fit_kw
+                )
 
         except BootPSFFailure as err:
             # the _run_boot code catches this one
@@ -1642,6 +2407,89 @@ class MetacalNGMixBootFitter(MaxNGMixBootFitter):
 
         return mcal_boot
 
+    def _fit_metacal_adaptive(self,
+                              mcal_boot,
+                              psf_model,
+                              model,
+                              max_pars,
+                              Tguess,
+                              metacal_obs=None,
+                              **kwargs):
+        """
+        fit the sheared images with one try, doubling the tries after each
+        failure up to the max
+
+        the sheared images are made once, so only the fits are redone
+        """
+
+        if metacal_obs is None:
+            metacal_obs=ngmix.metacal.get_all_metacal(
+                mcal_boot.mb_obs_list,
+                **kwargs['metacal_pars']
+            )
+
+        max_ntry=self._get_max_ntry()
+
+        ntry=1
+        ntry_used=0
+        while True:
+            ntry=min(ntry, max_ntry-ntry_used)
+            ntry_used += ntry
+            self.data['mcal_ntry'][0] = ntry_used
+
+            try:
+                mcal_boot.fit_metacal(
+                    psf_model,
+                    model,
+                    max_pars,
+                    Tguess,
+                    metacal_obs=metacal_obs,
+                    ntry=ntry,
+                    **kwargs
+                )
+                return
+
+            except BootGalFailure as err:
+                if ntry_used >= max_ntry:
+                    raise
+
+                print("        metacal failed with ntry %d: %s" % (ntry,err))
+                ntry *= 2
+
+    def _get_metacal_psf_Tguess(self, boot):
+        """
+        guess the T of the PSFs of the sheared images from the PSF fits to
+        the original images
+
+        The metacal PSFs are the original ones dilated by 1+2*step, so their
+        T is the median T of the good PSF fits times (1+2*step)**2.
+        """
+        Ts=[]
+        for obs_list in boot.mb_obs_list:
+            for obs in obs_list:
+                if obs.has_psf() and obs.get_psf().has_gmix():
+                    T=obs.get_psf().gmix.get_T()
+                    if numpy.isfinite(T) and T > 0.0:
+                        Ts.append(T)
+
+        if len(Ts) == 0:
+            # the _run_boot code catches this one
+            raise BootGalFailure("no good psf fits to guess the metacal psf T")
+
+        dilation=1.0 + 2.0*self['metacal_pars'].get('step',0.01)
+        return numpy.median(Ts)*dilation**2
+
+    def _get_metacal_guesser(self, boot):
+        """
+        guess the pars for each sheared image from the max like fit
+        """
+        res=boot.get_fitter().get_result()
+
+        guess=res['pars'].copy()
+        guess_widths=self._get_guess_widths(guess, res['pars_cov'])
+
+        return ngmix.guessers.ParsGuesser(guess, widths=guess_widths)
+
 
     def _get_fit_data_dtype(self,coadd):
         dt=super(MetacalNGMixBootFitter,self)._get_fit_data_dtype(coadd)
@@ -1702,6 +2550,8 @@ class MetacalNGMixBootFitter(MaxNGMixBootFitter):
         np=simple_npars
 
         dt=[('mcal_flags','i8')]
+        if self['adaptive_ntry'] is not None:
+            dt += [('mcal_ntry','i4')]
 
         models=self._get_all_models(coadd)
         if len(models) > 1:
@@ -1948,6 +2798,9 @@ class MetacalAdmomBootFitter(MetacalNGMixBootFitter):
             d[n('flux')] = DEFVAL
             d[n('flux_s2n')] = DEFVAL
 
+            if n('max_ntry') in d.dtype.names:
+                d[n('max_ntry')] = DEFVAL
+
         for f in self.mcal_flist:
             if 'err' in f:
                 dval=PDEFVAL
@@ -53,7 +53,7 @@ class Deconvolver(NGMixBootFitter):
         self.new_mb_obs_list = new_mb_obs_list
         self.mb_obs_list = mb_obs_list
 
-        mb_obs_list.update_meta_data({'fit_data':self._make_struct(coadd)})
+        mb_obs_list.update_meta_data({'fit_data':self._get_struct_template(coadd).copy()})
         self.data = mb_obs_list.meta['fit_data']
 
         if self['make_plots']:
@@ -462,9 +462,16 @@ class MetacalDeconvolver(Deconvolver):
         return res
 
     def _set_measurer_class(self):
-        import deconv
         dpars=self['deconv_pars']
         weight_type=dpars.get('weight_type','ksigma')
+        if weight_type=='ksigma-cached':
+            # transforms done once per object, see ObsKSigmaMomentsCached
+            self._measure_class=ObsKSigmaMomentsCached
+            self._measure_errors=(GMixRangeError,)
+            return
+
+        import deconv
+        self._measure_errors=(deconv.DeconvRangeError,)
         if weight_type=='ksigma':
             self._measure_class=deconv.measure.ObsKSigmaMoments
         elif weight_type=='ksigmac':
@@ -475,8 +482,6 @@ class MetacalDeconvolver(Deconvolver):
             raise NotImplementedError("bad weight type: '%s'" % weight_type)
 
     def _do_metacal_deconv(self, mb_obs_list):
-        import deconv
-
         doplots=False
 
         types=['noshear','1p','1m','2p','2m']
@@ -500,15 +505,24 @@ class MetacalDeconvolver(Deconvolver):
             **dpars
         )
 
+        return self._measure_shears(moments, shears, doplots=doplots)
 
+    def _measure_shears(self, moments, shears, doplots=False):
+        """
+        run the measurer, made once per object, for each shear type
+
+        The time for each type is kept in the result.
+        """
         try:
 
             flags=0
             res={}
 
             for type in shears:
+                tm=time.time()
                 moments.go(shear=shears[type],doplots=doplots)
                 res[type]=moments.get_result()
+                res[type]['time']=time.time()-tm
 
                 flags |= res[type]['flags']
 
@@ -516,9 +530,12 @@ class MetacalDeconvolver(Deconvolver):
                 if 'q'==raw_input('hit a key: '):
                     stop
 
-        except deconv.DeconvRangeError as err:
+        except self._measure_errors as err:
             raise BootGalFailure(str(err))
 
+        print("    shear times:",
+              " ".join(["%s: %.3g" % (type,res[type]['time']) for type in shears]))
+
         res['flags'] = flags
         return res
 
@@ -580,6 +597,7 @@ class MetacalDeconvolver(Deconvolver):
             data[n('e')][dindex] = res['e']
             data[n('wflux')][dindex] = res['wflux']
             data[n('wflux_band')][dindex] = res['wflux']
+            data[n('dc_time')][dindex] = res['time']
 
             for nn in ['T_err','e_cov','flux_s2n','s2n_w']:
                 if nn in res:
@@ -614,7 +632,7 @@ class MetacalDeconvolver(Deconvolver):
             for nn in ['dc_flags','dc_orflags','dc_flags_band','dc_orflags_band']: 
                 data[n(nn)] = NO_ATTEMPT
 
-            for nn in ['T','e','wflux','wflux_band','s2n_w','flux_s2n']:
+            for nn in ['T','e','wflux','wflux_band','s2n_w','flux_s2n','dc_time']:
                 data[n(nn)] = DEFVAL
 
             for nn in ['T_err','e_cov']:
@@ -674,6 +692,8 @@ class MetacalDeconvolver(Deconvolver):
 
                 (n('wflux'),'f8',bshape),
                 (n('wflux_band'),'f8',bshape),
+
+                (n('dc_time'),'f8'),
             ]
 
         return dt
@@ -690,9 +710,12 @@ class MetacalDeconvolver(Deconvolver):
 
 class MetacalDeconvolverPSFBase(MetacalDeconvolver):
 
-    def _do_metacal_deconv(self, mb_obs_list):
+    def _set_measurer_class(self):
         import deconv
+        self._measure_class=deconv.measure.KSigmaMomentsPSFBase
+        self._measure_errors=(deconv.DeconvRangeError,)
 
+    def _do_metacal_deconv(self, mb_obs_list):
         doplots=False
 
         types=['noshear','1p','1m','2p','2m']
@@ -701,33 +724,284 @@ class MetacalDeconvolverPSFBase(MetacalDeconvolver):
 
         dpars = self['deconv_pars']
 
-        moments = deconv.measure.KSigmaMomentsPSFBase(
+        moments = self._measure_class(
             mb_obs_list,
             **dpars
         )
 
+        return self._measure_shears(moments, shears, doplots=doplots)
+
+
+class ObsKSigmaMomentsCached(object):
+    """
+    pre-PSF k-sigma moments of the observations in a MultiBandObsList,
+    for running metacal on the same object many times
+
+    Each epoch's image and PSF are transformed once, in the constructor,
+    and the deconvolved transform and its noise are kept with the k grid.
+    Shearing the pre-PSF image by A, with unit determinant, is the same as
+    measuring the unsheared image with the kernels at A^-T k, so each call
+    to go only evaluates the weight kernels on the cached grid.
+
+    The weight is W(k) = (1 - k^2 sigma_weight^2/(2*nwt))^nwt inside
+    k sigma_weight < sqrt(2*nwt) and zero outside, which is close to a
+    gaussian of sigma_weight in real space.  The moments of the weighted
+    pre-PSF image come from the derivatives of W.
+
+    The real space weight has power law tails, so the padded images must
+    be many times sigma_weight across for the sums over the k grid to
+    converge; box_nsigma=64 gets the ellipticities to about 1.0e-5.
+
+    The epochs are combined with inverse variance weights from the noise
+    of their weighted fluxes.
+
+        moments = ObsKSigmaMomentsCached(mb_obs_list, sigma_weight)
+        moments.go(shear=ngmix.Shape(0.01, 0.0))
+        res = moments.get_result()
+    """
+
+    # the PSF transform is below min_psf_kval somewhere inside the
+    # support of the kernel
+    PSF_TOO_SMALL=2**0
+    # no epochs could be used in a band
+    NO_IMAGES=2**1
+    # the weighted flux is not positive or the size is zero
+    BAD_MOMENTS=2**2
+
+    def __init__(self,
+                 mb_obs_list,
+                 sigma_weight,
+                 nwt=4,
+                 pad_factor=2.0,
+                 box_nsigma=64.0,
+                 min_psf_kval=1.0e-4,
+                 **kw):
+
+        self.sigma_weight=sigma_weight
+        self.nwt=nwt
+        self.pad_factor=pad_factor
+        self.box_nsigma=box_nsigma
+        self.min_psf_kval=min_psf_kval
+        self.nband=len(mb_obs_list)
+
+        self._set_kdata(mb_obs_list)
+        self.result=None
+
+    def go(self, shear=None, doplots=False):
+        """
+        measure the moments of the pre-PSF image sheared by shear, an
+        ngmix Shape, or of the unsheared image if shear is None
+        """
 
-        try:
+        nband=self.nband
+        orflags_band=numpy.zeros(nband,dtype='i4')
+        nimage_use_band=numpy.zeros(nband,dtype='i4')
+
+        sums=numpy.zeros((nband,4))
+        covs=numpy.zeros((nband,4,4))
+        wsums=numpy.zeros(nband)
+
+        for kd in self.kdata:
+            band=kd['band']
+            ku,kv=self._get_sheared_k(kd,shear)
+            kernels,support=self._get_kernels(ku,kv)
+
+            if numpy.any(support & kd['psf_small']):
+                orflags_band[band] |= self.PSF_TOO_SMALL
+                continue
+
+            # normalized so an unresolved source has its total flux
+            norm=kernels[0].sum()
+            kernels=kernels/norm
+
+            tsums=numpy.array([(k*kd['fre']).sum() for k in kernels])
+            kvar=kd['kvar']
+            tcov=numpy.array([[(ki*kj*kvar).sum() for kj in kernels] for ki in kernels])
+
+            if not tcov[0,0] > 0.0:
+                orflags_band[band] |= self.BAD_MOMENTS
+                continue
+
+            wt=1.0/tcov[0,0]
+            sums[band] += wt*tsums
+            covs[band] += wt**2*tcov
+            wsums[band] += wt
+            nimage_use_band[band] += 1
+
+        flags_band=numpy.zeros(nband,dtype='i4')
+        flags_band[nimage_use_band == 0] |= self.NO_IMAGES
+
+        res={'flags':0,
+             'orflags':numpy.bitwise_or.reduce(orflags_band),
+             'flags_band':flags_band,
+             'orflags_band':orflags_band,
+             'nimage_use_band':nimage_use_band,
+             'wflux':numpy.zeros(nband)+DEFVAL,
+             'T':DEFVAL,
+             'T_err':PDEFVAL,
+             'e':numpy.zeros(2)+DEFVAL,
+             'e_cov':numpy.diag([PDEFVAL,PDEFVAL]),
+             'flux_s2n':DEFVAL,
+             's2n_w':DEFVAL}
+
+        w,=numpy.where(nimage_use_band > 0)
+        res['wflux'][w]=sums[w,0]/wsums[w]
+        if w.size < nband:
+            res['flags'] |= self.NO_IMAGES
+            self.result=res
+            return
+
+        # all bands together
+        wt=1.0/numpy.array([covs[b,0,0]/wsums[b]**2 for b in range(nband)])
+        S=(sums/wsums[:,numpy.newaxis]*wt[:,numpy.newaxis]).sum(axis=0)/wt.sum()
+        C=(covs/(wsums**2)[:,numpy.newaxis,numpy.newaxis]
+           *(wt**2)[:,numpy.newaxis,numpy.newaxis]).sum(axis=0)/wt.sum()**2
+
+        S0,ST,S1,S2=S
+        res['flux_s2n']=S0/numpy.sqrt(C[0,0])
+        res['s2n_w']=res['flux_s2n']
+
+        # T can be a bit negative for stars
+        if S0 <= 0.0 or ST == 0.0:
+            res['flags'] |= self.BAD_MOMENTS
+            self.result=res
+            return
+
+        T=ST/S0
+        e1=S1/ST
+        e2=S2/ST
+
+        # linear error propagation for T, e1, e2
+        G=numpy.array([[-ST/S0**2, 1.0/S0,    0.0,     0.0],
+                       [0.0,      -S1/ST**2, 1.0/ST,  0.0],
+                       [0.0,      -S2/ST**2, 0.0,     1.0/ST]])
+        pcov=numpy.dot(G,numpy.dot(C,G.T))
+
+        res['T']=T
+        res['T_err']=numpy.sqrt(pcov[0,0])
+        res['e']=numpy.array([e1,e2])
+        res['e_cov']=pcov[1:,1:]
+
+        self.result=res
+
+    def get_result(self):
+        """
+        the result of the last call to go
+        """
+        if self.result is None:
+            raise RuntimeError("run go() first")
+        return self.result
 
-            flags=0
-            res={}
+    def _set_kdata(self, mb_obs_list):
+        """
+        transform the image and PSF of each epoch
 
-            for type in shears:
-                moments.go(shear=shears[type],doplots=doplots)
-                res[type]=moments.get_result()
+        For each epoch this keeps the k grid in sky coordinates, the real
+        part of the deconvolved transform, the variance of that real part,
+        and where the PSF transform is too small to divide by
+        """
+        self.kdata=[]
+        for band,obs_list in enumerate(mb_obs_list):
+            for obs in obs_list:
+                self.kdata.append(self._get_obs_kdata(obs,band))
+
+    def _get_obs_kdata(self, obs, band):
+        im=obs.image
+        psf_im=obs.psf.image
+
+        jac=obs.jacobian
+        jmat=numpy.array([[jac.get_dvdrow(),jac.get_dvdcol()],
+                          [jac.get_dudrow(),jac.get_dudcol()]])
+        scale=numpy.sqrt(abs(numpy.linalg.det(jmat)))
+
+        dim=int(max(self.pad_factor*max(im.shape+psf_im.shape),
+                    self.box_nsigma*self.sigma_weight/scale))
+        dim += dim % 2
+
+        # k in radians/pixel along rows and cols
+        kpix=2.0*numpy.pi*numpy.fft.fftfreq(dim)
+        krow,kcol=numpy.meshgrid(kpix,kpix,indexing='ij')
+
+        # the transforms with the phases that put the origins at the
+        # jacobian centers
+        kim=self._get_centered_transform(im,jac,krow,kcol,dim)
+        kpsf=self._get_centered_transform(psf_im/psf_im.sum(),obs.psf.jacobian,krow,kcol,dim)
+
+        # from k per pixel to k per arcsec: k_pix = J^T k_sky
+        jinvT=numpy.linalg.inv(jmat).T
+        kv=jinvT[0,0]*krow + jinvT[0,1]*kcol
+        ku=jinvT[1,0]*krow + jinvT[1,1]*kcol
+
+        abs_kpsf=numpy.abs(kpsf)
+        psf_small=abs_kpsf < self.min_psf_kval
+        abs_kpsf[psf_small]=1.0
+
+        # white noise from the median variance of the used pixels
+        wpos=obs.weight[obs.weight > 0.0]
+        if wpos.size > 0:
+            pvar=numpy.median(1.0/wpos)
+        else:
+            pvar=numpy.inf
 
-                flags |= res[type]['flags']
+        fre=(kim/numpy.where(psf_small,1.0,kpsf)).real
+        fre[psf_small]=0.0
+        kvar=im.size*pvar/abs_kpsf**2
+        kvar[psf_small]=0.0
 
-            if doplots:
-                if 'q'==raw_input('hit a key: '):
-                    stop
+        return {'band':band,
+                'ku':ku,
+                'kv':kv,
+                'fre':fre,
+                'kvar':kvar,
+                'psf_small':psf_small}
 
-        except deconv.DeconvRangeError as err:
-            raise BootGalFailure(str(err))
+    def _get_centered_transform(self, im, jac, krow, kcol, dim):
+        pim=numpy.zeros((dim,dim))
+        pim[0:im.shape[0],0:im.shape[1]]=im
 
-        res['flags'] = flags
-        return res
+        row0,col0=jac.get_cen()
+        return numpy.fft.fft2(pim)*numpy.exp(1j*(krow*row0 + kcol*col0))
+
+    def _get_sheared_k(self, kd, shear):
+        """
+        the k at which to evaluate the kernels for the image sheared by shear
+        """
+        ku=kd['ku']
+        kv=kd['kv']
+        if shear is None:
+            return ku,kv
+
+        g1,g2=shear.g1,shear.g2
+        gsq=g1**2 + g2**2
+        if gsq >= 1.0:
+            raise GMixRangeError("g >= 1: %g" % numpy.sqrt(gsq))
+
+        s=numpy.sqrt(1.0-gsq)
+        return ((1.0-g1)*ku - g2*kv)/s, (-g2*ku + (1.0+g1)*kv)/s
 
+    def _get_kernels(self, ku, kv):
+        """
+        the kernels for the weighted flux, T, Muu-Mvv and 2*Muv, and
+        where they are not zero
+        """
+        sigma2=self.sigma_weight**2
+        nwt=self.nwt
+
+        k2=ku**2 + kv**2
+        t=1.0 - k2*sigma2/(2.0*nwt)
+        support=t > 0.0
+        t[~support]=0.0
+
+        tn2=t**(nwt-2)
+        fac=(nwt-1.0)/nwt*sigma2**2*tn2
+
+        kernels=numpy.array([
+            t**nwt,
+            2.0*sigma2*t**(nwt-1) - fac*k2,
+            -fac*(ku**2 - kv**2),
+            -2.0*fac*ku*kv,
+        ])
+        return kernels,support
 
 def _trim_image(im, cen):
 
@@ -15,6 +15,9 @@ if USE_OLD_FLAGS:
     GAL_FIT_FAILURE=2**3
     PSF_FLUX_FIT_FAILURE=2**9
     LOW_PSF_FLUX=2**6
+
+    # 2**6 is LOW_PSF_FLUX in this layout
+    LOW_TRIAGE_S2N=2**10
 else:
     # flags used by NGMixer
     BAD_OBJ              = 2**25
@@ -36,6 +39,10 @@ else:
     FORCEPHOT_BAD_MODEL = 2**4
     FORCEPHOT_FAILURE = 2**5
 
+    # the s2n of the triage fit was below all of the triage levels, so
+    # no galaxy models were fit
+    LOW_TRIAGE_S2N = 2**6
+
 object_blacklist=[3126629751,3126910598]
 OBJECT_IN_BLACKLIST = 2**24
 
@@ -0,0 +1,227 @@
+"""
+on-disk cache of the output rows of fits, so that reruns do not refit
+objects whose inputs have not changed
+"""
+from __future__ import print_function
+import os
+import hashlib
+import pprint
+import tempfile
+import numpy
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# config entries that do not change the fits
+_CONF_KEYS_TO_SKIP = ['config_file','work_dir','verbosity','verbose',
+                      'make_plots','fit_cache']
+
+def get_conf_hash(conf, fitter_conf=None):
+    """
+    hash of the config and the fitter config, without entries that do not
+    change the fits, and of the ngmix and ngmixer versions
+
+    The fitter config has the defaults set by the fitter, so a change of a
+    default also changes the hash. Objects in the configs, like priors, are
+    only hashed by their type; their parameters are in the config already.
+    """
+    import ngmix
+    from . import __version__
+
+    h = hashlib.sha1()
+    for c in [conf,fitter_conf]:
+        if c is not None:
+            c = dict((key,c[key]) for key in c if key not in _CONF_KEYS_TO_SKIP)
+            h.update(pprint.pformat(_get_plain(c)).encode('utf-8'))
+    h.update(str(getattr(ngmix,'__version__','')).encode('utf-8'))
+    h.update(str(__version__).encode('utf-8'))
+    return h.hexdigest()
+
+def _get_plain(obj):
+    """
+    copy of obj with only plain python types, which print the same way
+    in every run
+    """
+    if isinstance(obj,dict):
+        return dict((str(key),_get_plain(val)) for key,val in obj.items())
+    elif isinstance(obj,(list,tuple)):
+        return [_get_plain(val) for val in obj]
+    elif isinstance(obj,numpy.ndarray):
+        return obj.tolist()
+    elif isinstance(obj,numpy.generic):
+        return obj.item()
+    elif obj is None or isinstance(obj,(bool,int,float,str)):
+        return obj
+    else:
+        return '<%s.%s>' % (obj.__class__.__module__,obj.__class__.__name__)
+
+class FitCache(object):
+    """
+    cache of the output rows of fits, keyed by a hash of the pixels,
+    weights, psf images and jacobians of the object's observations
+
+    The entries for each config are kept in their own sub-directory, named
+    by the hash of the config, so a config change never uses an old entry.
+    When the total size of the cache is more than max_size bytes, the least
+    recently used entries are removed.
+
+        fit_cache = FitCache(cache_dir, conf_hash, max_size=10e9)
+        key = fit_cache.get_key(coadd_mb_obs_list, mb_obs_list)
+        rows = fit_cache.get(key)
+        if rows is None:
+            # fit the object
+            fit_cache.put(key, rows)
+    """
+    def __init__(self, cache_dir, conf_hash, max_size=None):
+        self.cache_dir = os.path.expandvars(cache_dir)
+        self.conf_hash = conf_hash
+        self.max_size = max_size
+
+        self.conf_dir = os.path.join(self.cache_dir,conf_hash)
+        if not os.path.exists(self.conf_dir):
+            try:
+                os.makedirs(self.conf_dir)
+            except OSError:
+                # another job made it
+                pass
+
+        self.size = None
+
+    def get_key(self, coadd_mb_obs_list, mb_obs_list):
+        """
+        hash of the inputs of the fit of an object
+        """
+        h = hashlib.sha1()
+        h.update(self.conf_hash.encode('utf-8'))
+        h.update(str(mb_obs_list.meta['id']).encode('utf-8'))
+        h.update(str(mb_obs_list.meta['obj_flags']).encode('utf-8'))
+
+        for mbo in [coadd_mb_obs_list,mb_obs_list]:
+            for obs_list in mbo:
+                h.update(str(len(obs_list)).encode('utf-8'))
+                for obs in obs_list:
+                    self._update_obs_hash(h,obs)
+
+        return h.hexdigest()
+
+    def _update_obs_hash(self, h, obs):
+        h.update(str(obs.meta['flags']).encode('utf-8'))
+        h.update(numpy.ascontiguousarray(obs.image))
+        h.update(numpy.ascontiguousarray(obs.weight))
+
+        jac = obs.jacobian
+        row0,col0 = jac.get_cen()
+        h.update(numpy.array([row0,col0,
+                              jac.get_dudrow(),jac.get_dudcol(),
+                              jac.get_dvdrow(),jac.get_dvdcol()]))
+
+        if obs.has_psf():
+            self._update_obs_hash(h,obs.get_psf())
+
+    def get(self, key):
+        """
+        get the cached rows for key, None if there are none
+        """
+        fname = self._get_fname(key)
+        if not os.path.exists(fname):
+            return None
+
+        try:
+            with open(fname,'rb') as fp:
+                rows = pickle.load(fp)
+        except Exception as err:
+            print('    could not read fit cache file %s: %s' % (fname,err))
+            return None
+
+        # mark it as recently used
+        try:
+            os.utime(fname,None)
+        except OSError:
+            pass
+
+        return rows
+
+    def put(self, key, rows):
+        """
+        cache the rows for key
+        """
+        fname = self._get_fname(key)
+        dname = os.path.dirname(fname)
+        if not os.path.exists(dname):
+            try:
+                os.makedirs(dname)
+            except OSError:
+                pass
+
+        # write to a temporary file and move into place so other jobs
+        # never see a partial file
+        fd,tmpname = tempfile.mkstemp(dir=dname,suffix='.tmp')
+        with os.fdopen(fd,'wb') as fp:
+            pickle.dump(rows,fp,protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname,fname)
+
+        if self.max_size is not None:
+            if self.size is None:
+                self.size = self._get_size()
+            else:
+                self.size += os.path.getsize(fname)
+
+            if self.size > self.max_size:
+                self._remove_lru()
+
+    def clear(self):
+        """
+        remove all of the entries for this config
+        """
+        for fname in self._get_files(self.conf_dir):
+            os.remove(fname)
+        self.size = None
+
+    def _get_fname(self, key):
+        return os.path.join(self.conf_dir,key[0:2],'%s.pkl' % key)
+
+    def _get_files(self, dname):
+        files = []
+        for root,dirs,fnames in os.walk(dname):
+            for fname in fnames:
+                if fname.endswith('.pkl'):
+                    files.append(os.path.join(root,fname))
+        return files
+
+    def _get_size(self):
+        size = 0
+        for fname in self._get_files(self.cache_dir):
+            try:
+                size += os.path.getsize(fname)
+            except OSError:
+                pass
+        return size
+
+    def _remove_lru(self):
+        """
+        remove the least recently used entries, over all configs, until the
+        cache is below 90% of max_size
+        """
+        entries = []
+        for fname in self._get_files(self.cache_dir):
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            entries.append((st.st_mtime,st.st_size,fname))
+        entries.sort()
+
+        size = sum([e[1] for e in entries])
+        for mtime,fsize,fname in entries:
+            if size <= 0.9*self.max_size:
+                break
+
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+            size -= fsize
+
+        self.size = size
@@ -91,6 +91,32 @@ class BaseFitter(dict):
         """
         raise NotImplementedError("get_default_nbrs_data method of BaseFitter must be defined in subclass.")
 
+    def _get_struct_template(self,coadd):
+        """
+        a default row of fit data from _make_struct, made once for each
+        value of coadd since the dtype is fixed for the run
+
+        copy it before filling it in
+        """
+        if getattr(self,'_struct_templates',None) is None:
+            self._struct_templates = {}
+
+        if coadd not in self._struct_templates:
+            self._struct_templates[coadd] = self._make_struct(coadd)
+
+        return self._struct_templates[coadd]
+
+    def _get_epoch_struct_template(self):
+        """
+        a default row of epoch fit data from _make_epoch_struct, made once
+
+        copy it before filling it in
+        """
+        if getattr(self,'_epoch_struct_template',None) is None:
+            self._epoch_struct_template = self._make_epoch_struct()
+
+        return self._epoch_struct_template
+
     def __call__(self,mb_obs_list,coadd=False,make_epoch_data=True,nbrs_fit_data=None,make_plots=False):
         """
         do fit of single obs list
@@ -145,6 +171,9 @@ class BaseFitter(dict):
             obs.image_orig
             obs.weight_orig
 
+        The weight_orig may share memory with other weight maps of the obs, so
+        it should not be modified in place.
+
         Any meta data (like PSF models or WCS jacobians) for the nbrs should be set in the nbrs_data field of
         the meta data of each obs in the mb_obs_list. This field is a numpy array of dtype returned by 
         'get_nbrs_data_dtype'.
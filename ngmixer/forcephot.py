@@ -193,7 +193,7 @@ class ForcedPhotometryFitter(NGMixBootFitter):
         self.new_mb_obs_list = new_mb_obs_list
         self.mb_obs_list = mb_obs_list
         
-        mb_obs_list.update_meta_data({'fit_data':self._make_struct(coadd)})
+        mb_obs_list.update_meta_data({'fit_data':self._get_struct_template(coadd).copy()})
         self.data = mb_obs_list.meta['fit_data']
 
         # do the forced photometry for each band
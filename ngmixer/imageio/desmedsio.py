@@ -4,6 +4,11 @@ import numpy
 import copy
 import fitsio
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from .medsio import MEDSImageIO, verify_meds
 from .. import files
 from .. import nbrsfofs
@@ -799,6 +804,11 @@ class Y1DESMEDSImageIO(SVDESMEDSImageIO):
         super(Y1DESMEDSImageIO,self)._set_defaults()
         self.conf['read_me_wcs'] = self.conf.get('read_me_wcs',False)
 
+        # directory for a pickled cache of the parsed WCS, shared by all
+        # chunks of a tile
+        self.conf['wcs_cache_dir'] = self.conf.get('wcs_cache_dir',None)
+        self._wcs_cache = None
+
         self._set_propagate_saturated_stars()
 
         self.conf['flag_y1_stellarhalo_masked'] = self.conf.get('flag_y1_stellarhalo_masked',False)
@@ -871,84 +881,141 @@ class Y1DESMEDSImageIO(SVDESMEDSImageIO):
         self.astroms = astroms
 
 
+    def _get_wcs_cache(self, source):
+        """
+        get the on-disk cache of parsed WCS objects for this tile, if
+        wcs_cache_dir is set in the config
+
+        the cache file is named after the first MEDS file so that all
+        chunks of the same tile share it
+        """
+        cache_dir = self.conf['wcs_cache_dir']
+        if cache_dir is None:
+            return None
+
+        bname = os.path.basename(self.meds_files_full[0])
+        bname = bname.replace('.fits.fz','').replace('.fits','')
+        fname = os.path.join(os.path.expandvars(cache_dir), '%s-wcs-cache.pkl' % bname)
+
+        return WCSCache(fname, source)
+
+    def _get_coadd_file_id(self, band):
+        # get coadd file ID
+        # a total hack, but should work!
+        # assumes all objects from the same coadd!
+        coadd_file_id = numpy.max(numpy.unique(self.meds_list[band]['file_id'][:,0]))
+        assert coadd_file_id >= 0,"Could not get coadd_file_id from MEDS file!"
+        return coadd_file_id
+
+    def _write_wcs_cache(self):
+        if self._wcs_cache is not None:
+            self._wcs_cache.write()
+
     def _load_wcs_from_meds(self):
+        """
+        set up the WCS transforms for each band from the json in the
+        image_info; each WCS is only parsed when first used
+        """
         from esutil.wcsutil import WCS
         import json
 
-        print('loading WCS from meds')
+        print('setting up WCS from meds')
+
+        self._wcs_cache = self._get_wcs_cache('meds')
+
         wcs_transforms = {}
         for band in self.iband:
-            wcs_transforms[band] = {}
-
             info = self.meds_list[band].get_image_info()
             nimage = info.size
 
-            # get coadd file ID            
-            # a total hack, but should work!
-            # assumes all objects from the same coadd!
-            coadd_file_id = numpy.max(numpy.unique(self.meds_list[band]['file_id'][:,0]))
-            assert coadd_file_id >= 0,"Could not get coadd_file_id from MEDS file!"
+            coadd_file_id = self._get_coadd_file_id(band)
 
-            wcs_dict = json.loads( info['wcs'][0] )
-            wcs_transforms[band][coadd_file_id] = WCS(wcs_dict)
+            def loader(band, file_id, info=info, coadd_file_id=coadd_file_id):
+                if file_id == coadd_file_id:
+                    wcs_dict = json.loads( info['wcs'][0] )
+                else:
+                    wcs_dict = json.loads( info['wcs'][file_id] )
+                return WCS(wcs_dict)
 
-            for i in xrange(nimage):
-                if i != coadd_file_id:
+            file_ids = list(xrange(nimage))
+            if coadd_file_id not in file_ids:
+                file_ids.append(coadd_file_id)
 
-                    wcs_dict = json.loads( info['wcs'][i] )
-                    wcs_transforms[band][i] = WCS(wcs_dict)
+            wcs_transforms[band] = LazyWCSTransforms(band,
+                                                     file_ids,
+                                                     loader,
+                                                     cache=self._wcs_cache)
 
         self.wcs_transforms = wcs_transforms
 
     def _load_wcs_from_files(self):
         """
-        Load the WCS transforms for each meds file
+        set up the WCS transforms for each band from the original coadd
+        image and the scamp head files; each file is only read when its
+        WCS is first used
         """
         from esutil.wcsutil import WCS
 
-        print('loading WCS from original files')
+        print('setting up WCS from original files')
+
+        self._wcs_cache = self._get_wcs_cache('files')
+
         wcs_transforms = {}
         for band in self.iband:
-            wcs_transforms[band] = {}
-
             info = self.meds_list[band].get_image_info()
             nimage = info.size
             meta = self.meds_meta_list[band]
 
-            # get coadd file ID            
-            # a total hack, but should work!
-            # assumes all objects from the same coadd!
-            coadd_file_id = numpy.max(numpy.unique(self.meds_list[band]['file_id'][:,0]))
-            assert coadd_file_id >= 0,"Could not get coadd_file_id from MEDS file!"
-            
+            coadd_file_id = self._get_coadd_file_id(band)
+
             # in image header for coadd
             coadd_path = info['image_path'][coadd_file_id].strip()
             coadd_path = coadd_path.replace(meta['DESDATA'][0],'${DESDATA}')
 
-            if os.path.exists(os.path.expandvars(coadd_path)):
-                h = fitsio.read_header(os.path.expandvars(coadd_path),ext=1)
-                wcs_transforms[band][coadd_file_id] = WCS(h)
-            else:
-                wcs_transforms[band][coadd_file_id] = None
-                print("warning: missing coadd WCS from image: %s" % coadd_path)
-
             # in scamp head files for SE
+            scamp_dir = os.path.join('/'.join(coadd_path.split('/')[:-2]),'QA/coadd_astrorefine_head')
+
+            def loader(band, file_id, info=info, coadd_file_id=coadd_file_id,
+                       coadd_path=coadd_path, scamp_dir=scamp_dir):
+                if file_id == coadd_file_id:
+                    if os.path.exists(os.path.expandvars(coadd_path)):
+                        h = fitsio.read_header(os.path.expandvars(coadd_path),ext=1)
+                        return WCS(h)
+                    else:
+                        print("warning: missing coadd WCS from image: %s" % coadd_path)
+                        return None
+                else:
+                    scamp_name = os.path.basename(info['image_path'][file_id].strip()).replace('.fits.fz','.head')
+                    scamp_file = os.path.join(scamp_dir,scamp_name)
+
+                    if os.path.exists(os.path.expandvars(scamp_file)):
+                        h = fitsio.read_scamp_head(os.path.expandvars(scamp_file))
+                        return WCS(h)
+                    else:
+                        print("warning: missing scamp head: %s" % scamp_file)
+                        return None
+
+            file_ids = [coadd_file_id]
             if self.conf['read_me_wcs']:
-                scamp_dir = os.path.join('/'.join(coadd_path.split('/')[:-2]),'QA/coadd_astrorefine_head')
-                for i in xrange(nimage):
-                    if i != coadd_file_id:
-                        scamp_name = os.path.basename(info['image_path'][i].strip()).replace('.fits.fz','.head')
-                        scamp_file = os.path.join(scamp_dir,scamp_name)
-
-                        if os.path.exists(os.path.expandvars(scamp_file)):
-                            h = fitsio.read_scamp_head(os.path.expandvars(scamp_file))
-                            wcs_transforms[band][i] = WCS(h)
-                        else:
-                            wcs_transforms[band][i] = None
-                            print("warning: missing scamp head: %s" % scamp_file)
+                file_ids += [i for i in xrange(nimage) if i != coadd_file_id]
+
+            wcs_transforms[band] = LazyWCSTransforms(band,
+                                                     file_ids,
+                                                     loader,
+                                                     cache=self._wcs_cache)
 
         self.wcs_transforms = wcs_transforms
 
+    def __next__(self):
+        try:
+            return super(Y1DESMEDSImageIO,self).__next__()
+        except StopIteration:
+            # all chunks of the tile can reuse what we parsed
+            self._write_wcs_cache()
+            raise
+
+    next = __next__
+
     def _get_offchip_nbr_psf_obs_and_jac(self,band,cen_ind,cen_mindex,cen_obs,nbr_ind,nbr_mindex,nbrs_obs_list):
         """
         how this works...
@@ -1405,6 +1472,105 @@ class Y3DESMEDSImageIO(Y1DESMEDSImageIO):
         dt += [('image_id','S49')]  # image_id specified in meds creation, e.g. for image table
         return dt
 
+class LazyWCSTransforms(object):
+    """
+    dict-like container of the WCS objects for a single band, keyed by
+    file_id
+
+    The WCS for a file_id is built by calling loader(band, file_id) the
+    first time it is requested and memoized after that.  If a WCSCache is
+    sent, it is checked before calling the loader and gets any newly built
+    WCS objects.
+    """
+    def __init__(self, band, file_ids, loader, cache=None):
+        self.band = band
+        self.file_ids = set([int(file_id) for file_id in file_ids])
+        self.loader = loader
+        self.cache = cache
+        self._wcs = {}
+
+    def __getitem__(self, file_id):
+        file_id = int(file_id)
+
+        if file_id not in self._wcs:
+            if file_id not in self.file_ids:
+                raise KeyError(file_id)
+
+            key = (self.band, file_id)
+            if self.cache is not None and key in self.cache:
+                wcs = self.cache[key]
+            else:
+                wcs = self.loader(self.band, file_id)
+                if self.cache is not None:
+                    self.cache[key] = wcs
+
+            self._wcs[file_id] = wcs
+
+        return self._wcs[file_id]
+
+    def __contains__(self, file_id):
+        return int(file_id) in self.file_ids
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def keys(self):
+        return sorted(self.file_ids)
+
+class WCSCache(dict):
+    """
+    pickled on-disk cache of WCS objects keyed by (band, file_id)
+
+    The source ('meds' or 'files') is stored with the data and a cache
+    made from a different source is ignored.  Writing merges with whatever
+    is on disk at the time and is done via a rename, so chunks of the same
+    tile can share the file.
+    """
+    def __init__(self, fname, source):
+        self.fname = fname
+        self.source = source
+
+        self.update(self._read())
+        self._nread = len(self)
+
+        if self._nread > 0:
+            print('    read %d WCS from cache: %s' % (self._nread,self.fname))
+
+    def _read(self):
+        if not os.path.exists(self.fname):
+            return {}
+
+        try:
+            with open(self.fname,'rb') as fobj:
+                data = pickle.load(fobj)
+        except Exception as err:
+            print("warning: could not read WCS cache %s: %s" % (self.fname,str(err)))
+            return {}
+
+        if data.get('source',None) != self.source:
+            return {}
+
+        return data['wcs']
+
+    def write(self):
+        """
+        write the cache if anything new was added
+        """
+        if len(self) == self._nread:
+            return
+
+        wcs = self._read()
+        wcs.update(self)
+
+        files.makedir_fromfile(self.fname)
+        tmpname = '%s.%d.tmp' % (self.fname,os.getpid())
+        print('writing WCS cache: %s' % self.fname)
+        with open(tmpname,'wb') as fobj:
+            pickle.dump({'source':self.source,'wcs':wcs}, fobj, protocol=2)
+        os.rename(tmpname, self.fname)
+
+        self._nread = len(self)
+
 class PIFFWrapper(dict):
     """
     provide an interface consistent with the PSFEx class
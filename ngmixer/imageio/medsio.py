@@ -356,6 +356,7 @@ class MEDSImageIO(ImageIO):
         for cen,mindex in enumerate(mindexes):
             nbrs_inds = []
             nbrs_ids = []
+            fixed_nbrs_numbers = []
 
             # if len is 1, then only a single galaxy in the FoF and do nothing
             if len(mindexes) > 1:
@@ -371,8 +372,18 @@ class MEDSImageIO(ImageIO):
 
                 assert cen not in nbrs_inds,'weird error where cen_ind is in nbrs_ind!'
 
-            coadd_mb_obs_lists[cen].update_meta_data({'nbrs_inds':nbrs_inds,'nbrs_ids':nbrs_ids,'cen_ind':cen})
-            me_mb_obs_lists[cen].update_meta_data({'nbrs_inds':nbrs_inds,'nbrs_ids':nbrs_ids,'cen_ind':cen})
+            # nbrs cut from the fof when it was split are not fit, so they
+            # are masked with the seg map
+            if 'fixed_nbrs' in self.extra_data:
+                fixed_nbrs = self.extra_data['fixed_nbrs']
+                q, = numpy.where((fixed_nbrs['number'] == self.meds_list[0]['number'][mindex])
+                                 & (fixed_nbrs['nbr_number'] > 0))
+                fixed_nbrs_numbers = list(fixed_nbrs['nbr_number'][q])
+
+            meta = {'nbrs_inds':nbrs_inds,'nbrs_ids':nbrs_ids,'cen_ind':cen,
+                    'fixed_nbrs_numbers':fixed_nbrs_numbers}
+            coadd_mb_obs_lists[cen].update_meta_data(meta)
+            me_mb_obs_lists[cen].update_meta_data(meta)
 
         # now do psfs and jacobians
         self._add_nbrs_psfs_and_jacs(coadd_mb_obs_lists,mindexes)
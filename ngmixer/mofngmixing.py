@@ -5,15 +5,16 @@ import time
 import pprint
 import os
 import fitsio
-import copy
+import scipy.sparse
 
 # local imports
 from . import imageio
 from . import fitting
 from . import files
 from .ngmixing import NGMixer
-from .defaults import DEFVAL,_CHECKPOINTS_DEFAULT_MINUTES
+from .defaults import DEFVAL,_CHECKPOINTS_DEFAULT_MINUTES,VERBOSITY
 from .defaults import NO_ATTEMPT,NO_CUTOUTS,BOX_SIZE_TOO_BIG,IMAGE_FLAGS
+from .defaults import LOW_TRIAGE_S2N
 from .defaults import MOF_SKIPPED_IN_CONV_CHECK, \
     MOF_NOT_CONVERGED, \
     MOF_NBR_NOT_CONVERGED, \
@@ -30,11 +31,78 @@ from .defaults import MOF_SKIPPED_IN_CONV_CHECK, \
 from .util import UtterFailure,Namer,print_pars
 from .util import print_with_verbosity
 
+# MOFNGMixer and fof used by each process in the pool for jacobi updates,
+# set by the pool initializer
+_JACOBI_MOF = None
+
+def _init_jacobi_pool(mixer,coadd_mb_obs_lists,mb_obs_lists):
+    global _JACOBI_MOF
+    _JACOBI_MOF = {'mixer':mixer,
+                   'coadd_mb_obs_lists':coadd_mb_obs_lists,
+                   'mb_obs_lists':mb_obs_lists,
+                   'weight_attr':None}
+
+def _fit_jacobi_obj(task):
+    """
+    fit a fof member against the nbrs from the previous iteration
+
+    returns the index, the new data row and any nbrs data made
+    """
+    i,seed,itr,prev_data,weight_attr = task
+    mixer = _JACOBI_MOF['mixer']
+    coadd_mb_obs_lists = _JACOBI_MOF['coadd_mb_obs_lists']
+    mb_obs_lists = _JACOBI_MOF['mb_obs_lists']
+
+    # the pool lives for all iterations, so follow the weights used
+    if weight_attr != _JACOBI_MOF['weight_attr']:
+        mixer._switch_weights(coadd_mb_obs_lists,mb_obs_lists,weight_attr)
+        _JACOBI_MOF['weight_attr'] = weight_attr
+
+    numpy.random.seed(seed)
+
+    mixer.prev_data = prev_data
+    mixer.curr_data = prev_data.copy()
+
+    nnbrs = len(mixer.nbrs_data)
+    mixer._fit_mof_obj(coadd_mb_obs_lists,mb_obs_lists,i,itr,mixer.prev_data)
+
+    row = mixer.curr_data[i].copy()
+    nbrs_data = mixer.nbrs_data[nnbrs:]
+    del mixer.nbrs_data[nnbrs:]
+
+    return i,row,nbrs_data
+
 class MOFNGMixer(NGMixer):
     def _set_defaults(self):
         super(MOFNGMixer,self)._set_defaults()
         self['mof']['write_convergence_data'] = self['mof'].get('write_convergence_data',False)
 
+        # only refit members that, or whose nbrs, did not converge in the
+        # previous iteration
+        self['mof']['active_set'] = self['mof'].get('active_set',False)
+
+        # how to update the members in each iteration
+        #   'gauss-seidel': fit one at a time, each against the latest nbrs
+        #   'jacobi': fit all against the nbrs from the previous iteration,
+        #       optionally on mof:nprocs processes, and update together
+        self['mof']['update'] = self['mof'].get('update','gauss-seidel')
+        assert self['mof']['update'] in ['gauss-seidel','jacobi'], \
+            "mof update '%s' not supported!" % self['mof']['update']
+        self['mof']['nprocs'] = self['mof'].get('nprocs',1)
+
+        # fraction of the change in the jacobi update to apply
+        self['mof']['damping'] = self['mof'].get('damping',1.0)
+
+        # accelerate the iterations between sweeps
+        #   None: plain iterations
+        #   'sor': over-relax by mof:accel_omega
+        #   'anderson': Anderson mixing over the last mof:accel_m iterations
+        self['mof']['accel'] = self['mof'].get('accel',None)
+        assert self['mof']['accel'] in [None,'sor','anderson'], \
+            "mof accel '%s' not supported!" % self['mof']['accel']
+        self['mof']['accel_omega'] = self['mof'].get('accel_omega',1.2)
+        self['mof']['accel_m'] = self['mof'].get('accel_m',3)
+
     def _get_models_to_check(self):
         me_models_to_check,me_pars_models_to_check,me_cov_models_to_check, \
             coadd_models_to_check,coadd_pars_models_to_check,coadd_cov_models_to_check, \
@@ -59,6 +127,8 @@ class MOFNGMixer(NGMixer):
     def _check_convergence(self,foflen,itr,coadd_mb_obs_lists,mb_obs_lists):
         """
         check convergence of fits
+
+        the differences are computed for all fof members at once
         """
 
         models_to_check,pars_models_to_check,cov_models_to_check,npars = self._get_models_to_check()
@@ -75,65 +145,68 @@ class MOFNGMixer(NGMixer):
         maxfrac_conv = self['mof']['maxfrac_conv'][0:npars]
         maxabs_conv = self['mof']['maxabs_conv'][0:npars]
 
-        for fofind in xrange(foflen):
-            print_with_verbosity('    fof obj: %ld' % (fofind+1),verbosity=1)
+        for model,_pars_model,_model_cov in zip(models_to_check,pars_models_to_check,cov_models_to_check):
+            if (self['fit_coadd_galaxy'] and
+                    not self['use_coadd_prefix'] and
+                    'coadd_' in model):
+                pars_model = _pars_model.replace('coadd_', '')
+                model_cov = _model_cov.replace('coadd_', '')
+            else:
+                pars_model = _pars_model
+                model_cov = _model_cov
 
-            for model,_pars_model,_model_cov in zip(models_to_check,pars_models_to_check,cov_models_to_check):
-                if (self['fit_coadd_galaxy'] and
-                        not self['use_coadd_prefix'] and
-                        'coadd_' in model):
-                    pars_model = _pars_model.replace('coadd_', '')
-                    model_cov = _model_cov.replace('coadd_', '')
-                else:
-                    pars_model = _pars_model
-                    model_cov = _model_cov
+            if pars_model not in self.curr_data.dtype.names:
+                print('    skipping model %s parameters' % pars_model)
+                continue
 
-                if pars_model not in self.curr_data.dtype.names:
-                    print('    skipping model %s parameters' % pars_model)
-                    continue
+            n = Namer(model)  # the old namer still gets used for flags
 
-                n = Namer(model)  # the old namer still gets used for flags
+            self.curr_data[n('mof_flags')][:] = 0
+            self.curr_data[n('mof_num_itr')][:] = itr+1
 
-                self.curr_data[n('mof_flags')][fofind] = 0
-                self.curr_data[n('mof_num_itr')][fofind] = itr+1
+            # members triaged in both fits have no pars to check, but
+            # they did not change either
+            triaged = self._get_triaged(self.curr_data) & self._get_triaged(self.prev_data)
+            skip = ((self.curr_data['flags'] != 0) | (self.prev_data['flags'] != 0)) & ~triaged
+            for fofind in numpy.where(skip)[0]:
+                print('    skipping fof obj %s in convergence check' % (fofind+1))
+            self.curr_data[n('mof_flags')][skip] = MOF_SKIPPED_IN_CONV_CHECK
 
-                if self.curr_data['flags'][fofind] or self.prev_data['flags'][fofind]:
-                    print('    skipping fof obj %s in convergence check' % (fofind+1))
-                    self.curr_data[n('mof_flags')][fofind] = MOF_SKIPPED_IN_CONV_CHECK
-                    continue
+            w, = numpy.where(~skip & ~triaged)
+            if w.size == 0:
+                continue
 
-                old = self.prev_data[pars_model][fofind]
-                new = self.curr_data[pars_model][fofind]
+            old = self.prev_data[pars_model][w]
+            new = self.curr_data[pars_model][w]
+            err = numpy.sqrt(numpy.diagonal(self.curr_data[model_cov][w],axis1=1,axis2=2))
+            with numpy.errstate(divide='ignore',invalid='ignore'):
                 absdiff = numpy.abs(new-old)
                 absfracdiff = numpy.abs(new/old-1.0)
-                abserr = numpy.abs((old-new)/numpy.sqrt(numpy.diag(self.curr_data[model_cov][fofind])))
+                abserr = numpy.abs((old-new)/err)
 
-                self.curr_data[n('mof_abs_diff')][fofind] = absdiff
-                self.curr_data[n('mof_frac_diff')][fofind] = absfracdiff
-                self.curr_data[n('mof_err_diff')][fofind] = abserr
+            self.curr_data[n('mof_abs_diff')][w] = absdiff
+            self.curr_data[n('mof_frac_diff')][w] = absfracdiff
+            self.curr_data[n('mof_err_diff')][w] = abserr
 
-                if numpy.all((absdiff <= maxabs_conv)      | \
+            conv = numpy.all((absdiff <= maxabs_conv)      | \
                              (absfracdiff <= maxfrac_conv) | \
-                             (abserr <= self['mof']['maxerr_conv'])):
-                    self.curr_data[n('mof_flags')][fofind] = 0
-                else:
-                    self.curr_data[n('mof_flags')][fofind] = MOF_NOT_CONVERGED
-
+                             (abserr <= self['mof']['maxerr_conv']),axis=1)
+            self.curr_data[n('mof_flags')][w[~conv]] = MOF_NOT_CONVERGED
 
-                for i in xrange(npars):
-                    if absdiff[i] > maxabs[i]:
-                        maxabs[i] = copy.copy(absdiff[i])
-                    if absfracdiff[i] > maxfrac[i]:
-                        maxfrac[i] = copy.copy(absfracdiff[i])
-                    if abserr[i] > maxerr[i]:
-                        maxerr[i] = copy.copy(abserr[i])
+            # nans never count towards the max
+            maxabs = numpy.fmax(maxabs,numpy.fmax.reduce(absdiff,axis=0))
+            maxfrac = numpy.fmax(maxfrac,numpy.fmax.reduce(absfracdiff,axis=0))
+            maxerr = numpy.fmax(maxerr,numpy.fmax.reduce(abserr,axis=0))
 
-                print_with_verbosity('        %s:' % model,verbosity=1)
-                print_pars(old,        front='            old      ',verbosity=1)
-                print_pars(new,        front='            new      ',verbosity=1)
-                print_pars(absdiff,    front='            abs diff ',verbosity=1)
-                print_pars(absfracdiff,front='            frac diff',verbosity=1)
-                print_pars(abserr,     front='            err diff ',verbosity=1)
+            if VERBOSITY() >= 1:
+                for i,fofind in enumerate(w):
+                    print_with_verbosity('    fof obj: %ld' % (fofind+1),verbosity=1)
+                    print_with_verbosity('        %s:' % model,verbosity=1)
+                    print_pars(old[i],        front='            old      ',verbosity=1)
+                    print_pars(new[i],        front='            new      ',verbosity=1)
+                    print_pars(absdiff[i],    front='            abs diff ',verbosity=1)
+                    print_pars(absfracdiff[i],front='            frac diff',verbosity=1)
+                    print_pars(abserr[i],     front='            err diff ',verbosity=1)
 
 
         fmt = "%8.3g "*len(maxabs)
@@ -154,9 +227,33 @@ class MOFNGMixer(NGMixer):
         else:
             return False
 
+    def _get_nbrs_adjacency(self,foflen,mb_obs_lists):
+        """
+        sparse matrix with a one at [cen_ind,nbrs_ind] for each nbr of
+        each fof member
+        """
+        rows = []
+        cols = []
+        for cen_ind in xrange(foflen):
+            nbrs_inds = mb_obs_lists[cen_ind].meta['nbrs_inds']
+            rows.extend([cen_ind]*len(nbrs_inds))
+            cols.extend(nbrs_inds)
+
+        data = numpy.ones(len(rows),dtype='i4')
+        return scipy.sparse.csr_matrix((data,(rows,cols)),shape=(foflen,foflen))
+
     def _set_nbr_mof_flags(self,foflen,coadd_mb_obs_lists,mb_obs_lists):
         models_to_check,pars_models_to_check,cov_models_to_check,npars = self._get_models_to_check()
 
+        adj = self._get_nbrs_adjacency(foflen,mb_obs_lists)
+
+        def nbr_any(mask):
+            return adj.dot(mask.astype('i4')) > 0
+
+        not_fit = numpy.array([mb_obs_lists[cen_ind].meta['obj_flags'] != 0
+                               for cen_ind in xrange(foflen)],dtype=bool)
+        bad_fit = (self.curr_data['flags'] != 0) & ~self._get_triaged(self.curr_data)
+
         for model,_pars_model,_model_cov in zip(models_to_check,pars_models_to_check,cov_models_to_check):
             if (self['fit_coadd_galaxy'] and
                     not self['use_coadd_prefix'] and
@@ -171,77 +268,61 @@ class MOFNGMixer(NGMixer):
 
             n = Namer(model)
 
-            any_not_conv = 0
-            any_bad_fit = 0
-            any_not_fit = 0
-            any_skip_conv = 0
-
-            for cen_ind in xrange(foflen):
-
-                if mb_obs_lists[cen_ind].meta['obj_flags'] != 0:
-                    any_not_fit = 1
-
-                if self.curr_data[n('mof_flags')][cen_ind]&MOF_NOT_CONVERGED != 0:
-                    any_not_conv = 1
-
-                if self.curr_data['flags'][cen_ind]:
-                    any_bad_fit = 1
-
-                if self.curr_data[n('mof_flags')][cen_ind]&MOF_SKIPPED_IN_CONV_CHECK != 0:
-                    any_skip_conv = 1
-
-                nbr_not_conv = 0
-                nbr_bad_fit = 0
-                nbr_not_fit = 0
-                nbr_skip_conv = 0
-
-                nbrs_inds = mb_obs_lists[cen_ind].meta['nbrs_inds']
-                for nbrs_ind in nbrs_inds:
+            mof_flags = self.curr_data[n('mof_flags')]
+            not_conv = (mof_flags & MOF_NOT_CONVERGED) != 0
+            skip_conv = (mof_flags & MOF_SKIPPED_IN_CONV_CHECK) != 0
 
-                    if mb_obs_lists[nbrs_ind].meta['obj_flags'] != 0:
-                        nbr_not_fit = 1
+            # set flag for nbrs lists
+            new_flags = numpy.zeros(foflen,dtype=mof_flags.dtype)
+            new_flags[nbr_any(not_conv)] |= MOF_NBR_NOT_CONVERGED
+            new_flags[nbr_any(bad_fit)] |= MOF_NBR_BAD_FIT
+            new_flags[nbr_any(not_fit)] |= MOF_NBR_NOT_FIT
+            new_flags[nbr_any(skip_conv)] |= MOF_NBR_SKIPPED_IN_CONV_CHECK
 
-                    if self.curr_data[n('mof_flags')][nbrs_ind]&MOF_NOT_CONVERGED != 0:
-                        nbr_not_conv = 1
-
-                    if self.curr_data['flags'][nbrs_ind]:
-                        nbr_bad_fit = 1
+            # set flags for the whole fof
+            if numpy.any(not_conv):
+                new_flags |= MOF_FOFMEM_NOT_CONVERGED
 
-                    if self.curr_data[n('mof_flags')][nbrs_ind]&MOF_SKIPPED_IN_CONV_CHECK != 0:
-                        nbr_skip_conv = 1
+            if numpy.any(bad_fit):
+                new_flags |= MOF_FOFMEM_BAD_FIT
 
-                # set flag for nbrs lists
-                if nbr_not_conv:
-                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_NBR_NOT_CONVERGED
+            if numpy.any(not_fit):
+                new_flags |= MOF_FOFMEM_NOT_FIT
 
-                if nbr_bad_fit:
-                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_NBR_BAD_FIT
+            if numpy.any(skip_conv):
+                new_flags |= MOF_FOFMEM_SKIPPED_IN_CONV_CHECK
 
-                if nbr_not_fit:
-                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_NBR_NOT_FIT
+            mof_flags |= new_flags
 
-                if nbr_skip_conv:
-                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_NBR_SKIPPED_IN_CONV_CHECK
+    def _get_triaged(self,data):
+        """
+        fof members with only a triage fit, because of their low s2n
 
+        These never get model pars, so they are not bad fits.
+        """
+        return data['flags'] == LOW_TRIAGE_S2N
 
-            # set flags for the whole fof
-            for cen_ind in xrange(foflen):
-                if any_not_conv:
-                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_FOFMEM_NOT_CONVERGED
+    def _get_active_members(self,foflen,mb_obs_lists):
+        """
+        get the fof members to refit in the next iteration
 
-                if any_bad_fit:
-                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_FOFMEM_BAD_FIT
+        A member is refit if it or any of its nbrs was not converged or was
+        skipped in the last convergence check.
+        """
+        models_to_check,pars_models_to_check,cov_models_to_check,npars = self._get_models_to_check()
 
-                if any_not_fit:
-                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_FOFMEM_NOT_FIT
+        changed = numpy.zeros(foflen,dtype=bool)
+        for model in models_to_check:
+            n = Namer(model)
+            changed |= (self.curr_data[n('mof_flags')] & (MOF_NOT_CONVERGED | MOF_SKIPPED_IN_CONV_CHECK)) != 0
 
-                if any_skip_conv:
-                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_FOFMEM_SKIPPED_IN_CONV_CHECK
+        active = changed.copy()
+        for cen_ind in xrange(foflen):
+            nbrs_inds = mb_obs_lists[cen_ind].meta['nbrs_inds']
+            if len(nbrs_inds) > 0 and numpy.any(changed[nbrs_inds]):
+                active[cen_ind] = True
 
-    def _set_default_data_for_fofind(self,fofind):
-        for tag in self.default_data.dtype.names:
-            self.curr_data[tag][fofind] = self.default_data[tag]
-        self.curr_data['fofind'][fofind] = fofind
+        return active
 
     def do_fits(self):
         """
@@ -265,31 +346,17 @@ class MOFNGMixer(NGMixer):
             print('    num in fof: %d' % foflen)
 
             # get data to fill
-            self.curr_data = self._make_struct(num=foflen)
-            for i in xrange(foflen):
-                self._set_default_data_for_fofind(i)
+            self.curr_data = numpy.repeat(self._get_struct_template(),foflen)
+            self.curr_data['fofind'] = numpy.arange(foflen)
 
             #####################################################################
             # fit the fof once with no nbrs
             # sort by stamp size
             # set weight to uberseg if more than one thing in fof
-            for coadd_mb_obs_list,mb_obs_list in zip(coadd_mb_obs_lists,mb_obs_lists):
-                for obs_list in mb_obs_list:
-                    for obs in obs_list:
-                        if obs.meta['flags'] == 0:
-                            if foflen > 1:
-                                obs.weight = getattr(obs,'weight_us',obs.weight)
-                            else:
-                                obs.weight = getattr(obs,'weight_raw',obs.weight)
-                            obs.weight_orig = obs.weight.copy()
-                for obs_list in coadd_mb_obs_list:
-                    for obs in obs_list:
-                        if obs.meta['flags'] == 0:
-                            if foflen > 1:
-                                obs.weight = getattr(obs,'weight_us',obs.weight)
-                            else:
-                                obs.weight = getattr(obs,'weight_raw',obs.weight)
-                            obs.weight_orig = obs.weight.copy()
+            if foflen > 1:
+                self._switch_weights(coadd_mb_obs_lists,mb_obs_lists,'weight_us')
+            else:
+                self._switch_weights(coadd_mb_obs_lists,mb_obs_lists,'weight_raw')
 
             bs = []
             for coadd_mb_obs_list,mb_obs_list in zip(coadd_mb_obs_lists,mb_obs_lists):
@@ -324,54 +391,64 @@ class MOFNGMixer(NGMixer):
                                                  self['mof']['convergence_model'],init=True)
 
                 converged = False
-                for itr in xrange(self['mof']['max_itr']):
-                    print('itr %d - fof index %d:%d ' % (itr+1,\
-                                                         self.curr_fofindex+1-self.start_fofindex,\
-                                                         numtot))
-
-                    # switch back to non-uberseg weights
-                    if itr >= self['mof']['min_useg_itr']:
-                        for coadd_mb_obs_list,mb_obs_list in zip(coadd_mb_obs_lists,mb_obs_lists):
-                            for obs_list in mb_obs_list:
-                                for obs in obs_list:
-                                    if obs.meta['flags'] == 0:
-                                        obs.weight = getattr(obs,'weight_raw',obs.weight)
-                                        obs.weight_orig = obs.weight.copy()
-                            for obs_list in coadd_mb_obs_list:
-                                for obs in obs_list:
-                                    if obs.meta['flags'] == 0:
-                                        obs.weight = getattr(obs,'weight_raw',obs.weight)
-                                        obs.weight_orig = obs.weight.copy()
-
-                    # data
-                    self.prev_data = self.curr_data.copy()
-
-                    # fitting
-                    for i in numpy.random.choice(foflen,size=foflen,replace=False):
-                        self.curr_data_index = i
-
-                        coadd_mb_obs_list = coadd_mb_obs_lists[i]
-                        mb_obs_list = mb_obs_lists[i]
-                        print('  fof obj: %d:%d - itr %d' % (self.curr_data_index+1,foflen,itr+1))
-                        print('    id: %d' % mb_obs_list.meta['id'])
-
-                        num += 1
-                        ti = time.time()
-                        self.fit_obj(coadd_mb_obs_list,mb_obs_list,
-                                     nbrs_fit_data=self.curr_data,
-                                     make_epoch_data=False,
-                                     make_nbrs_data=True if itr == 0 else False)
-                        ti = time.time()-ti
-                        print('    time: %f' % ti)
-
-                    if self['mof']['write_convergence_data']:
-                        self._write_convergence_data(mb_obs_lists,self.curr_data, \
-                                                     self['mof']['convergence_model'],init=False)
-
-                    print('  convergence itr %d:' % (itr+1))
-                    if self._check_convergence(foflen,itr,coadd_mb_obs_lists,mb_obs_lists) and itr >= self['mof']['min_itr']:
-                        converged = True
-                        break
+                active = numpy.ones(foflen,dtype=bool)
+                self._accel_hist = []
+                self._start_jacobi_pool(coadd_mb_obs_lists,mb_obs_lists)
+                try:
+                    for itr in xrange(self['mof']['max_itr']):
+                        print('itr %d - fof index %d:%d ' % (itr+1,\
+                                                             self.curr_fofindex+1-self.start_fofindex,\
+                                                             numtot))
+
+                        # switch back to non-uberseg weights
+                        if itr >= self['mof']['min_useg_itr']:
+                            self._switch_weights(coadd_mb_obs_lists,mb_obs_lists,'weight_raw')
+
+                            # the data changed for everyone
+                            if itr == self['mof']['min_useg_itr']:
+                                active[:] = True
+                                self._accel_hist = []
+
+                        # data
+                        self.prev_data = self.curr_data.copy()
+
+                        # fitting
+                        if self['mof']['active_set']:
+                            print('  fitting %d of %d fof objs' % (active.sum(),foflen))
+
+                        inds = [i for i in numpy.random.choice(foflen,size=foflen,replace=False) if active[i]]
+                        num += len(inds)
+
+                        if self['mof']['update'] == 'jacobi':
+                            self._do_jacobi_update(coadd_mb_obs_lists,mb_obs_lists,inds,itr)
+                        else:
+                            for i in inds:
+                                self._fit_mof_obj(coadd_mb_obs_lists,mb_obs_lists,i,itr,self.curr_data)
+
+                        if self['mof']['write_convergence_data']:
+                            self._write_convergence_data(mb_obs_lists,self.curr_data, \
+                                                         self['mof']['convergence_model'],init=False)
+
+                        print('  convergence itr %d:' % (itr+1))
+                        if self._check_convergence(foflen,itr,coadd_mb_obs_lists,mb_obs_lists) and itr >= self['mof']['min_itr']:
+                            converged = True
+                            break
+
+                        if self['mof']['active_set']:
+                            active = self._get_active_members(foflen,mb_obs_lists)
+
+                        # the damped or accelerated pars are used to render
+                        # the nbrs and as guesses in the next iteration; never
+                        # on the last one so the output always comes from a fit
+                        if itr < self['mof']['max_itr']-1:
+                            if (self['mof']['update'] == 'jacobi'
+                                    and self['mof']['damping'] != 1.0):
+                                self._damp_pars(self['mof']['damping'])
+
+                            if self['mof']['accel'] is not None:
+                                self._accelerate_pars(active)
+                finally:
+                    self._stop_jacobi_pool()
 
                 print('  convergence fof index: %d' % (self.curr_fofindex+1-self.start_fofindex))
                 print('    converged: %s' % str(converged))
@@ -402,6 +479,217 @@ class MOFNGMixer(NGMixer):
 
         self.done = True
 
+    def _switch_weights(self,coadd_mb_obs_lists,mb_obs_lists,attr):
+        """
+        set the weight of each good observation to the weight map in attr,
+        e.g. weight_us or weight_raw, if it has one
+
+        The weight maps are not modified during the fits, so weight_orig
+        refers to the same array rather than a copy.
+        """
+        for coadd_mb_obs_list,mb_obs_list in zip(coadd_mb_obs_lists,mb_obs_lists):
+            for obs_lists in [mb_obs_list,coadd_mb_obs_list]:
+                for obs_list in obs_lists:
+                    for obs in obs_list:
+                        if obs.meta['flags'] == 0:
+                            weight = getattr(obs,attr,obs.weight)
+                            if weight is not obs.weight:
+                                obs.weight = weight
+                            obs.weight_orig = obs.weight
+
+    def _fit_mof_obj(self,coadd_mb_obs_lists,mb_obs_lists,i,itr,nbrs_fit_data):
+        """
+        fit a fof member with its nbrs in a MOF iteration
+        """
+        self.curr_data_index = i
+
+        foflen = len(mb_obs_lists)
+        coadd_mb_obs_list = coadd_mb_obs_lists[i]
+        mb_obs_list = mb_obs_lists[i]
+        print('  fof obj: %d:%d - itr %d' % (self.curr_data_index+1,foflen,itr+1))
+        print('    id: %d' % mb_obs_list.meta['id'])
+
+        ti = time.time()
+        self.fit_obj(coadd_mb_obs_list,mb_obs_list,
+                     nbrs_fit_data=nbrs_fit_data,
+                     make_epoch_data=False,
+                     make_nbrs_data=True if itr == 0 else False)
+        ti = time.time()-ti
+        print('    time: %f' % ti)
+
+    def _do_jacobi_update(self,coadd_mb_obs_lists,mb_obs_lists,inds,itr):
+        """
+        fit the fof members in inds against the nbrs from the previous
+        iteration and then update them all at once
+
+        The fits are run on the pool from _start_jacobi_pool if there is
+        one. Each fit in the pool gets its own seed drawn here so the
+        processes do not share random numbers.
+        """
+        if self._jacobi_pool is None:
+            for i in inds:
+                self._fit_mof_obj(coadd_mb_obs_lists,mb_obs_lists,i,itr,self.prev_data)
+            return
+
+        if itr >= self['mof']['min_useg_itr']:
+            weight_attr = 'weight_raw'
+        else:
+            weight_attr = 'weight_us'
+
+        seeds = numpy.random.randint(0,2**30,size=len(inds))
+        tasks = [(i,seed,itr,self.prev_data,weight_attr) for i,seed in zip(inds,seeds)]
+        results = self._jacobi_pool.map(_fit_jacobi_obj,tasks)
+
+        for i,row,nbrs_data in results:
+            self.curr_data[i] = row
+            self.nbrs_data.extend(nbrs_data)
+
+    def _start_jacobi_pool(self,coadd_mb_obs_lists,mb_obs_lists):
+        """
+        start the pool of mof:nprocs processes for the jacobi updates of a
+        fof, if needed
+
+        The fof is sent to the processes once by the pool initializer and
+        the pool is used for all of the iterations.
+        """
+        self._jacobi_pool = None
+
+        nprocs = min(self['mof']['nprocs'],len(mb_obs_lists))
+        if self['mof']['update'] == 'jacobi' and nprocs > 1:
+            import multiprocessing
+            self._jacobi_pool = multiprocessing.Pool(nprocs,
+                                                     initializer=_init_jacobi_pool,
+                                                     initargs=(self,coadd_mb_obs_lists,mb_obs_lists))
+
+    def _stop_jacobi_pool(self):
+        if self._jacobi_pool is not None:
+            self._jacobi_pool.close()
+            self._jacobi_pool.join()
+            self._jacobi_pool = None
+
+    def _damp_pars(self,damping):
+        """
+        only move the pars a fraction damping of the way from their values
+        in the previous iteration, for objects with good fits in both
+        """
+        for max_pars_tag,pars_tag,flags_tag,cov_tag in self._get_pars_tags():
+            w, = numpy.where((self.curr_data['flags'] == 0) &
+                             (self.prev_data['flags'] == 0) &
+                             (self.curr_data[flags_tag] == 0) &
+                             (self.prev_data[flags_tag] == 0))
+            if w.size == 0:
+                continue
+
+            for tag in [max_pars_tag,pars_tag]:
+                old = self.prev_data[tag][w]
+                new = self.curr_data[tag][w]
+                self.curr_data[tag][w] = old + damping*(new-old)
+
+    def _get_pars_tags(self):
+        """
+        get the max_pars, pars and max_flags tags for the models to check
+        """
+        models_to_check,pars_models_to_check,cov_models_to_check,npars = self._get_models_to_check()
+
+        tags = []
+        for model,_pars_model,_model_cov in zip(models_to_check,pars_models_to_check,cov_models_to_check):
+            if (self['fit_coadd_galaxy'] and
+                    not self['use_coadd_prefix'] and
+                    'coadd_' in model):
+                pars_model = _pars_model.replace('coadd_', '')
+                model_cov = _model_cov.replace('coadd_', '')
+            else:
+                pars_model = _pars_model
+                model_cov = _model_cov
+
+            if pars_model not in self.curr_data.dtype.names:
+                continue
+
+            tags.append((pars_model,
+                         pars_model.replace('_max_pars','_pars'),
+                         pars_model.replace('_max_pars','_max_flags'),
+                         model_cov))
+
+        return tags
+
+    def _accelerate_pars(self,active):
+        """
+        replace the pars of the members to be refit with accelerated values
+
+        The last iteration is treated as a map from the pars at the start
+        (prev_data) to the new fits (curr_data).  For 'sor' the step is
+        scaled by mof:accel_omega.  For 'anderson' the new pars are the
+        combination of the last mof:accel_m fits that minimizes the change
+        in the stacked max_pars, scaled by their errors.  Members whose
+        accelerated shape is not valid keep their fits.
+        """
+        tags = self._get_pars_tags()
+        if len(tags) == 0:
+            return
+
+        good = active.copy()
+        good &= (self.curr_data['flags'] == 0) & (self.prev_data['flags'] == 0)
+        for max_pars_tag,pars_tag,flags_tag,cov_tag in tags:
+            good &= (self.curr_data[flags_tag] == 0) & (self.prev_data[flags_tag] == 0)
+
+        w, = numpy.where(good)
+        if w.size == 0:
+            self._accel_hist = []
+            return
+
+        x = {}
+        g = {}
+        for max_pars_tag,pars_tag,flags_tag,cov_tag in tags:
+            for tag in [max_pars_tag,pars_tag]:
+                x[tag] = self.prev_data[tag][w].copy()
+                g[tag] = self.curr_data[tag][w].copy()
+
+        if self['mof']['accel'] == 'sor':
+            omega = self['mof']['accel_omega']
+            new = {}
+            for tag in x:
+                new[tag] = x[tag] + omega*(g[tag]-x[tag])
+        else:
+            # restart if the members used changed
+            if len(self._accel_hist) > 0 and not numpy.array_equal(self._accel_hist[-1]['w'],w):
+                self._accel_hist = []
+
+            self._accel_hist.append({'w':w,'x':x,'g':g})
+            self._accel_hist = self._accel_hist[-(self['mof']['accel_m']+1):]
+
+            if len(self._accel_hist) < 2:
+                return
+
+            # residuals of the stacked max_pars, scaled by the errors
+            resids = []
+            for hist in self._accel_hist:
+                resid = []
+                for max_pars_tag,pars_tag,flags_tag,cov_tag in tags:
+                    err = numpy.sqrt(numpy.abs(numpy.diagonal(self.curr_data[cov_tag][w],axis1=1,axis2=2)))
+                    err[err <= 0.0] = 1.0
+                    resid.append(((hist['g'][max_pars_tag]-hist['x'][max_pars_tag])/err).ravel())
+                resids.append(numpy.concatenate(resid))
+            resids = numpy.array(resids).T
+
+            dresids = resids[:,1:] - resids[:,:-1]
+            gamma = numpy.linalg.lstsq(dresids,resids[:,-1],rcond=-1)[0]
+            if not numpy.all(numpy.isfinite(gamma)):
+                return
+
+            new = {}
+            for tag in x:
+                gs = numpy.array([hist['g'][tag] for hist in self._accel_hist])
+                dgs = gs[1:] - gs[:-1]
+                new[tag] = gs[-1] - numpy.tensordot(gamma,dgs,axes=(0,0))
+
+        for max_pars_tag,pars_tag,flags_tag,cov_tag in tags:
+            for tag in [max_pars_tag,pars_tag]:
+                gtot = numpy.sqrt(new[tag][:,2]**2 + new[tag][:,3]**2)
+                ok = numpy.all(numpy.isfinite(new[tag]),axis=1) & (gtot < 0.99)
+                self.curr_data[tag][w[ok]] = new[tag][ok]
+
+        print('    accelerated pars for %d fof objs' % w.size)
+
     def _write_convergence_data(self,mb_obs_lists,curr_data,model,init=False):
         for i in xrange(len(mb_obs_lists)):
             iter_fname = 'iter_pars_%d.dat' % (mb_obs_lists[i].meta['id'])
@@ -16,6 +16,24 @@ def get_dummy_fofs(numbers):
     fofs['number'][:] = numbers[:] #subscript should make a copy
     return fofs
 
+#MedsNbrs used by each process in the pool when finding nbrs in parallel,
+#set by the pool initializer
+_POOL_NBRS = None
+
+def _init_pool_nbrs(nbrs):
+    global _POOL_NBRS
+    _POOL_NBRS = nbrs
+
+def _get_strip_nbrs(task):
+    """
+    get the nbrs of the objects in a strip, searching only the part of the
+    index which can overlap the strip
+    """
+    mindexes,sort_inds,sort_l = task
+    _POOL_NBRS.sort_inds = sort_inds
+    _POOL_NBRS.sort_l = sort_l
+    return [_POOL_NBRS._get_nbrs_mindex(mindex) for mindex in mindexes]
+
 class MedsNbrs(object):
     """
     Gets nbrs of any postage stamp in the MEDS.
@@ -35,6 +53,11 @@ class MedsNbrs(object):
         maxsize - size ot use instead of maxsize_to_replace to compute overlap
 
         check_seg - use object's seg map to get nbrs in addition to postage stamp overlap
+        seg_block_size - number of pixels of seg cutouts to read at once when
+            check_seg is set (default 10000000)
+
+        max_fof_size - if set, FoFs larger than this are split with split_fofs
+            when making the nbrs data
     """
 
     def __init__(self,meds_list,conf):
@@ -46,6 +69,9 @@ class MedsNbrs(object):
         self.conf = conf
 
         self._init_bounds()
+        self._init_index()
+
+        self.seg_nbrs = None
 
     def _init_bounds(self):
         self.l = {}
@@ -54,7 +80,16 @@ class MedsNbrs(object):
         self.b = {}
         self.sze = {}
 
+        #catalog columns, so the nbrs can be found without the MEDS files
+        self.number = {}
+        self.id = {}
+        self.good = {}
+
         for band,m in enumerate(self.meds_list):
+            self.number[band] = m['number'].copy()
+            self.id[band] = m['id'].copy()
+            self.good[band] = (m['orig_start_row'][:,0] != -9999) & (m['orig_start_col'][:,0] != -9999)
+
             #expand the stamps and get edges
             dsize = (self.conf['new_maxsize']-self.conf['maxsize_to_replace'])//2
             self.sze[band] = m['box_size'].copy()
@@ -72,29 +107,72 @@ class MedsNbrs(object):
             self.r[band] += self.sze[band]
             self.t[band] += self.sze[band]
 
-    def get_nbrs(self,verbose=True):
+    def _init_index(self):
+        """
+        sort the good stamps in each band by their lower row edge
+
+        A stamp can only overlap stamps whose lower row edge is within
+        the widest stamp plus the smallest possible buffer of its own
+        edges, so the candidates for each stamp are found with a binary
+        search on the sorted edges instead of testing every stamp.
+        """
+        self.sort_inds = {}
+        self.sort_l = {}
+        self.max_width = {}
+        self.min_sze = {}
+        self.max_sze = {}
+
+        for band in xrange(len(self.meds_list)):
+            good, = numpy.where(self.good[band])
+            s = numpy.argsort(self.l[band][good],kind='mergesort')
+            self.sort_inds[band] = good[s]
+            self.sort_l[band] = self.l[band][good[s]]
+
+            if good.size > 0:
+                self.max_width[band] = numpy.max(self.r[band][good] - self.l[band][good])
+                self.min_sze[band] = numpy.min(self.sze[band][good])
+                self.max_sze[band] = numpy.max(self.sze[band][good])
+            else:
+                self.max_width[band] = 0
+                self.min_sze[band] = 0
+                self.max_sze[band] = 0
+
+    def _get_buff(self,sze,nbr_sze):
+        """
+        buffer between a stamp of size sze and stamps of size nbr_sze
+        """
+        if self.conf['buff_type'] == 'min':
+            buff = numpy.minimum(sze,nbr_sze)
+        elif self.conf['buff_type'] == 'max':
+            buff = numpy.maximum(sze,nbr_sze)
+        elif self.conf['buff_type'] == 'tot':
+            buff = sze + nbr_sze
+        else:
+            assert False, "buff_type '%s' not supported!" % self.conf['buff_type']
+        return buff*self.conf['buff_frac']
+
+    def get_nbrs(self,verbose=True,nprocs=1):
+        """
+        get the nbrs of all objects
+
+        If nprocs > 1, the tile is split into strips in row and the strips
+        are processed on a pool of processes. The output is the same as the
+        serial path.
+        """
         #data types
         nbrs_data = []
         dtype = [('number','i8'),('nbr_number','i8')]
         print("config:",self.conf)
 
-        for mindex in prange(self.meds_list[0].size):
-            nbrs = []
-            for band,m in enumerate(self.meds_list):
-                #make sure MEDS lists have the same objects!
-                assert m['number'][mindex] == self.meds_list[0]['number'][mindex]
-                assert m['id'][mindex] == self.meds_list[0]['id'][mindex]
-                assert m['number'][mindex] == mindex+1
-
-                #add on the nbrs
-                nbrs.extend(list(self.check_mindex(mindex,band)))
-
-            #only keep unique nbrs
-            nbrs = numpy.unique(numpy.array(nbrs))
+        if nprocs > 1:
+            nbrs_list = self._get_nbrs_parallel(nprocs)
+        else:
+            nbrs_list = [self._get_nbrs_mindex(mindex) for mindex in prange(len(self.number[0]))]
 
+        for mindex,nbrs in enumerate(nbrs_list):
             #add to final list
             for nbr in nbrs:
-                nbrs_data.append((m['number'][mindex],nbr))
+                nbrs_data.append((self.number[0][mindex],nbr))
 
         #return array sorted by number
         nbrs_data = numpy.array(nbrs_data,dtype=dtype)
@@ -103,11 +181,108 @@ class MedsNbrs(object):
 
         return nbrs_data
 
+    def _get_nbrs_mindex(self,mindex):
+        """
+        get the unique nbrs of an object over all bands
+        """
+        nbrs = []
+        for band in xrange(len(self.number)):
+            #make sure MEDS lists have the same objects!
+            assert self.number[band][mindex] == self.number[0][mindex]
+            assert self.id[band][mindex] == self.id[0][mindex]
+            assert self.number[band][mindex] == mindex+1
+
+            #add on the nbrs
+            nbrs.extend(list(self.check_mindex(mindex,band)))
+
+        #only keep unique nbrs
+        return numpy.unique(numpy.array(nbrs))
+
+    def _get_nbrs_parallel(self,nprocs):
+        """
+        find the nbrs in strips of the tile on a pool of processes
+
+        The strips are contiguous in the row of the lower stamp edge. The
+        catalog data are sent to each process once by the pool initializer
+        and each strip comes with the part of the sorted index which can
+        overlap it, so nbrs across strip edges are found as in the serial
+        path.
+        """
+        import multiprocessing
+
+        #read the seg nbrs once, before starting the pool
+        if self.conf['check_seg'] and self.seg_nbrs is None:
+            self._init_seg_nbrs()
+
+        nobj = len(self.number[0])
+        nstrips = min(nobj,nprocs*4)
+        srt = numpy.argsort(self.l[0],kind='mergesort')
+        strips = [strip for strip in numpy.array_split(srt,max(nstrips,1)) if len(strip) > 0]
+        print('finding nbrs in %d strips with %d processes' % (len(strips),nprocs))
+
+        tasks = []
+        for strip in strips:
+            sort_inds,sort_l = self._get_strip_index(strip)
+            tasks.append((strip,sort_inds,sort_l))
+
+        #the MEDS objects cannot be sent to the processes and are not needed
+        pool_nbrs = copy.copy(self)
+        pool_nbrs.meds_list = None
+        pool_nbrs.sort_inds = None
+        pool_nbrs.sort_l = None
+
+        pool = multiprocessing.Pool(nprocs,initializer=_init_pool_nbrs,initargs=(pool_nbrs,))
+        try:
+            strip_nbrs = pool.map(_get_strip_nbrs,tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        nbrs_list = [None]*nobj
+        for strip,nbrs in zip(strips,strip_nbrs):
+            for mindex,nbr in zip(strip,nbrs):
+                nbrs_list[mindex] = nbr
+
+        return nbrs_list
+
+    def _get_strip_index(self,mindexes):
+        """
+        the parts of the sorted index in each band which can hold nbrs of
+        the objects in mindexes
+        """
+        sort_inds = {}
+        sort_l = {}
+        for band in xrange(len(self.number)):
+            q, = numpy.where(self.good[band][mindexes])
+            if len(q) == 0:
+                sort_inds[band] = self.sort_inds[band][0:0]
+                sort_l[band] = self.sort_l[band][0:0]
+                continue
+
+            lo,hi = self._get_search_bounds(mindexes[q],band)
+            lo = numpy.searchsorted(self.sort_l[band],numpy.min(lo),side='left')
+            hi = numpy.searchsorted(self.sort_l[band],numpy.max(hi),side='right')
+            sort_inds[band] = self.sort_inds[band][lo:hi].copy()
+            sort_l[band] = self.sort_l[band][lo:hi].copy()
+
+        return sort_inds,sort_l
+
+    def _get_search_bounds(self,mindex,band):
+        """
+        the range of lower row edges of stamps which can overlap the stamp
+        of mindex
+        """
+        sze = self.sze[band][mindex]
+        buff_lo = numpy.minimum(self._get_buff(sze,self.min_sze[band]),self._get_buff(sze,self.max_sze[band]))
+        lo = self.l[band][mindex] + buff_lo - self.max_width[band] - 1
+        hi = self.r[band][mindex] - buff_lo + 1
+        return lo,hi
+
     def check_mindex(self,mindex,band):
-        m = self.meds_list[band]
+        number = self.number[band]
 
         #check that current gal has OK stamp, or return bad crap
-        if m['orig_start_row'][mindex,0] == -9999 or m['orig_start_col'][mindex,0] == -9999:
+        if not self.good[band][mindex]:
             nbr_numbers = numpy.array([-1],dtype=int)
             return nbr_numbers
 
@@ -117,45 +292,39 @@ class MedsNbrs(object):
         nbr_numbers = []
 
         #box intersection test and exclude yourself
-        #use buffer of 1/4 of smaller of pair of stamps
-        buff = self.sze[band].copy()
-        if self.conf['buff_type'] == 'min':
-            q, = numpy.where(buff[mindex] < buff)
-            if len(q) > 0:
-                buff[q[:]] = buff[mindex]
-        elif self.conf['buff_type'] == 'max':
-            q, = numpy.where(buff[mindex] > buff)
-            if len(q) > 0:
-                buff[q[:]] = buff[mindex]
-        elif self.conf['buff_type'] == 'tot':
-            buff = buff[mindex] + buff
-        else:
-            assert False, "buff_type '%s' not supported!" % self.conf['buff_type']
-        buff = buff*self.conf['buff_frac']
-        q, = numpy.where((~((self.l[band][mindex] > self.r[band]-buff) | (self.r[band][mindex] < self.l[band]+buff) |
-                            (self.t[band][mindex] < self.b[band]+buff) | (self.b[band][mindex] > self.t[band]-buff))) &
-                         (m['number'][mindex] != m['number']) &
-                         (m['orig_start_row'][:,0] != -9999) & (m['orig_start_col'][:,0] != -9999))
+        #the buffer is set by buff_type and buff_frac for each pair of stamps
+        #only stamps with lower row edges within the sorted window can overlap
+        lo,hi = self._get_search_bounds(mindex,band)
+        lo = numpy.searchsorted(self.sort_l[band],lo,side='left')
+        hi = numpy.searchsorted(self.sort_l[band],hi,side='right')
+        inds = self.sort_inds[band][lo:hi]
+
+        buff = self._get_buff(self.sze[band][mindex],self.sze[band][inds])
+        l = self.l[band][inds]
+        r = self.r[band][inds]
+        b = self.b[band][inds]
+        t = self.t[band][inds]
+        q, = numpy.where((~((self.l[band][mindex] > r-buff) | (self.r[band][mindex] < l+buff) |
+                            (self.t[band][mindex] < b+buff) | (self.b[band][mindex] > t-buff))) &
+                         (number[mindex] != number[inds]))
 
         if len(q) > 0:
-            nbr_numbers.extend(list(m['number'][q]))
+            nbr_numbers.extend(list(number[inds[q]]))
 
         #check coadd seg maps
         if self.conf['check_seg']:
-            try:
-                segmap = m.get_cutout(mindex,0,type='seg')
-                q = numpy.where((segmap > 0) & (segmap != m['number'][mindex]))
-                if len(q) > 0:
-                    nbr_numbers.extend(list(numpy.unique(segmap[q])))
-            except:
-                pass
+            if self.seg_nbrs is None:
+                self._init_seg_nbrs()
+            lo = numpy.searchsorted(self.seg_nbrs['number'],number[mindex],side='left')
+            hi = numpy.searchsorted(self.seg_nbrs['number'],number[mindex],side='right')
+            nbr_numbers.extend(list(self.seg_nbrs['nbr_number'][lo:hi]))
 
         #cut weird crap
         if len(nbr_numbers) > 0:
             nbr_numbers = numpy.array(nbr_numbers,dtype=int)
             nbr_numbers = numpy.unique(nbr_numbers)
             inds = nbr_numbers-1
-            q, = numpy.where((m['orig_start_row'][inds,0] != -9999) & (m['orig_start_col'][inds,0] != -9999))
+            q, = numpy.where(self.good[band][inds])
             if len(q) > 0:
                 nbr_numbers = list(nbr_numbers[q])
             else:
@@ -170,14 +339,103 @@ class MedsNbrs(object):
 
         return nbr_numbers
 
+    def get_overlaps(self,nbrs_data,band=0):
+        """
+        get the overlap area in pixels of the stamps of each pair in the
+        nbrs data
+
+        Pairs found only through the seg map or with no nbr get zero.
+        """
+        overlaps = numpy.zeros(len(nbrs_data),dtype='f8')
+        q, = numpy.where(nbrs_data['nbr_number'] > 0)
+        if len(q) > 0:
+            i = nbrs_data['number'][q]-1
+            j = nbrs_data['nbr_number'][q]-1
+            dr = numpy.minimum(self.r[band][i],self.r[band][j]) - numpy.maximum(self.l[band][i],self.l[band][j])
+            dc = numpy.minimum(self.t[band][i],self.t[band][j]) - numpy.maximum(self.b[band][i],self.b[band][j])
+            overlaps[q] = numpy.clip(dr,0,None)*numpy.clip(dc,0,None)
+        return overlaps
+
+    def _init_seg_nbrs(self):
+        """
+        collect the (number, nbr_number) pairs from the coadd seg maps of
+        all objects
+
+        All bands share the coadd seg map, so it is only read from the
+        first MEDS file. The seg cutouts are read in large contiguous blocks
+        and the pairs for all stamps in a block are found at once.
+        """
+        m = self.meds_list[0]
+        dtype = [('number','i8'),('nbr_number','i8')]
+        block_size = self.conf.get('seg_block_size',10000000)
+
+        try:
+            seg_hdu = m._fits['seg_cutouts']
+        except (IOError,KeyError) as err:
+            print("warning: could not read seg cutouts: %s" % str(err))
+            self.seg_nbrs = numpy.zeros(0,dtype=dtype)
+            return
+
+        #only objects with a coadd cutout, in file order
+        good, = numpy.where((m['ncutout'] > 0) & (m['box_size'] > 0))
+        good = good[numpy.argsort(m['start_row'][good,0],kind='mergesort')]
+        starts = m['start_row'][good,0].astype('i8')
+        npixs = m['box_size'][good].astype('i8')**2
+        numbers = m['number'][good].astype('i8')
+
+        pairs = []
+        beg = 0
+        while beg < len(good):
+            #read from the first cutout until the block is full
+            end = beg+1
+            while end < len(good) and starts[end]+npixs[end]-starts[beg] <= block_size:
+                end += 1
+
+            first_row = starts[beg]
+            block = seg_hdu[first_row:numpy.max(starts[beg:end]+npixs[beg:end])]
+
+            #pixel indices into the block for each stamp
+            bnpix = npixs[beg:end]
+            offsets = numpy.cumsum(bnpix) - bnpix
+            pinds = numpy.arange(numpy.sum(bnpix)) + numpy.repeat(starts[beg:end]-first_row-offsets,bnpix)
+            vals = block[pinds].astype('i8')
+            owners = numpy.repeat(numbers[beg:end],bnpix)
+
+            q, = numpy.where((vals > 0) & (vals != owners))
+            if len(q) > 0:
+                #seg values can be larger than any number in the catalog
+                nmax = max(numpy.max(owners[q]),numpy.max(vals[q]))+1
+                keys = numpy.unique(owners[q]*nmax + vals[q])
+                pairs.append(numpy.column_stack([keys // nmax,keys % nmax]))
+
+            beg = end
+
+        if len(pairs) > 0:
+            pairs = numpy.unique(numpy.concatenate(pairs),axis=0)
+        else:
+            pairs = numpy.zeros((0,2),dtype='i8')
+
+        self.seg_nbrs = numpy.zeros(len(pairs),dtype=dtype)
+        self.seg_nbrs['number'] = pairs[:,0]
+        self.seg_nbrs['nbr_number'] = pairs[:,1]
+
 class NbrsFoF(object):
+    """
+    Groups objects into FoFs using the nbrs data.
+
+    The FoFs are the connected components of the graph whose edges are the
+    (number, nbr_number) pairs. They are found with a vectorized union-find
+    which hooks the larger root of each edge onto the smaller one and then
+    compresses paths, until every edge has the same root at both ends. The
+    root of each FoF is its smallest member, so the fofids are assigned in
+    order of the smallest number in each FoF.
+    """
     def __init__(self,nbrs_data):
         self.nbrs_data = nbrs_data
         self.Nobj = len(numpy.unique(nbrs_data['number']))
 
         #records fofid of entry
         self.linked = numpy.zeros(self.Nobj,dtype='i8')
-        self.fofs = {}
 
         self._fof_data = None
 
@@ -189,62 +447,158 @@ class NbrsFoF(object):
         #init
         self._init_fofs()
 
+        u,v = self._get_edges()
+        parent = numpy.arange(self.Nobj,dtype='i8')
 
-        for i in prange(self.Nobj):
-            self._link_fof(i)
+        itr = 0
+        while True:
+            #compress paths so everything points at a root
+            while True:
+                gparent = parent[parent]
+                if numpy.array_equal(gparent,parent):
+                    break
+                parent = gparent
 
-        for fofid,k in enumerate(self.fofs):
-            inds = numpy.array(list(self.fofs[k]),dtype=int)
-            self.linked[inds[:]] = fofid
-        self.fofs = {}
+            pu = parent[u]
+            pv = parent[v]
+            q, = numpy.where(pu != pv)
+            if len(q) == 0:
+                break
 
-        self._make_fof_data()
+            #hook the larger root onto the smaller one
+            numpy.minimum.at(parent,numpy.maximum(pu[q],pv[q]),numpy.minimum(pu[q],pv[q]))
+            itr += 1
 
-    def _link_fof(self,mind):
-        #get nbrs for this object
-        nbrs = set(self._get_nbrs_index(mind))
+        if verbose:
+            print('found fofs in %d iterations' % itr)
 
-        #always make a base fof
-        if self.linked[mind] == -1:
-            fofid = copy.copy(mind)
-            self.fofs[fofid] = set([mind])
-            self.linked[mind] = fofid
-        else:
-            fofid = copy.copy(self.linked[mind])
-
-        #loop through nbrs
-        for nbr in nbrs:
-            if self.linked[nbr] == -1 or self.linked[nbr] == fofid:
-                #not linked so add to current
-                self.fofs[fofid].add(nbr)
-                self.linked[nbr] = fofid
-            else:
-                #join!
-                self.fofs[self.linked[nbr]] |= self.fofs[fofid]
-                del self.fofs[fofid]
-                fofid = copy.copy(self.linked[nbr])
-                inds = numpy.array(list(self.fofs[fofid]),dtype=int)
-                self.linked[inds[:]] = fofid
+        #roots are the smallest member of each fof
+        roots,self.linked[:] = numpy.unique(parent,return_inverse=True)
+
+        self._make_fof_data()
 
     def _make_fof_data(self):
-        self._fof_data = []
-        for i in xrange(self.Nobj):
-            self._fof_data.append((self.linked[i],i+1))
-        self._fof_data = numpy.array(self._fof_data,dtype=[('fofid','i8'),('number','i8')])
-        i = numpy.argsort(self._fof_data['number'])
-        self._fof_data = self._fof_data[i]
+        self._fof_data = numpy.zeros(self.Nobj,dtype=[('fofid','i8'),('number','i8')])
+        self._fof_data['fofid'] = self.linked
+        self._fof_data['number'] = numpy.arange(1,self.Nobj+1)
         assert numpy.all(self._fof_data['fofid'] >= 0)
 
     def _init_fofs(self):
         self.linked[:] = -1
-        self.fofs = {}
 
-    def _get_nbrs_index(self,mind):
-        q, = numpy.where((self.nbrs_data['number'] == mind+1) & (self.nbrs_data['nbr_number'] > 0))
-        if len(q) > 0:
-            return list(self.nbrs_data['nbr_number'][q]-1)
-        else:
-            return []
+    def _get_edges(self):
+        """
+        get the edges as zero-based indices, skipping entries with no nbrs
+        """
+        q, = numpy.where(self.nbrs_data['nbr_number'] > 0)
+        u = self.nbrs_data['number'][q].astype('i8') - 1
+        v = self.nbrs_data['nbr_number'][q].astype('i8') - 1
+        return u,v
+
+def split_fofs(fof_data,nbrs_data,max_fof_size,overlaps=None):
+    """
+    split FoFs with more than max_fof_size members
+
+    The pairs in each oversized FoF are linked in order of decreasing
+    overlap, skipping any link that would make a group larger than
+    max_fof_size, so the FoF is cut along its weakest overlaps. FoFs at or
+    below max_fof_size are not changed.
+
+    parameters
+    ----------
+    fof_data: array
+        fofs from NbrsFoF
+    nbrs_data: array
+        nbrs used to make the fofs
+    max_fof_size: int
+        maximum number of members in a FoF
+    overlaps: array, optional
+        strength of each pair in nbrs_data, e.g. from MedsNbrs.get_overlaps;
+        if not sent all pairs are equal
+
+    returns
+    -------
+    fof_data, nbrs_data, fixed_nbrs_data
+
+    The new nbrs_data only has pairs within the new FoFs. The cut pairs
+    are returned in fixed_nbrs_data; those nbrs are not fit together with
+    the object and must be treated as fixed.
+    """
+    assert max_fof_size >= 1,"max_fof_size must be at least 1"
+
+    nobj = len(fof_data)
+    assert numpy.array_equal(fof_data['number'],numpy.arange(1,nobj+1)),"fof_data must be sorted by number!"
+
+    if overlaps is None:
+        overlaps = numpy.ones(len(nbrs_data),dtype='f8')
+
+    fofids = fof_data['fofid']
+    counts = numpy.bincount(fofids)
+    big = counts[fofids] > max_fof_size
+
+    #start from the existing fofs for the small ones, rooted at their
+    #smallest member
+    min_member = numpy.zeros(len(counts),dtype='i8') + nobj
+    numpy.minimum.at(min_member,fofids,numpy.arange(nobj))
+    parent = numpy.where(big,numpy.arange(nobj),min_member[fofids])
+    size = numpy.ones(nobj,dtype='i8')
+    q, = numpy.where(~big)
+    size[min_member[fofids[q]]] = counts[fofids[q]]
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    #link the pairs in the big fofs, strongest overlap first
+    q, = numpy.where(nbrs_data['nbr_number'] > 0)
+    q = q[big[nbrs_data['number'][q]-1]]
+    q = q[numpy.argsort(-overlaps[q],kind='mergesort')]
+    for u,v in zip(nbrs_data['number'][q]-1,nbrs_data['nbr_number'][q]-1):
+        ru = find(u)
+        rv = find(v)
+        if ru != rv and size[ru]+size[rv] <= max_fof_size:
+            if ru > rv:
+                ru,rv = rv,ru
+            parent[rv] = ru
+            size[ru] += size[rv]
+
+    while True:
+        gparent = parent[parent]
+        if numpy.array_equal(gparent,parent):
+            break
+        parent = gparent
+
+    new_fof_data = numpy.zeros(nobj,dtype=fof_data.dtype)
+    roots,new_fof_data['fofid'] = numpy.unique(parent,return_inverse=True)
+    new_fof_data['number'] = fof_data['number']
+
+    #pairs across the new fofs are fixed
+    has_nbr = nbrs_data['nbr_number'] > 0
+    cut = numpy.zeros(len(nbrs_data),dtype=bool)
+    q, = numpy.where(has_nbr)
+    cut[q] = parent[nbrs_data['number'][q]-1] != parent[nbrs_data['nbr_number'][q]-1]
+    fixed_nbrs_data = nbrs_data[cut]
+
+    #objects whose nbrs were all cut get no nbrs
+    new_nbrs_data = nbrs_data[~cut]
+    nokeep = numpy.ones(nobj,dtype=bool)
+    nokeep[new_nbrs_data['number']-1] = False
+    q, = numpy.where(nokeep)
+    if len(q) > 0:
+        no_nbrs = numpy.zeros(len(q),dtype=nbrs_data.dtype)
+        no_nbrs['number'] = q+1
+        no_nbrs['nbr_number'] = -1
+        new_nbrs_data = numpy.concatenate([new_nbrs_data,no_nbrs])
+        i = numpy.argsort(new_nbrs_data['number'],kind='mergesort')
+        new_nbrs_data = new_nbrs_data[i]
+
+    print('split %d fofs larger than %d into %d, fixing %d nbrs' %
+          (numpy.sum(counts > max_fof_size),max_fof_size,
+           len(numpy.unique(new_fof_data['fofid'][big])),len(fixed_nbrs_data)))
+
+    return new_fof_data,new_nbrs_data,fixed_nbrs_data
 
 class NbrsFoFExtractor(object):
     """
@@ -58,10 +58,11 @@ class NGMixer(dict):
         self.fof_range=fof_range
         self._set_imageio(data_files, fof_range, fof_file, mof_file, extra_data)
 
-
         self._set_priors()
         self._set_fitter_and_data()
 
+        self._set_fit_cache()
+
         pprint.pprint(self)
 
         # checkpointing and outputs
@@ -141,6 +142,31 @@ class NGMixer(dict):
         self.default_epoch_data = def_edata
         self.default_nbrs_data = def_ndata
 
+    def _set_fit_cache(self):
+        """
+        set up the on-disk cache of fit results, if requested
+
+        the entries are keyed by the config with the fitter defaults, so
+        this is done after the fitter is made
+
+        fit_cache:
+            dir: path to the cache, can be shared between jobs
+            max_size_gb: optional limit on its total size
+        """
+        self['fit_cache'] = self.get('fit_cache',None)
+
+        self.fit_cache = None
+        if self['fit_cache'] is not None:
+            from .fitcache import FitCache, get_conf_hash
+
+            max_size = self['fit_cache'].get('max_size_gb',None)
+            if max_size is not None:
+                max_size = max_size*1.0e9
+
+            self.fit_cache = FitCache(self['fit_cache']['dir'],
+                                      get_conf_hash(self,fitter_conf=self.fitter),
+                                      max_size=max_size)
+
     def _set_priors(self):
         """
         Set priors on the parameters we will fit
@@ -196,9 +222,7 @@ class NGMixer(dict):
             foflen = len(mb_obs_lists)
 
             # get data to fill
-            self.curr_data = self._make_struct(num=foflen)
-            for tag in self.default_data.dtype.names:
-                self.curr_data[tag][:] = self.default_data[tag]
+            self.curr_data = numpy.repeat(self._get_struct_template(),foflen)
             self.curr_data_index = 0
 
             if 'mof_fit_data' in self.extra_data:
@@ -336,6 +360,22 @@ class NGMixer(dict):
 
         t0 = time.time()
 
+        # the cache is only used for objects fit without nbrs, since the
+        # nbrs fits also use the side effects of fitting each object
+        key = None
+        if (self.fit_cache is not None
+                and not self.get('model_nbrs',False)
+                and nbrs_fit_data is None):
+            key = self.fit_cache.get_key(coadd_mb_obs_list,mb_obs_list)
+            rows = self.fit_cache.get(key)
+            if rows is not None:
+                print('    using cached fit')
+                self._set_cached_fit(rows,t0,coadd_mb_obs_list,mb_obs_list)
+                return
+
+            nepoch = len(self.epoch_data)
+            nnbrs = len(self.nbrs_data)
+
         #check flags
         flags = self._check_basic_things(coadd_mb_obs_list,mb_obs_list)
 
@@ -356,6 +396,63 @@ class NGMixer(dict):
         for tag in mb_obs_list.meta['meta_data'].dtype.names:
             self.curr_data[tag][self.curr_data_index] = mb_obs_list.meta['meta_data'][tag][0]
 
+        if key is not None:
+            i = self.curr_data_index
+            rows = {'data':self.curr_data[i:i+1].copy(),
+                    'epoch_data':numpy.array(self.epoch_data[nepoch:],dtype=self.epoch_data_dtype),
+                    'nbrs_data':numpy.array(self.nbrs_data[nnbrs:],dtype=self.nbrs_data_dtype)}
+            self.fit_cache.put(key,rows)
+
+    def _set_cached_fit(self,rows,t0,coadd_mb_obs_list,mb_obs_list):
+        """
+        fill in the output rows of an object from the fit cache
+
+        Only the fit results are taken from the cache. The meta data of
+        the object and of its epochs, e.g. the number and fofid, are set
+        from the obs lists as for a new fit, since they can differ between
+        runs with the same pixels.
+        """
+        i = self.curr_data_index
+        if 'fofind' in self.curr_data.dtype.names:
+            fofind = self.curr_data['fofind'][i]
+            self.curr_data[i] = rows['data'][0]
+            self.curr_data['fofind'][i] = fofind
+        else:
+            self.curr_data[i] = rows['data'][0]
+
+        self.curr_data['time_last_fit'][i] = time.time()-t0
+        self.curr_data['obj_flags'][i] = mb_obs_list.meta['obj_flags']
+        for tag in mb_obs_list.meta['meta_data'].dtype.names:
+            self.curr_data[tag][i] = mb_obs_list.meta['meta_data'][tag][0]
+
+        # epoch meta data by (band_num,cutout_index)
+        epoch_meta = {}
+        for mbo in [coadd_mb_obs_list,mb_obs_list]:
+            for obs_list in mbo:
+                for obs in obs_list:
+                    if 'meta_data' in obs.meta:
+                        meta_data = obs.meta['meta_data']
+                        epoch_meta[(meta_data['band_num'][0],meta_data['cutout_index'][0])] = meta_data
+
+        for data,cached in [(self.epoch_data,rows['epoch_data']),(self.nbrs_data,rows['nbrs_data'])]:
+            cached = cached.copy()
+            for row in cached:
+                meta_data = epoch_meta.get((row['band_num'],row['cutout_index']),None)
+                if meta_data is not None:
+                    for tag in meta_data.dtype.names:
+                        row[tag] = meta_data[tag][0]
+                else:
+                    row['id'] = mb_obs_list.meta['meta_data']['id'][0]
+                    row['number'] = mb_obs_list.meta['meta_data']['number'][0]
+
+            # each epoch has a row per nbr and one for the object itself
+            if 'nbr_id' in cached.dtype.names and 'nbrs_ids' in mb_obs_list.meta:
+                nbr_ids = list(mb_obs_list.meta['nbrs_ids']) + [mb_obs_list.meta['id']]
+                if len(cached) % len(nbr_ids) == 0:
+                    cached['nbr_id'] = numpy.tile(nbr_ids,len(cached)//len(nbr_ids))
+
+            data.extend(list(cached))
+
     def _fill_epoch_data(self,mb_obs_list):
         # fill in epoch data
         for band,obs_list in enumerate(mb_obs_list):
@@ -363,10 +460,7 @@ class NGMixer(dict):
                 if 'fit_data' in obs.meta and obs.meta['fit_data'] is not None \
                    and 'meta_data' in obs.meta and obs.meta['flags'] == 0:
 
-                    ed = self._make_epoch_struct()
-
-                    for tag in self.default_epoch_data.dtype.names:
-                        ed[tag] = self.default_epoch_data[tag]
+                    ed = self._get_epoch_struct_template().copy()
 
                     for tag in obs.meta['fit_data'].dtype.names:
                         ed[tag] = obs.meta['fit_data'][tag][0]
@@ -384,10 +478,7 @@ class NGMixer(dict):
                         and 'fit_data' in obs.meta and obs.meta['fit_data'] is not None \
                         and 'meta_data' in obs.meta and obs.meta['flags'] == 0:
 
-                    ed = self._make_nbrs_struct(len(obs.meta['nbrs_data']))
-
-                    for tag in self.default_nbrs_data.dtype.names:
-                        ed[tag] = self.default_nbrs_data[tag][0]
+                    ed = numpy.repeat(self._get_nbrs_struct_template(),len(obs.meta['nbrs_data']))
 
                     for tag in obs.meta['nbrs_data'].dtype.names:
                         ed[tag] = obs.meta['nbrs_data'][tag]
@@ -532,6 +623,45 @@ class NGMixer(dict):
         data['obj_flags'] = NO_ATTEMPT
         return data
 
+    def _get_struct_template(self):
+        """
+        an output row filled with the default fit data
+
+        it is made once since the dtype is fixed for the run, so copy
+        it before filling it in
+        """
+        if getattr(self,'_struct_template',None) is None:
+            data = self._make_struct()
+            for tag in self.default_data.dtype.names:
+                data[tag] = self.default_data[tag]
+            self._struct_template = data
+
+        return self._struct_template
+
+    def _get_epoch_struct_template(self):
+        """
+        an epoch row filled with the default epoch fit data, made once
+        """
+        if getattr(self,'_epoch_struct_template',None) is None:
+            ed = self._make_epoch_struct()
+            for tag in self.default_epoch_data.dtype.names:
+                ed[tag] = self.default_epoch_data[tag]
+            self._epoch_struct_template = ed
+
+        return self._epoch_struct_template
+
+    def _get_nbrs_struct_template(self):
+        """
+        a nbrs row filled with the default nbrs data, made once
+        """
+        if getattr(self,'_nbrs_struct_template',None) is None:
+            ed = self._make_nbrs_struct()
+            for tag in self.default_nbrs_data.dtype.names:
+                ed[tag] = self.default_nbrs_data[tag][0]
+            self._nbrs_struct_template = ed
+
+        return self._nbrs_struct_template
+
     def _setup_checkpoints(self):
         """
         Set up the checkpoint times in minutes and data
@@ -204,7 +204,8 @@ class RenderNGmixNbrs(object):
                     band,
                     unmodeled_nbrs_masking_type='nbrs-seg',
                     total=False,
-                    verbose=True):
+                    verbose=True,
+                    render_tol=None):
         """
         render nbr images for a given object
 
@@ -222,6 +223,8 @@ class RenderNGmixNbrs(object):
         -------------------
         total: if set to True, return the sum of all nbrs images (and the and of any masks)
         verbose: bool indicating if the code should tell you things that happen (default: True)
+        render_tol: if not None, each image is only rendered where it can be above render_tol,
+            so each pixel is within render_tol of the full render (default: None)
 
         Returns
         -------
@@ -265,7 +268,9 @@ class RenderNGmixNbrs(object):
                                 pars_tag, fit_flags_tag, fit_data,
                                 unmodeled_nbrs_masking_type=unmodeled_nbrs_masking_type,
                                 verbose=verbose,
-                                fracdev_tag=fracdev_tag,TdByTe_tag=TdByTe_tag)
+                                fracdev_tag=fracdev_tag,TdByTe_tag=TdByTe_tag,
+                                total=total,
+                                render_tol=render_tol)
         if res is None:
             return None
 
@@ -277,10 +282,8 @@ class RenderNGmixNbrs(object):
         # do final return
         cen_img, nbrs_imgs, nbrs_masks = res
         if total:
-            nbrs_img = numpy.zeros(img_shape,dtype='f8')
-            for img in nbrs_imgs:
-                if img is not None:
-                    nbrs_img += img
+            # the nbrs were rendered into a single image
+            nbrs_img = nbrs_imgs
 
             nbrs_mask = numpy.ones(img_shape,dtype='f8')
             for msk in nbrs_masks:
@@ -429,7 +432,11 @@ class RenderNGmixNbrs(object):
                      pars_tag, fit_flags_tag, nbrs_fit_data,
                      unmodeled_nbrs_masking_type='nbrs-seg',
                      verbose=True,
-                     fracdev_tag=None,TdByTe_tag=None):
+                     fracdev_tag=None,TdByTe_tag=None,
+                     cache=None,
+                     total=False,
+                     render_tol=None,
+                     fixed_nbrs_numbers=None):
         """
         render or mask nbrs around a central object given a set of nbr flags, jacobians and PSF GMixes
 
@@ -458,6 +465,17 @@ class RenderNGmixNbrs(object):
         verbose: bool indicating if the code should tell you things that happen (default: True)
         fracdev_tag: tag to use for fracdev if model == 'cm' (default: None)
         TdByTe_tag: tag to use for TdByTed if model == 'cm' (default: None)
+        cache: dict used to keep the rendered images between calls for the same image; an
+            image is only rendered again if the fit data or PSF used for it changed (default: None)
+        total: if True, the gaussians of all of the nbrs are put in one mixture and rendered in a
+            single pass, and nbr_imgs is the sum image of the nbrs; the cache is only used for the
+            central (default: False)
+        render_tol: if not None, each object is only rendered in the box of pixels where its
+            model can be above render_tol, so every pixel of its image is within render_tol of
+            the full render, see _get_gmix_bbox (default: None)
+        fixed_nbrs_numbers: list of numbers in the seg map of nbrs which are not in nbrs_inds
+            since they were cut from the FoF of the central; these are always masked and their
+            masks are appended to nbr_masks (default: None)
 
         Returns
         -------
@@ -487,15 +505,15 @@ class RenderNGmixNbrs(object):
             and cen_jac is not None
             and nbrs_fit_data['flags'][cen_ind] == 0):
 
-            if verbose:
-                print('        rendered central')
-
-            cen_img = RenderNGmixNbrs._render_single(
+            cen_img = RenderNGmixNbrs._render_single_cached(
+                cache, 'cen',
                 model, band, img_shape,
-                pars_tag,
-                nbrs_fit_data[cen_ind:cen_ind+1],
+                pars_tag, fit_flags_tag,
+                nbrs_fit_data, cen_ind,
                 cen_psf_gmix, cen_jac,
                 fracdev_tag=fracdev_tag,TdByTe_tag=TdByTe_tag,
+                verbose=verbose,
+                render_tol=render_tol,
             )
         else:
             cen_img = None
@@ -520,6 +538,8 @@ class RenderNGmixNbrs(object):
         # now do nbrs
         nbrs_imgs = []
         nbrs_masks = []
+        nbrs_gmixes = []
+        nbrs_gmix_jacs = []
         for nbr_ind,nbr_flags,nbr_psf_gmix,nbr_jac in zip(nbrs_inds,
                                                           nbrs_flags,
                                                           nbrs_psf_gmixes,
@@ -530,17 +550,32 @@ class RenderNGmixNbrs(object):
                 and nbr_psf_gmix is not None
                 and nbr_jac is not None):
 
-                if verbose:
-                    print('        rendered nbr: %d' % (nbr_ind+1))
-
-                curr_nbrsim = RenderNGmixNbrs._render_single(
-                    model, band, img_shape,
-                    pars_tag,
-                    nbrs_fit_data[nbr_ind:nbr_ind+1],
-                    nbr_psf_gmix, nbr_jac,
-                    fracdev_tag=fracdev_tag, TdByTe_tag=TdByTe_tag,
-                )
-                nbrs_imgs.append(curr_nbrsim)
+                if total:
+                    if verbose:
+                        print('        rendered nbr: %d' % (nbr_ind+1))
+
+                    gmix_image = RenderNGmixNbrs._get_gmix_image(
+                        model, band,
+                        pars_tag,
+                        nbrs_fit_data[nbr_ind:nbr_ind+1],
+                        nbr_psf_gmix,
+                        fracdev_tag=fracdev_tag, TdByTe_tag=TdByTe_tag,
+                    )
+                    if gmix_image is not None:
+                        nbrs_gmixes.append(gmix_image)
+                        nbrs_gmix_jacs.append(nbr_jac)
+                else:
+                    curr_nbrsim = RenderNGmixNbrs._render_single_cached(
+                        cache, 'nbr',
+                        model, band, img_shape,
+                        pars_tag, fit_flags_tag,
+                        nbrs_fit_data, nbr_ind,
+                        nbr_psf_gmix, nbr_jac,
+                        fracdev_tag=fracdev_tag, TdByTe_tag=TdByTe_tag,
+                        verbose=verbose,
+                        render_tol=render_tol,
+                    )
+                    nbrs_imgs.append(curr_nbrsim)
                 nbrs_masks.append(numpy.ones(img_shape))
 
             else:
@@ -552,7 +587,8 @@ class RenderNGmixNbrs(object):
                                               nbrs_fit_data['number'][nbr_ind],
                                               msk,
                                               unmodeled_nbrs_masking_type=unmodeled_nbrs_masking_type)
-                nbrs_imgs.append(None)
+                if not total:
+                    nbrs_imgs.append(None)
                 nbrs_masks.append(msk)
 
                 if verbose:
@@ -571,8 +607,88 @@ class RenderNGmixNbrs(object):
                     else:
                         print('        nbr not rendered for unknown reason: FoF obj = %d' % (nbr_ind+1))
 
+        if total:
+            nbrs_imgs = RenderNGmixNbrs._render_gmixes(nbrs_gmixes, nbrs_gmix_jacs, img_shape,
+                                                       render_tol=render_tol)
+
+        if fixed_nbrs_numbers is not None:
+            for nbr_number in fixed_nbrs_numbers:
+                if verbose:
+                    print('        masked fixed nbr: %d' % nbr_number)
+
+                msk = numpy.ones(img_shape)
+                RenderNGmixNbrs._mask_nbr_seg(cen_seg,
+                                              nbr_number,
+                                              msk,
+                                              unmodeled_nbrs_masking_type=unmodeled_nbrs_masking_type)
+                nbrs_masks.append(msk)
+
         return cen_img, nbrs_imgs, nbrs_masks
 
+    @staticmethod
+    def _render_single_cached(cache, kind,
+                              model, band, img_shape,
+                              pars_tag, fit_flags_tag,
+                              fit_data, ind,
+                              psf_gmix, jac,
+                              fracdev_tag=None,
+                              TdByTe_tag=None,
+                              verbose=True,
+                              render_tol=None):
+        """
+        render the object at index ind of fit_data with _render_single, reusing the image in
+        cache if the fit data, PSF, jacobian and image shape it was rendered with have not
+        changed
+
+        The cached images are read only, so callers cannot change them in place.
+
+        kind is 'cen' or 'nbr' and is only used for printing
+        """
+        if cache is not None:
+            row0, col0 = jac.get_cen()
+            key = [fit_data[pars_tag][ind].tobytes(),
+                   fit_data[fit_flags_tag][ind],
+                   fit_data['flags'][ind],
+                   psf_gmix.get_full_pars().tobytes(),
+                   (row0, col0,
+                    jac.get_dudrow(), jac.get_dudcol(),
+                    jac.get_dvdrow(), jac.get_dvdcol()),
+                   tuple(img_shape)]
+            if fracdev_tag is not None:
+                key += [fit_data[fracdev_tag][ind],fit_data[TdByTe_tag][ind]]
+            key += [render_tol]
+            key = tuple(key)
+
+            if ind in cache and cache[ind][0] == key:
+                if verbose:
+                    if kind == 'cen':
+                        print('        reused central')
+                    else:
+                        print('        reused nbr: %d' % (ind+1))
+                return cache[ind][1]
+
+        if verbose:
+            if kind == 'cen':
+                print('        rendered central')
+            else:
+                print('        rendered nbr: %d' % (ind+1))
+
+        image = RenderNGmixNbrs._render_single(
+            model, band, img_shape,
+            pars_tag,
+            fit_data[ind:ind+1],
+            psf_gmix, jac,
+            fracdev_tag=fracdev_tag, TdByTe_tag=TdByTe_tag,
+            render_tol=render_tol,
+        )
+
+        if cache is not None:
+            if image is not None:
+                image.setflags(write=False)
+            cache[ind] = (key,image)
+
+        return image
+
     @staticmethod
     def _render_single(model,
                        band,
@@ -582,7 +698,8 @@ class RenderNGmixNbrs(object):
                        psf_gmix,
                        jac,
                        fracdev_tag=None,
-                       TdByTe_tag=None):
+                       TdByTe_tag=None,
+                       render_tol=None):
         """
         render a single image of model for band with pars_tag in fit_data and psf_gmix w/ jac
 
@@ -600,18 +717,50 @@ class RenderNGmixNbrs(object):
         -------------------
         fracdev_tag: tag to use for fracdev if model == 'cm'
         TdByTe_tag: tag to use for TdByTed if model == 'cm'
+        render_tol: if not None, only render the box where the model can be above render_tol
 
         Returns
         -------
         img: image of the nbr as numpy array
         """
+        gmix_image = RenderNGmixNbrs._get_gmix_image(model, band, pars_tag, fit_data, psf_gmix,
+                                                     fracdev_tag=fracdev_tag, TdByTe_tag=TdByTe_tag)
+
+        image=None
+        if gmix_image is not None:
+            try:
+                if render_tol is None:
+                    image = gmix_image.make_image(img_shape, jacobian=jac, fast_exp=True)
+                else:
+                    image = numpy.zeros(img_shape,dtype='f8')
+                    bbox = RenderNGmixNbrs._get_gmix_bbox(gmix_image, jac, img_shape, render_tol)
+                    RenderNGmixNbrs._add_gmix_image(image, gmix_image, jac, bbox)
+            except GMixRangeError as err:
+                print("caught error: '%s'" % str(err))
+                pass
+
+        return image
+
+    @staticmethod
+    def _get_gmix_image(model,
+                        band,
+                        pars_tag,
+                        fit_data,
+                        psf_gmix,
+                        fracdev_tag=None,
+                        TdByTe_tag=None):
+        """
+        get the PSF convolved GMix of model for band with pars_tag in fit_data
+
+        the arguments are as for _render_single; None is returned if the GMix cannot be made
+        """
         pars_obj = fit_data[pars_tag][0].copy()
         band_pars_obj = numpy.zeros(6,dtype='f8')
         band_pars_obj[0:5] = pars_obj[0:5]
         band_pars_obj[5] = pars_obj[5+band]
         assert len(band_pars_obj) == 6
 
-        image=None
+        gmix_image=None
         for i in [1,2]:
             try:
                 if model != 'cm':
@@ -623,6 +772,7 @@ class RenderNGmixNbrs(object):
                                       fit_data[TdByTe_tag][0],
                                       band_pars_obj)
                 gmix_image = gmix_sky.convolve(psf_gmix)
+                break
             except GMixRangeError:
                 if i==1:
                     print('        setting T=0 for nbr!')
@@ -631,15 +781,226 @@ class RenderNGmixNbrs(object):
                 else:
                     gmix_image=None
 
-        if gmix_image is not None:
+        return gmix_image
+
+    @staticmethod
+    def _render_gmixes(gmixes, jacs, img_shape, render_tol=None):
+        """
+        render the sum of a list of GMixes, each with its own jacobian, in one pass
+
+        The jacobians of nbrs in the same image differ only in their centers, so each GMix is
+        shifted to the frame of the first jacobian and all of the gaussians are put in a
+        single GMix that is rendered once.  GMixes with a jacobian of a different shape, or
+        all of them if the single GMix cannot be rendered, are rendered one at a time.
+
+        With render_tol, GMixes that are below render_tol everywhere in the image are dropped
+        and the single GMix is only rendered in the union of the boxes of the others.
+
+        Parameters
+        ----------
+        gmixes: list of PSF convolved ngmix GMixes
+        jacs: list of ngmix Jacobians, one for each GMix
+        img_shape: tuple with image shape
+        render_tol: if not None, only render where the GMixes can be above render_tol
+
+        Returns
+        -------
+        img: sum image as numpy array
+        """
+        image = numpy.zeros(img_shape,dtype='f8')
+        if len(gmixes) == 0:
+            return image
+
+        ref_jac = jacs[0]
+        ref_row0, ref_col0 = ref_jac.get_cen()
+        ref_lin = numpy.array([ref_jac.get_dvdrow(), ref_jac.get_dvdcol(),
+                               ref_jac.get_dudrow(), ref_jac.get_dudcol()])
+
+        pars = []
+        bboxes = []
+        others = []
+        for gmix,jac in zip(gmixes,jacs):
+            bbox = None
+            if render_tol is not None:
+                bbox = RenderNGmixNbrs._get_gmix_bbox(gmix, jac, img_shape, render_tol)
+                if bbox[0] == bbox[1] or bbox[2] == bbox[3]:
+                    continue
+
+            lin = numpy.array([jac.get_dvdrow(), jac.get_dvdcol(),
+                               jac.get_dudrow(), jac.get_dudcol()])
+            if not numpy.allclose(lin, ref_lin, rtol=1.0e-10, atol=0.0):
+                others.append((gmix,jac,bbox))
+                continue
+
+            if bbox is not None:
+                bboxes.append(bbox)
+
+            # offset of this jacobian's center in the frame of the first
+            row0, col0 = jac.get_cen()
+            drow = row0 - ref_row0
+            dcol = col0 - ref_col0
+            dv = ref_lin[0]*drow + ref_lin[1]*dcol
+            du = ref_lin[2]*drow + ref_lin[3]*dcol
+
+            gpars = gmix.get_full_pars().copy()
+            gpars[1::6] += dv
+            gpars[2::6] += du
+            pars.append(gpars)
+
+        if len(pars) > 0:
+            if len(bboxes) > 0:
+                bboxes = numpy.array(bboxes)
+                all_bbox = (bboxes[:,0].min(), bboxes[:,1].max(),
+                            bboxes[:,2].min(), bboxes[:,3].max())
+            else:
+                all_bbox = None
+
+            try:
+                all_gmix = GMix(pars=numpy.concatenate(pars))
+                RenderNGmixNbrs._add_gmix_image(image, all_gmix, ref_jac, all_bbox)
+            except GMixRangeError as err:
+                print("caught error: '%s'" % str(err))
+                others = []
+                for gmix,jac in zip(gmixes,jacs):
+                    bbox = None
+                    if render_tol is not None:
+                        bbox = RenderNGmixNbrs._get_gmix_bbox(gmix, jac, img_shape, render_tol)
+                    others.append((gmix,jac,bbox))
+                image[:,:] = 0.0
+
+        for gmix,jac,bbox in others:
             try:
-                image = gmix_image.make_image(img_shape, jacobian=jac, fast_exp=True)
+                RenderNGmixNbrs._add_gmix_image(image, gmix, jac, bbox)
             except GMixRangeError as err:
                 print("caught error: '%s'" % str(err))
                 pass
 
         return image
 
+    @staticmethod
+    def _get_gmix_bbox(gmix, jac, img_shape, render_tol):
+        """
+        get the box of pixels outside of which the image of gmix is below render_tol
+
+        Each of the ngauss gaussians is cut where it drops below render_tol/ngauss, so the
+        pixels outside the box, and the pixels of a render in the box, are within render_tol
+        of the full render.  With render_tol set to a fraction of the noise, the nbrs
+        subtracted pixels match the full render to that fraction of the noise per nbr.
+
+        Parameters
+        ----------
+        gmix: a PSF convolved ngmix GMix
+        jac: an ngmix Jacobian for the image
+        img_shape: tuple with image shape
+        render_tol: the tolerance in the units of the image
+
+        Returns
+        -------
+        bbox: (row_min, row_max, col_min, col_max), with the max values one past the end;
+            the box is empty if the gmix is below render_tol everywhere
+        """
+        pars = gmix.get_full_pars().reshape(-1,6)
+        ngauss = pars.shape[0]
+
+        p = pars[:,0]
+        v = pars[:,1]
+        u = pars[:,2]
+        irr = pars[:,3]
+        irc = pars[:,4]
+        icc = pars[:,5]
+
+        # pixel to (v,u) and back
+        jmat = numpy.array([[jac.get_dvdrow(), jac.get_dvdcol()],
+                            [jac.get_dudrow(), jac.get_dudcol()]])
+        jinv = numpy.linalg.inv(jmat)
+        if RenderNGmixNbrs._render_has_area():
+            area = abs(numpy.linalg.det(jmat))
+        else:
+            area = 1.0
+
+        det = irr*icc - irc*irc
+        peak = numpy.abs(p)*area/(2.0*numpy.pi*numpy.sqrt(det))
+        gtol = render_tol/ngauss
+
+        w, = numpy.where(peak > gtol)
+        if w.size == 0:
+            return (0,0,0,0)
+
+        # extent where each gaussian is above gtol
+        chi2max = 2.0*numpy.log(peak[w]/gtol)
+
+        row0, col0 = jac.get_cen()
+        rows = row0 + jinv[0,0]*v[w] + jinv[0,1]*u[w]
+        cols = col0 + jinv[1,0]*v[w] + jinv[1,1]*u[w]
+
+        # pixel variances of the gaussians
+        var_rows = (jinv[0,0]**2*irr[w] + 2.0*jinv[0,0]*jinv[0,1]*irc[w]
+                    + jinv[0,1]**2*icc[w])
+        var_cols = (jinv[1,0]**2*irr[w] + 2.0*jinv[1,0]*jinv[1,1]*irc[w]
+                    + jinv[1,1]**2*icc[w])
+        drows = numpy.sqrt(chi2max*var_rows)
+        dcols = numpy.sqrt(chi2max*var_cols)
+
+        nrows, ncols = img_shape
+        row_min = int(numpy.clip(numpy.floor((rows-drows).min()), 0, nrows))
+        row_max = int(numpy.clip(numpy.ceil((rows+drows).max())+1, 0, nrows))
+        col_min = int(numpy.clip(numpy.floor((cols-dcols).min()), 0, ncols))
+        col_max = int(numpy.clip(numpy.ceil((cols+dcols).max())+1, 0, ncols))
+
+        if row_min >= row_max or col_min >= col_max:
+            return (0,0,0,0)
+
+        return (row_min, row_max, col_min, col_max)
+
+    _has_area = None
+
+    @staticmethod
+    def _render_has_area():
+        """
+        True if GMix.make_image multiplies by the pixel area of the jacobian
+
+        Some versions of ngmix do and some do not, so this is found once by
+        rendering the peak of a unit gaussian with pixels of area 0.25.
+        """
+        if RenderNGmixNbrs._has_area is None:
+            gmix = GMix(pars=[1.0,0.0,0.0,1.0,0.0,1.0])
+            jac = Jacobian(row=0.0,
+                           col=0.0,
+                           dudrow=0.0,
+                           dudcol=0.5,
+                           dvdrow=0.5,
+                           dvdcol=0.0)
+            peak = gmix.make_image((1,1), jacobian=jac)[0,0]*2.0*numpy.pi
+            RenderNGmixNbrs._has_area = bool(abs(peak-0.25) < abs(peak-1.0))
+
+        return RenderNGmixNbrs._has_area
+
+    @staticmethod
+    def _add_gmix_image(image, gmix, jac, bbox):
+        """
+        add the image of gmix to image, only in the box bbox from _get_gmix_bbox if it is not None
+        """
+        if bbox is None:
+            image += gmix.make_image(image.shape, jacobian=jac, fast_exp=True)
+            return
+
+        row_min, row_max, col_min, col_max = bbox
+        if row_min >= row_max or col_min >= col_max:
+            return
+
+        row0, col0 = jac.get_cen()
+        sub_jac = Jacobian(row=row0-row_min,
+                           col=col0-col_min,
+                           dudrow=jac.get_dudrow(),
+                           dudcol=jac.get_dudcol(),
+                           dvdrow=jac.get_dvdrow(),
+                           dvdcol=jac.get_dvdcol())
+
+        sub_shape = (row_max-row_min, col_max-col_min)
+        image[row_min:row_max,col_min:col_max] += gmix.make_image(sub_shape,
+                                                                  jacobian=sub_jac,
+                                                                  fast_exp=True)
+
     @staticmethod
     def _mask_nbr_seg(seg,nbr_number,masked_pix,unmodeled_nbrs_masking_type='nbrs-seg'):
         """
@@ -0,0 +1,57 @@
+"""
+tests of the batched EM psf fits
+"""
+from __future__ import print_function
+import numpy
+import pytest
+
+ngmix = pytest.importorskip('ngmix')
+pytest.importorskip('meds')
+pytest.importorskip('fitsio')
+pytest.importorskip('esutil')
+
+from ngmixer.batchpsf import BatchEMPSFFitter
+
+def make_psf_obs(seed, scale=0.263, dim=25):
+    rng = numpy.random.RandomState(seed)
+    gm = ngmix.GMix(pars=[0.6, 0.01, -0.02, 0.20, 0.01, 0.22,
+                          0.4, 0.00, 0.00, 0.60, -0.02, 0.55])
+    cen = (dim-1)/2.0 + rng.uniform(-0.5,0.5,size=2)
+    jac = ngmix.Jacobian(row=cen[0], col=cen[1],
+                         dvdrow=scale, dvdcol=0.0,
+                         dudrow=0.0, dudcol=scale)
+    im = gm.make_image((dim,dim), jacobian=jac)
+    im *= 1000.0/im.sum()
+    im += rng.normal(scale=1.0e-4*im.max(),size=im.shape)
+
+    obs = ngmix.Observation(im, jacobian=jac)
+    obs.update_meta_data({'Tguess':0.8})
+    return obs
+
+def fit_ngmix_em(obs, guess, maxiter, tol):
+    imsky,sky = ngmix.em.prep_image(obs.image)
+    emobs = ngmix.Observation(imsky, jacobian=obs.jacobian)
+    em = ngmix.em.GMixEM(emobs)
+    em.go(ngmix.GMix(pars=guess.ravel()), sky, maxiter=maxiter, tol=tol)
+    assert em.get_result()['flags'] == 0
+    return em.get_gmix().get_full_pars().reshape(-1,6)
+
+def test_batch_em_vs_ngmix():
+    maxiter = 5000
+    tol = 1.0e-8
+    psf_obs_list = [make_psf_obs(seed) for seed in range(90,94)]
+
+    fitter = BatchEMPSFFitter(2, maxiter=maxiter, tol=tol)
+    fitters = fitter.go(psf_obs_list)
+
+    guess = fitter._get_guess(numpy.array([0.8]),0)[0]
+    for obs,fit in zip(psf_obs_list,fitters):
+        assert fit.get_result()['flags'] == 0
+        pars = fit.get_gmix().get_full_pars().reshape(-1,6)
+        em_pars = fit_ngmix_em(obs,guess,maxiter,tol)
+
+        # fluxes sum to one minus the sky fraction, as in ngmix
+        assert 0.9 < pars[:,0].sum() < 1.0
+        assert numpy.allclose(pars[:,0],em_pars[:,0],rtol=1.0e-3,atol=0)
+        assert numpy.allclose(pars[:,1:3],em_pars[:,1:3],rtol=0,atol=1.0e-4)
+        assert numpy.allclose(pars[:,3:6],em_pars[:,3:6],rtol=0,atol=1.0e-3)
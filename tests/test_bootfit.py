@@ -0,0 +1,236 @@
+"""
+tests of the bootstrap fitters
+"""
+from __future__ import print_function
+import numpy
+import pytest
+
+pytest.importorskip('ngmix')
+pytest.importorskip('meds')
+pytest.importorskip('fitsio')
+pytest.importorskip('esutil')
+
+from ngmix.gexceptions import BootGalFailure
+from ngmixer.bootfit import NGMixBootFitter, MetacalNGMixBootFitter
+from ngmixer.defaults import LOW_TRIAGE_S2N
+
+class FakeObs(object):
+    def __init__(self, shape):
+        self.image = numpy.zeros(shape)
+        self.meta = {}
+
+    def update_meta_data(self, meta):
+        self.meta.update(meta)
+
+def make_fitter(**conf):
+    fitter = NGMixBootFitter.__new__(NGMixBootFitter)
+    fitter.update(conf)
+    return fitter
+
+def test_nbrs_cache_bounded():
+    shape = (32,32)
+    nbytes = 5*FakeObs(shape).image.nbytes
+    fitter = make_fitter(nbrs_cache_max_bytes=2*nbytes)
+
+    obs = [FakeObs(shape) for i in range(3)]
+    for o in obs:
+        cache = fitter._get_nbrs_render_cache(o,'exp_max_pars',3)
+        assert cache is not None
+        assert fitter._nbrs_cache_nbytes <= fitter['nbrs_cache_max_bytes']
+
+    # the least recently used cache was dropped
+    assert 'exp_max_pars' not in obs[0].meta['nbrs_render_cache']
+    assert 'exp_max_pars' in obs[1].meta['nbrs_render_cache']
+    assert 'exp_max_pars' in obs[2].meta['nbrs_render_cache']
+
+    # using a cache keeps it
+    cache = obs[1].meta['nbrs_render_cache']['exp_max_pars']
+    assert fitter._get_nbrs_render_cache(obs[1],'exp_max_pars',3) is cache
+    fitter._get_nbrs_render_cache(obs[0],'exp_max_pars',3)
+    assert 'exp_max_pars' in obs[1].meta['nbrs_render_cache']
+    assert 'exp_max_pars' not in obs[2].meta['nbrs_render_cache']
+
+    # too big for the budget by itself
+    assert fitter._get_nbrs_render_cache(FakeObs(shape),'exp_max_pars',20) is None
+
+    # deleted obs do not use the budget forever
+    del obs
+    for i in range(4):
+        assert fitter._get_nbrs_render_cache(FakeObs(shape),'dev_max_pars',3) is not None
+        assert fitter._nbrs_cache_nbytes <= fitter['nbrs_cache_max_bytes']
+
+@pytest.mark.parametrize('nbrs_sum_refresh',[1,3,1000])
+def test_nbrs_sum_update(nbrs_sum_refresh):
+    rng = numpy.random.RandomState(70)
+    shape = (16,16)
+    nnbrs = 5
+    fitter = make_fitter(nbrs_cache_max_bytes=1024**3,nbrs_sum_refresh=nbrs_sum_refresh)
+    obs = FakeObs(shape)
+    cache = fitter._get_nbrs_render_cache(obs,'exp_max_pars',nnbrs)
+
+    nbrs_imgs = [rng.normal(size=shape)*1e6 for i in range(nnbrs)]
+    for itr in range(20):
+        # change some of the images and leave the others as the same arrays
+        nbrs_imgs = list(nbrs_imgs)
+        for i in rng.choice(nnbrs,size=2,replace=False):
+            if rng.uniform() < 0.2:
+                nbrs_imgs[i] = None
+            else:
+                nbrs_imgs[i] = rng.normal(size=shape)*1e6
+
+        nbrsim = fitter._update_nbrs_sum(cache,nbrs_imgs,obs.image)
+
+        truth = numpy.zeros(shape)
+        for img in nbrs_imgs:
+            if img is not None:
+                truth += img
+        assert numpy.allclose(nbrsim,truth,rtol=0,atol=1e-6)
+        assert cache['nupdate'] < nbrs_sum_refresh
+
+class FakeMetacalBoot(object):
+    """
+    fails the fits with fewer than good_ntry tries
+    """
+    def __init__(self, good_ntry):
+        self.good_ntry = good_ntry
+        self.mb_obs_list = 'mb_obs_list'
+        self.ntrys = []
+
+    def fit_metacal(self, psf_model, model, max_pars, Tguess, metacal_obs=None, ntry=1, **kw):
+        assert metacal_obs == {'noshear':'sheared images'}
+
+        self.ntrys.append(ntry)
+        if ntry < self.good_ntry:
+            raise BootGalFailure('failed with ntry %d' % ntry)
+
+def make_metacal_fitter(**conf):
+    fitter = MetacalNGMixBootFitter.__new__(MetacalNGMixBootFitter)
+    fitter.update(conf)
+    return fitter
+
+@pytest.mark.parametrize('good_ntry,ntrys',[(1,[1]),(3,[1,2,4]),(4,[1,2,4]),(5,[1,2,4,1])])
+def test_metacal_adaptive_ntry(good_ntry, ntrys, monkeypatch):
+    import ngmix
+
+    nmake = []
+    def get_all_metacal(obs, **kw):
+        assert obs == 'mb_obs_list'
+        assert kw == {'step':0.01}
+        nmake.append(1)
+        return {'noshear':'sheared images'}
+    monkeypatch.setattr(ngmix.metacal,'get_all_metacal',get_all_metacal,raising=False)
+
+    fitter = make_metacal_fitter(adaptive_ntry={'max_ntry':8},metacal_pars={'step':0.01})
+    fitter.data = numpy.zeros(1,dtype=[('mcal_ntry','i4')])
+    mcal_boot = FakeMetacalBoot(good_ntry)
+
+    if good_ntry > 4:
+        with pytest.raises(BootGalFailure):
+            fitter._fit_metacal_adaptive(mcal_boot,'gauss','exp',{},4.0,
+                                         metacal_pars=fitter['metacal_pars'])
+    else:
+        fitter._fit_metacal_adaptive(mcal_boot,'gauss','exp',{},4.0,
+                                     metacal_pars=fitter['metacal_pars'])
+
+    # only the fits are redone
+    assert len(nmake) == 1
+    assert mcal_boot.ntrys == ntrys
+    assert fitter.data['mcal_ntry'][0] == sum(ntrys)
+
+def test_ntry_columns():
+    conf = dict(nband=1,fit_models=['exp'],fit_me_galaxy=False,use_coadd_prefix=False,
+                metacal_pars={'types':['noshear','1p']})
+
+    fitter = make_metacal_fitter(adaptive_ntry=None,**conf)
+    names = [d[0] for d in fitter._get_metacal_dtype(False)]
+    assert 'mcal_ntry' not in names
+    fitter.data = numpy.zeros(1,dtype=[('exp_max_ntry','i4')])
+    fitter.max_ntry_used = 3
+    fitter._set_max_ntry('exp',False)
+    assert fitter.data['exp_max_ntry'][0] == 0
+
+    fitter['adaptive_ntry'] = {'max_ntry':8}
+    names = [d[0] for d in fitter._get_metacal_dtype(False)]
+    assert 'mcal_ntry' in names
+    fitter._set_max_ntry('exp',False)
+    assert fitter.data['exp_max_ntry'][0] == 3
+
+class FakeGMix(object):
+    def __init__(self, T):
+        self.T = T
+
+    def get_T(self):
+        return self.T
+
+class FakePSFObs(object):
+    def __init__(self, T):
+        self.gmix = None if T is None else FakeGMix(T)
+
+    def has_gmix(self):
+        return self.gmix is not None
+
+class FakeGalObs(object):
+    def __init__(self, psf_T):
+        self.psf = FakePSFObs(psf_T)
+
+    def has_psf(self):
+        return True
+
+    def get_psf(self):
+        return self.psf
+
+class FakeBoot(object):
+    def __init__(self, psf_Ts):
+        self.mb_obs_list = [[FakeGalObs(T) for T in band_Ts] for band_Ts in psf_Ts]
+
+def test_metacal_psf_Tguess():
+    fitter = make_metacal_fitter(metacal_pars={'step':0.01})
+
+    # the first psf was not fit and some fits are bad
+    boot = FakeBoot([[None,0.5,numpy.nan],[0.6,-1.0],[0.7]])
+    assert numpy.isclose(fitter._get_metacal_psf_Tguess(boot),0.6*1.02**2)
+
+    with pytest.raises(BootGalFailure):
+        fitter._get_metacal_psf_Tguess(FakeBoot([[None],[-1.0]]))
+
+class FakeMbObsList(list):
+    def __init__(self):
+        super(FakeMbObsList,self).__init__([])
+        self.meta = {'id':1}
+
+    def update_meta_data(self, meta):
+        self.meta.update(meta)
+
+def test_triage_after_nbrs():
+    """
+    the triage fit is done on the images with the nbrs subtracted
+    """
+    fitter = make_fitter(fit_models=['exp','dev'],model_nbrs=True,make_plots=False,
+                         triage={'model':'psf','levels':[{'min_s2n':10.0}]})
+    calls = []
+
+    fitter._get_good_mb_obs_list = lambda mb_obs_list: mb_obs_list
+    fitter._get_struct_template = lambda coadd: numpy.zeros(1,dtype=[('flags','i4')])
+    fitter._restore_nbrs_meta_data = lambda *args,**kw: calls.append('restore')
+    fitter._render_nbrs = lambda model,*args: calls.append('render %s' % model)
+    fitter._mask_fixed_nbrs = lambda *args: calls.append('mask')
+    fitter._triage = lambda *args: (calls.append('triage'),(-1,FakeBoot([])))[1]
+    for name in ['_fill_epoch_data','_do_psf_stats','_fill_nimage_used','_fill_nbrs_data']:
+        setattr(fitter,name,lambda *args: None)
+
+    flags = fitter(FakeMbObsList(),nbrs_fit_data=numpy.zeros(1),nbrs_meta_data=numpy.zeros(1))
+    assert flags == LOW_TRIAGE_S2N
+    assert calls == ['restore','render exp','triage']
+
+    # no nbrs fits yet
+    del calls[:]
+    fitter(FakeMbObsList())
+    assert calls == ['mask','triage']
+
+def test_triage_flag_bits():
+    from ngmixer import defaults
+
+    names = ['PSF_FIT_FAILURE','GAL_FIT_FAILURE','PSF_FLUX_FIT_FAILURE','LOW_PSF_FLUX',
+             'IMAGE_FLAGS','NO_CUTOUTS','BOX_SIZE_TOO_BIG','UTTER_FAILURE','NO_ATTEMPT']
+    for name in names:
+        assert getattr(defaults,name) & LOW_TRIAGE_S2N == 0
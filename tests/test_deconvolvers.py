@@ -0,0 +1,167 @@
+"""
+tests of the deconvolving fitters
+"""
+from __future__ import print_function
+import numpy
+import pytest
+
+pytest.importorskip('ngmix')
+pytest.importorskip('meds')
+pytest.importorskip('fitsio')
+pytest.importorskip('esutil')
+
+from ngmixer.deconvolvers import ObsKSigmaMomentsCached
+
+SCALE = 0.263
+
+class FakeJac(object):
+    def __init__(self, row0, col0):
+        self.row0 = row0
+        self.col0 = col0
+
+    def get_cen(self):
+        return self.row0,self.col0
+
+    def get_dudrow(self):
+        return 0.0
+
+    def get_dudcol(self):
+        return SCALE
+
+    def get_dvdrow(self):
+        return SCALE
+
+    def get_dvdcol(self):
+        return 0.0
+
+class FakeObs(object):
+    def __init__(self, image, jacobian, psf=None):
+        self.image = image
+        self.weight = numpy.zeros_like(image) + 1.0/0.01**2
+        self.jacobian = jacobian
+        self.psf = psf
+
+class FakeShape(object):
+    def __init__(self, g1, g2):
+        self.g1 = g1
+        self.g2 = g2
+
+def shear_cov(cov, g1, g2):
+    """
+    the covariance in (u,v) of a gaussian sheared by g
+    """
+    s = numpy.sqrt(1.0 - g1**2 - g2**2)
+    A = numpy.array([[1.0+g1, g2],[g2, 1.0-g1]])/s
+    return numpy.dot(A,numpy.dot(cov,A.T))
+
+def render_gauss(dim, cen, cov, flux=1.0):
+    """
+    a gaussian with covariance cov in (u,v) at the pixel centers
+    """
+    rows,cols = numpy.mgrid[0:dim,0:dim]
+    v = (rows - cen[0])*SCALE
+    u = (cols - cen[1])*SCALE
+    icov = numpy.linalg.inv(cov)
+    chi2 = icov[0,0]*u**2 + 2.0*icov[0,1]*u*v + icov[1,1]*v**2
+    norm = flux*SCALE**2/(2.0*numpy.pi*numpy.sqrt(numpy.linalg.det(cov)))
+    return norm*numpy.exp(-0.5*chi2)
+
+def make_mb_obs_list(gal_cov, flux=100.0, psf_sigma=0.4, nepoch=2, dim=41):
+    psf_cov = numpy.diag([psf_sigma**2,psf_sigma**2])
+    mb_obs_list = []
+    for band in range(2):
+        obs_list = []
+        for i in range(nepoch):
+            # the objects are not at the same place in each epoch
+            cen = (20.0 + 0.3*i, 19.6 - 0.2*i)
+            psf_cen = (12.0, 12.0)
+            psf = FakeObs(render_gauss(25,psf_cen,psf_cov),FakeJac(*psf_cen))
+            im = render_gauss(dim,cen,gal_cov + psf_cov,flux=flux)
+            obs_list.append(FakeObs(im,FakeJac(*cen),psf=psf))
+        mb_obs_list.append(obs_list)
+    return mb_obs_list
+
+def measure(mb_obs_list, shear=None, sigma_weight=1.0):
+    moments = ObsKSigmaMomentsCached(mb_obs_list,sigma_weight)
+    moments.go(shear=shear)
+    return moments.get_result()
+
+def test_ksigma_cached_round():
+    res = measure(make_mb_obs_list(numpy.diag([0.5**2,0.5**2])))
+    assert res['flags'] == 0
+    assert numpy.all(res['nimage_use_band'] == 2)
+    assert numpy.abs(res['e']).max() < 1.0e-6
+    assert res['T'] > 0.0
+    assert res['T_err'] > 0.0
+    assert res['flux_s2n'] > 0.0
+
+def test_ksigma_cached_star():
+    """
+    the weight does not change the flux of a point source
+    """
+    res = measure(make_mb_obs_list(numpy.diag([1.0e-6,1.0e-6]),flux=100.0))
+    assert res['flags'] == 0
+    assert numpy.allclose(res['wflux'],100.0,rtol=1.0e-4)
+    assert abs(res['T']) < 1.0e-4
+
+def test_ksigma_cached_shear():
+    """
+    measuring with a shear is the same as measuring the sheared galaxy
+    """
+    cov = numpy.array([[0.6**2, 0.02],[0.02, 0.45**2]])
+    g1,g2 = 0.01,-0.02
+
+    res = measure(make_mb_obs_list(cov),shear=FakeShape(g1,g2))
+    sres = measure(make_mb_obs_list(shear_cov(cov,g1,g2)))
+
+    assert res['flags'] == 0
+    assert sres['flags'] == 0
+    assert numpy.allclose(res['e'],sres['e'],atol=1.0e-5)
+    assert numpy.allclose(res['T'],sres['T'],rtol=1.0e-4)
+    assert numpy.allclose(res['wflux'],sres['wflux'],rtol=1.0e-4)
+
+    # and not the same as the unsheared one
+    ures = measure(make_mb_obs_list(cov))
+    assert abs(res['e'][0] - ures['e'][0]) > 1.0e-3
+
+def test_ksigma_cached_transforms_once(monkeypatch):
+    """
+    the images are transformed once per object, not once per shear
+    """
+    mb_obs_list = make_mb_obs_list(numpy.diag([0.5**2,0.5**2]))
+
+    fft2 = numpy.fft.fft2
+    calls = []
+    def counting_fft2(*args, **kw):
+        calls.append(1)
+        return fft2(*args,**kw)
+    monkeypatch.setattr(numpy.fft,'fft2',counting_fft2)
+
+    moments = ObsKSigmaMomentsCached(mb_obs_list,1.0)
+    nfft = len(calls)
+    # an image and a psf for each epoch
+    assert nfft == 2*4
+
+    for g1,g2 in [(0.0,0.0),(0.01,0.0),(-0.01,0.0),(0.0,0.01),(0.0,-0.01)]:
+        moments.go(shear=FakeShape(g1,g2))
+        assert moments.get_result()['flags'] == 0
+    assert len(calls) == nfft
+
+def test_ksigma_cached_flags():
+    mb_obs_list = make_mb_obs_list(numpy.diag([0.5**2,0.5**2]))
+
+    # a psf too wide to divide by within the weight
+    res = measure(mb_obs_list,sigma_weight=0.05)
+    assert res['flags'] & ObsKSigmaMomentsCached.NO_IMAGES != 0
+    assert numpy.all(res['orflags_band'] & ObsKSigmaMomentsCached.PSF_TOO_SMALL != 0)
+    assert res['T'] == -9999.0
+
+    with pytest.raises(RuntimeError):
+        ObsKSigmaMomentsCached(mb_obs_list,1.0).get_result()
+
+def test_ksigma_cached_bad_shear():
+    from ngmix import GMixRangeError
+
+    moments = ObsKSigmaMomentsCached(make_mb_obs_list(numpy.diag([0.5**2,0.5**2])),1.0)
+    with pytest.raises(GMixRangeError):
+        moments.go(shear=FakeShape(0.8,0.7))
@@ -0,0 +1,227 @@
+"""
+tests of the on-disk cache of fit results
+"""
+from __future__ import print_function
+import os
+import numpy
+import pytest
+
+pytest.importorskip('ngmix')
+pytest.importorskip('meds')
+pytest.importorskip('fitsio')
+pytest.importorskip('esutil')
+
+from ngmixer.fitcache import FitCache, get_conf_hash
+from ngmixer.ngmixing import NGMixer
+
+EPOCH_DT = [('id','i8'),('number','i4'),('band_num','i2'),('cutout_index','i4'),
+            ('file_id','i4'),('psf_fit_flags','i4')]
+NBRS_DT = [('id','i8'),('number','i4'),('band_num','i2'),('cutout_index','i4'),
+           ('file_id','i4'),('nbr_id','i8'),('nbr_flags','i4')]
+META_DT = [('id','i8'),('number','i4'),('fofid','i8')]
+DATA_DT = META_DT + [('flags','i4'),('time_last_fit','f8'),('obj_flags','i4'),
+                     ('fofind','i8'),('pars','f8',3)]
+
+class FakeJacobian(object):
+    def __init__(self, row0, col0):
+        self.row0 = row0
+        self.col0 = col0
+
+    def get_cen(self):
+        return self.row0,self.col0
+
+    def get_dudrow(self):
+        return 0.0
+
+    def get_dudcol(self):
+        return 0.263
+
+    def get_dvdrow(self):
+        return 0.263
+
+    def get_dvdcol(self):
+        return 0.0
+
+class FakeObs(object):
+    def __init__(self, image, meta_data=None):
+        self.image = image
+        self.weight = numpy.ones_like(image)
+        self.jacobian = FakeJacobian(10.0,11.0)
+        self.meta = {'flags':0}
+        if meta_data is not None:
+            self.meta['meta_data'] = meta_data
+
+    def has_psf(self):
+        return False
+
+class FakeMbObsList(list):
+    def __init__(self, obs_lists, meta):
+        super(FakeMbObsList,self).__init__(obs_lists)
+        self.meta = meta
+
+def make_epoch_meta(id, number, band_num, cutout_index, file_id):
+    meta_data = numpy.zeros(1,dtype=EPOCH_DT[0:5])
+    meta_data['id'] = id
+    meta_data['number'] = number
+    meta_data['band_num'] = band_num
+    meta_data['cutout_index'] = cutout_index
+    meta_data['file_id'] = file_id
+    return meta_data
+
+def make_mb_obs_lists(id=10, number=3, fofid=2, seed=100, nbrs_ids=None):
+    rng = numpy.random.RandomState(seed)
+    meta_data = numpy.zeros(1,dtype=META_DT)
+    meta_data['id'] = id
+    meta_data['number'] = number
+    meta_data['fofid'] = fofid
+    meta = {'id':id,'obj_flags':0,'meta_data':meta_data}
+    if nbrs_ids is not None:
+        meta['nbrs_ids'] = nbrs_ids
+
+    coadd = FakeMbObsList([[FakeObs(rng.normal(size=(8,8)),
+                                    make_epoch_meta(id,number,0,0,0))]],
+                          dict(meta))
+    mb = FakeMbObsList([[FakeObs(rng.normal(size=(8,8)),
+                                 make_epoch_meta(id,number,0,icut,icut))
+                         for icut in [1,2]]],
+                       meta)
+    return coadd,mb
+
+def test_fit_cache_round_trip(tmpdir):
+    fit_cache = FitCache(str(tmpdir),'abc')
+    coadd,mb = make_mb_obs_lists()
+    key = fit_cache.get_key(coadd,mb)
+    assert fit_cache.get(key) is None
+
+    rows = {'data':numpy.zeros(1,dtype=DATA_DT),
+            'epoch_data':numpy.zeros(2,dtype=EPOCH_DT),
+            'nbrs_data':numpy.zeros(0,dtype=NBRS_DT)}
+    rows['data']['pars'] = [1.0,2.0,3.0]
+    fit_cache.put(key,rows)
+
+    cached = FitCache(str(tmpdir),'abc').get(key)
+    for name in rows:
+        assert numpy.array_equal(cached[name],rows[name])
+
+    # other configs do not see the entry
+    assert FitCache(str(tmpdir),'abd').get(key) is None
+
+    fit_cache.clear()
+    assert fit_cache.get(key) is None
+
+def test_fit_cache_key(tmpdir):
+    fit_cache = FitCache(str(tmpdir),'abc')
+    coadd,mb = make_mb_obs_lists()
+    key = fit_cache.get_key(coadd,mb)
+
+    # the meta data of the object are not part of the key
+    coadd,mb = make_mb_obs_lists(number=5,fofid=7)
+    assert fit_cache.get_key(coadd,mb) == key
+
+    coadd,mb = make_mb_obs_lists()
+    mb[0][1].image[3,3] += 1.0e-6
+    assert fit_cache.get_key(coadd,mb) != key
+
+    coadd,mb = make_mb_obs_lists()
+    mb[0][0].weight[0,0] = 0.0
+    assert fit_cache.get_key(coadd,mb) != key
+
+    coadd,mb = make_mb_obs_lists(id=11)
+    assert fit_cache.get_key(coadd,mb) != key
+
+    coadd,mb = make_mb_obs_lists()
+    assert FitCache(str(tmpdir),'abd').get_key(coadd,mb) != key
+
+def test_fit_cache_lru(tmpdir):
+    rows = {'data':numpy.zeros(100,dtype=DATA_DT)}
+    fit_cache = FitCache(str(tmpdir),'abc')
+    fit_cache.put('00',rows)
+    size = os.path.getsize(fit_cache._get_fname('00'))
+
+    fit_cache = FitCache(str(tmpdir),'abc',max_size=3.5*size)
+    for i,key in enumerate(['01','02','03']):
+        fname = fit_cache._get_fname(key)
+        fit_cache.put(key,rows)
+        os.utime(fname,(i+1,i+1))
+
+    # using an entry keeps it
+    fit_cache.get('00')
+    fit_cache.put('04',rows)
+
+    assert fit_cache.get('00') is not None
+    assert fit_cache.get('01') is None
+    assert fit_cache.get('04') is not None
+    assert fit_cache.size <= 3.5*size
+
+class FakePrior(object):
+    def __init__(self, sigma):
+        self.sigma = sigma
+
+def test_conf_hash():
+    conf = {'fit_models':['exp'],'min_arcsec':0.5,'work_dir':'/a',
+            'model_pars':{'exp':{'g':{'type':'ba','sigma':0.3}}}}
+    fitter_conf = dict(conf,max_pars={'ntry':2})
+    conf_hash = get_conf_hash(conf,fitter_conf=fitter_conf)
+
+    assert get_conf_hash(conf) != conf_hash
+    assert get_conf_hash(dict(conf,work_dir='/b'),
+                         fitter_conf=dict(fitter_conf,work_dir='/b')) == conf_hash
+    assert get_conf_hash(conf,fitter_conf=dict(fitter_conf,max_pars={'ntry':3})) != conf_hash
+
+    # prior objects are hashed by type, their pars are in the config
+    fitter_conf['model_pars']['exp']['g_prior'] = FakePrior(0.3)
+    conf_hash = get_conf_hash(conf,fitter_conf=fitter_conf)
+    fitter_conf['model_pars']['exp']['g_prior'] = FakePrior(0.3)
+    assert get_conf_hash(conf,fitter_conf=fitter_conf) == conf_hash
+
+def make_mixer():
+    mixer = NGMixer.__new__(NGMixer)
+    mixer.curr_data = numpy.zeros(2,dtype=DATA_DT)
+    mixer.curr_data['fofind'] = [0,1]
+    mixer.curr_data_index = 1
+    mixer.epoch_data = []
+    mixer.nbrs_data = []
+    return mixer
+
+def test_set_cached_fit():
+    """
+    the fit results come from the cache, the ids from the current run
+    """
+    coadd,mb = make_mb_obs_lists(id=10,number=3,fofid=2,nbrs_ids=[20])
+    rows = {'data':numpy.zeros(1,dtype=DATA_DT),
+            'epoch_data':numpy.zeros(3,dtype=EPOCH_DT),
+            'nbrs_data':numpy.zeros(4,dtype=NBRS_DT)}
+    rows['data']['number'] = 1
+    rows['data']['fofid'] = 5
+    rows['data']['fofind'] = 7
+    rows['data']['pars'] = [1.0,2.0,3.0]
+    for name in ['epoch_data','nbrs_data']:
+        rows[name]['number'] = 1
+        rows[name]['file_id'] = -1
+    rows['epoch_data']['cutout_index'] = [0,1,2]
+    rows['epoch_data']['psf_fit_flags'] = [0,1,2]
+    rows['nbrs_data']['cutout_index'] = [1,1,2,2]
+    rows['nbrs_data']['nbr_id'] = [21,11,21,11]
+    rows['nbrs_data']['nbr_flags'] = [0,1,2,3]
+
+    mixer = make_mixer()
+    mixer._set_cached_fit(rows,0.0,coadd,mb)
+
+    data = mixer.curr_data[1]
+    assert numpy.array_equal(data['pars'],[1.0,2.0,3.0])
+    assert (data['id'],data['number'],data['fofid'],data['fofind']) == (10,3,2,1)
+
+    epoch_data = numpy.array(mixer.epoch_data,dtype=EPOCH_DT)
+    assert numpy.all(epoch_data['id'] == 10)
+    assert numpy.all(epoch_data['number'] == 3)
+    assert numpy.array_equal(epoch_data['file_id'],[0,1,2])
+    assert numpy.array_equal(epoch_data['psf_fit_flags'],[0,1,2])
+
+    nbrs_data = numpy.array(mixer.nbrs_data,dtype=NBRS_DT)
+    assert numpy.all(nbrs_data['number'] == 3)
+    assert numpy.array_equal(nbrs_data['file_id'],[1,1,2,2])
+    assert numpy.array_equal(nbrs_data['nbr_id'],[20,10,20,10])
+    assert numpy.array_equal(nbrs_data['nbr_flags'],[0,1,2,3])
+
+    # the cached rows are not changed
+    assert numpy.all(rows['epoch_data']['number'] == 1)
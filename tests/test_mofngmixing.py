@@ -0,0 +1,366 @@
+"""
+tests of the MOF iterations
+"""
+from __future__ import print_function
+import copy
+import numpy
+import pytest
+
+pytest.importorskip('ngmix')
+pytest.importorskip('meds')
+pytest.importorskip('fitsio')
+pytest.importorskip('esutil')
+
+from ngmixer.mofngmixing import MOFNGMixer
+from ngmixer.util import Namer
+from ngmixer.defaults import MOF_SKIPPED_IN_CONV_CHECK, \
+    MOF_NOT_CONVERGED, \
+    MOF_NBR_NOT_CONVERGED, \
+    MOF_NBR_BAD_FIT, \
+    MOF_NBR_NOT_FIT, \
+    MOF_NBR_SKIPPED_IN_CONV_CHECK, \
+    MOF_FOFMEM_NOT_CONVERGED, \
+    MOF_FOFMEM_BAD_FIT, \
+    MOF_FOFMEM_NOT_FIT, \
+    MOF_FOFMEM_SKIPPED_IN_CONV_CHECK
+from ngmixer.defaults import DEFVAL, LOW_TRIAGE_S2N
+
+NPARS = 6
+
+def make_mixer(foflen, mof_conf):
+    """
+    a MOFNGMixer with only the config and data needed for the iterations
+    """
+    mixer = MOFNGMixer.__new__(MOFNGMixer)
+    mixer['mof'] = mof_conf
+    mixer._accel_hist = []
+    mixer._get_pars_tags = lambda: [('exp_max_pars','exp_pars','exp_max_flags','exp_max_pars_cov')]
+
+    dtype = [('flags','i4'),
+             ('exp_max_flags','i4'),
+             ('exp_max_pars','f8',NPARS),
+             ('exp_pars','f8',NPARS),
+             ('exp_max_pars_cov','f8',(NPARS,NPARS))]
+    mixer.curr_data = numpy.zeros(foflen,dtype=dtype)
+    for i in range(NPARS):
+        mixer.curr_data['exp_max_pars_cov'][:,i,i] = 0.01**2
+    return mixer
+
+def make_linear_map(foflen, seed):
+    """
+    a contraction x -> A x + b on the stacked pars of the fof with its fixed
+    point, which has small shapes
+    """
+    rng = numpy.random.RandomState(seed)
+    ntot = foflen*NPARS
+    q,_ = numpy.linalg.qr(rng.normal(size=(ntot,ntot)))
+    A = numpy.dot(q*rng.uniform(0.5,0.97,size=ntot),q.T)
+
+    xstar = rng.uniform(-1.0,1.0,size=(foflen,NPARS))
+    xstar[:,2:4] *= 0.1
+    b = xstar.ravel() - numpy.dot(A,xstar.ravel())
+
+    def apply(x):
+        return (numpy.dot(A,x.ravel()) + b).reshape(x.shape)
+
+    return apply,xstar
+
+def run_iterations(mixer, apply, niter, accel):
+    foflen = len(mixer.curr_data)
+    active = numpy.ones(foflen,dtype=bool)
+    for itr in range(niter):
+        mixer.prev_data = mixer.curr_data.copy()
+        for tag in ['exp_max_pars','exp_pars']:
+            mixer.curr_data[tag] = apply(mixer.prev_data[tag])
+        if accel and itr < niter-1:
+            mixer._accelerate_pars(active)
+    return mixer.curr_data
+
+@pytest.mark.parametrize('accel,omega,gain',[('sor',1.5,1.5),('anderson',None,10.0)])
+def test_accelerate_linear(accel, omega, gain):
+    foflen = 3
+    niter = 30
+    conf = {'accel':accel,'accel_omega':omega,'accel_m':3}
+    apply,xstar = make_linear_map(foflen,60)
+
+    plain = run_iterations(make_mixer(foflen,conf),apply,niter,False)
+    fast = run_iterations(make_mixer(foflen,conf),apply,niter,True)
+
+    plain_err = numpy.abs(plain['exp_max_pars']-xstar).max()
+    fast_err = numpy.abs(fast['exp_max_pars']-xstar).max()
+    print(accel,plain_err,fast_err)
+
+    assert fast_err < plain_err/gain
+    assert numpy.array_equal(fast['exp_max_pars'],fast['exp_pars'])
+
+def test_accelerate_skips_flagged():
+    foflen = 3
+    conf = {'accel':'sor','accel_omega':1.5,'accel_m':3}
+    apply,xstar = make_linear_map(foflen,62)
+
+    mixer = make_mixer(foflen,conf)
+    mixer.prev_data = mixer.curr_data.copy()
+    for tag in ['exp_max_pars','exp_pars']:
+        mixer.curr_data[tag] = apply(mixer.prev_data[tag])
+    mixer.curr_data['exp_max_flags'][1] = 1
+    fits = mixer.curr_data.copy()
+
+    active = numpy.ones(foflen,dtype=bool)
+    active[2] = False
+    mixer._accelerate_pars(active)
+
+    assert numpy.array_equal(mixer.curr_data[1],fits[1])
+    assert numpy.array_equal(mixer.curr_data[2],fits[2])
+    assert not numpy.array_equal(mixer.curr_data['exp_max_pars'][0],fits['exp_max_pars'][0])
+
+class LoopMOFNGMixer(MOFNGMixer):
+    """
+    the original loops over the fof members for the convergence check and
+    the nbr flags
+    """
+    def _check_convergence(self,foflen,itr,coadd_mb_obs_lists,mb_obs_lists):
+        models_to_check,pars_models_to_check,cov_models_to_check,npars = self._get_models_to_check()
+
+        maxabs = numpy.zeros(npars,dtype='f8')
+        maxabs[:] = -numpy.inf
+        maxfrac = numpy.zeros(npars,dtype='f8')
+        maxfrac[:] = -numpy.inf
+        maxerr = numpy.zeros(npars,dtype='f8')
+        maxerr[:] = -numpy.inf
+
+        maxfrac_conv = self['mof']['maxfrac_conv'][0:npars]
+        maxabs_conv = self['mof']['maxabs_conv'][0:npars]
+
+        for fofind in range(foflen):
+            for model,_pars_model,_model_cov in zip(models_to_check,pars_models_to_check,cov_models_to_check):
+                pars_model = _pars_model
+                model_cov = _model_cov
+
+                n = Namer(model)
+
+                self.curr_data[n('mof_flags')][fofind] = 0
+                self.curr_data[n('mof_num_itr')][fofind] = itr+1
+
+                if self.curr_data['flags'][fofind] or self.prev_data['flags'][fofind]:
+                    self.curr_data[n('mof_flags')][fofind] = MOF_SKIPPED_IN_CONV_CHECK
+                    continue
+
+                old = self.prev_data[pars_model][fofind]
+                new = self.curr_data[pars_model][fofind]
+                absdiff = numpy.abs(new-old)
+                absfracdiff = numpy.abs(new/old-1.0)
+                abserr = numpy.abs((old-new)/numpy.sqrt(numpy.diag(self.curr_data[model_cov][fofind])))
+
+                self.curr_data[n('mof_abs_diff')][fofind] = absdiff
+                self.curr_data[n('mof_frac_diff')][fofind] = absfracdiff
+                self.curr_data[n('mof_err_diff')][fofind] = abserr
+
+                if numpy.all((absdiff <= maxabs_conv)      | \
+                             (absfracdiff <= maxfrac_conv) | \
+                             (abserr <= self['mof']['maxerr_conv'])):
+                    self.curr_data[n('mof_flags')][fofind] = 0
+                else:
+                    self.curr_data[n('mof_flags')][fofind] = MOF_NOT_CONVERGED
+
+                for i in range(npars):
+                    if absdiff[i] > maxabs[i]:
+                        maxabs[i] = copy.copy(absdiff[i])
+                    if absfracdiff[i] > maxfrac[i]:
+                        maxfrac[i] = copy.copy(absfracdiff[i])
+                    if abserr[i] > maxerr[i]:
+                        maxerr[i] = copy.copy(abserr[i])
+
+        self.maxabs = maxabs
+        self.maxfrac = maxfrac
+        self.maxerr = maxerr
+
+        self._set_nbr_mof_flags(foflen,coadd_mb_obs_lists,mb_obs_lists)
+
+        if numpy.all((maxabs <= maxabs_conv)   | \
+                     (maxfrac <= maxfrac_conv) | \
+                     (maxerr <= self['mof']['maxerr_conv'])):
+            return True
+        else:
+            return False
+
+    def _set_nbr_mof_flags(self,foflen,coadd_mb_obs_lists,mb_obs_lists):
+        models_to_check,pars_models_to_check,cov_models_to_check,npars = self._get_models_to_check()
+
+        for model in models_to_check:
+            n = Namer(model)
+
+            any_not_conv = 0
+            any_bad_fit = 0
+            any_not_fit = 0
+            any_skip_conv = 0
+
+            for cen_ind in range(foflen):
+                if mb_obs_lists[cen_ind].meta['obj_flags'] != 0:
+                    any_not_fit = 1
+                if self.curr_data[n('mof_flags')][cen_ind]&MOF_NOT_CONVERGED != 0:
+                    any_not_conv = 1
+                if self.curr_data['flags'][cen_ind]:
+                    any_bad_fit = 1
+                if self.curr_data[n('mof_flags')][cen_ind]&MOF_SKIPPED_IN_CONV_CHECK != 0:
+                    any_skip_conv = 1
+
+                nbr_not_conv = 0
+                nbr_bad_fit = 0
+                nbr_not_fit = 0
+                nbr_skip_conv = 0
+
+                for nbrs_ind in mb_obs_lists[cen_ind].meta['nbrs_inds']:
+                    if mb_obs_lists[nbrs_ind].meta['obj_flags'] != 0:
+                        nbr_not_fit = 1
+                    if self.curr_data[n('mof_flags')][nbrs_ind]&MOF_NOT_CONVERGED != 0:
+                        nbr_not_conv = 1
+                    if self.curr_data['flags'][nbrs_ind]:
+                        nbr_bad_fit = 1
+                    if self.curr_data[n('mof_flags')][nbrs_ind]&MOF_SKIPPED_IN_CONV_CHECK != 0:
+                        nbr_skip_conv = 1
+
+                if nbr_not_conv:
+                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_NBR_NOT_CONVERGED
+                if nbr_bad_fit:
+                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_NBR_BAD_FIT
+                if nbr_not_fit:
+                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_NBR_NOT_FIT
+                if nbr_skip_conv:
+                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_NBR_SKIPPED_IN_CONV_CHECK
+
+            for cen_ind in range(foflen):
+                if any_not_conv:
+                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_FOFMEM_NOT_CONVERGED
+                if any_bad_fit:
+                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_FOFMEM_BAD_FIT
+                if any_not_fit:
+                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_FOFMEM_NOT_FIT
+                if any_skip_conv:
+                    self.curr_data[n('mof_flags')][cen_ind] |= MOF_FOFMEM_SKIPPED_IN_CONV_CHECK
+
+class FakeMbObsList(list):
+    def __init__(self, meta):
+        self.meta = meta
+
+def make_conv_fof(foflen, seed):
+    """
+    data for two iterations of a fof, with some flagged members and nbrs
+    """
+    rng = numpy.random.RandomState(seed)
+    models = ['exp','dev']
+
+    dtype = [('flags','i4')]
+    for model in models:
+        n = Namer(model)
+        dtype += [(n('mof_flags'),'i4'),
+                  (n('mof_num_itr'),'i4'),
+                  (n('mof_abs_diff'),'f8',NPARS),
+                  (n('mof_frac_diff'),'f8',NPARS),
+                  (n('mof_err_diff'),'f8',NPARS),
+                  (n('max_pars'),'f8',NPARS),
+                  (n('max_pars_cov'),'f8',(NPARS,NPARS))]
+
+    prev_data = numpy.zeros(foflen,dtype=dtype)
+    curr_data = numpy.zeros(foflen,dtype=dtype)
+    for model in models:
+        n = Namer(model)
+        prev_data[n('max_pars')] = rng.uniform(0.5,1.5,size=(foflen,NPARS))
+        step = rng.normal(size=(foflen,NPARS))*10.0**rng.uniform(-5,-1,size=(foflen,1))
+        curr_data[n('max_pars')] = prev_data[n('max_pars')] + step
+        for i in range(NPARS):
+            curr_data[n('max_pars_cov')][:,i,i] = 1e-3**2
+    prev_data['flags'][rng.uniform(size=foflen) < 0.1] = 1
+    curr_data['flags'][rng.uniform(size=foflen) < 0.1] = 2
+
+    mb_obs_lists = []
+    for i in range(foflen):
+        nbrs_inds = [j for j in rng.choice(foflen,size=3,replace=False) if j != i]
+        obj_flags = 1 if rng.uniform() < 0.05 else 0
+        mb_obs_lists.append(FakeMbObsList({'nbrs_inds':nbrs_inds,'obj_flags':obj_flags}))
+
+    return prev_data,curr_data,mb_obs_lists
+
+@pytest.mark.parametrize('seed',[80,81,82,83])
+def test_convergence_vs_loop(seed):
+    foflen = 40
+    mof_conf = {'maxabs_conv':[1e-3]*NPARS,
+                'maxfrac_conv':[1e-4]*NPARS,
+                'maxerr_conv':0.5}
+    prev_data,curr_data,mb_obs_lists = make_conv_fof(foflen,seed)
+
+    res = []
+    for cls in [MOFNGMixer,LoopMOFNGMixer]:
+        mixer = cls.__new__(cls)
+        mixer['mof'] = mof_conf
+        mixer['fit_coadd_galaxy'] = False
+        mixer._get_models_to_check = lambda: (['exp','dev'],['exp_max_pars','dev_max_pars'],
+                                              ['exp_max_pars_cov','dev_max_pars_cov'],NPARS)
+        mixer.prev_data = prev_data.copy()
+        mixer.curr_data = curr_data.copy()
+
+        conv = mixer._check_convergence(foflen,3,None,mb_obs_lists)
+        res.append((conv,mixer))
+
+    (conv,mixer),(loop_conv,loop_mixer) = res
+    assert conv == loop_conv
+    assert numpy.array_equal(mixer.maxabs,loop_mixer.maxabs)
+    assert numpy.array_equal(mixer.maxfrac,loop_mixer.maxfrac)
+    assert numpy.array_equal(mixer.maxerr,loop_mixer.maxerr)
+    for tag in mixer.curr_data.dtype.names:
+        assert numpy.array_equal(mixer.curr_data[tag],loop_mixer.curr_data[tag]),tag
+
+    # some of each kind of member
+    mof_flags = mixer.curr_data['exp_mof_flags']
+    assert numpy.any(mof_flags & MOF_NOT_CONVERGED)
+    assert numpy.any(mof_flags & MOF_SKIPPED_IN_CONV_CHECK)
+    assert numpy.any((mof_flags & (MOF_NOT_CONVERGED|MOF_SKIPPED_IN_CONV_CHECK)) == 0)
+
+def test_convergence_triaged():
+    """
+    members triaged in every fit do not count as skipped or bad fits
+    """
+    foflen = 6
+    mof_conf = {'maxabs_conv':[1e-3]*NPARS,
+                'maxfrac_conv':[1e-4]*NPARS,
+                'maxerr_conv':0.5}
+    prev_data,curr_data,mb_obs_lists = make_conv_fof(foflen,90)
+    prev_data['flags'] = 0
+    curr_data['flags'] = 0
+    nbrs_inds = [[1,2],[0],[0],[4],[3],[]]
+    for mb_obs_list,inds in zip(mb_obs_lists,nbrs_inds):
+        mb_obs_list.meta['obj_flags'] = 0
+        mb_obs_list.meta['nbrs_inds'] = inds
+    for model in ['exp','dev']:
+        n = Namer(model)
+        curr_data[n('max_pars')] = prev_data[n('max_pars')]
+
+    # 0 was triaged in both fits, 1 only in the last one
+    for data in [prev_data,curr_data]:
+        data['flags'][0] = LOW_TRIAGE_S2N
+        data['exp_max_pars'][0] = DEFVAL
+        data['dev_max_pars'][0] = DEFVAL
+    curr_data['flags'][1] = LOW_TRIAGE_S2N
+
+    mixer = MOFNGMixer.__new__(MOFNGMixer)
+    mixer['mof'] = mof_conf
+    mixer['fit_coadd_galaxy'] = False
+    mixer._get_models_to_check = lambda: (['exp','dev'],['exp_max_pars','dev_max_pars'],
+                                          ['exp_max_pars_cov','dev_max_pars_cov'],NPARS)
+    mixer.prev_data = prev_data
+    mixer.curr_data = curr_data
+
+    mixer._check_convergence(foflen,3,None,mb_obs_lists)
+    mof_flags = mixer.curr_data['exp_mof_flags']
+    assert mof_flags[0] & (MOF_SKIPPED_IN_CONV_CHECK|MOF_NOT_CONVERGED) == 0
+    assert mof_flags[1] & MOF_SKIPPED_IN_CONV_CHECK != 0
+    assert numpy.all(mof_flags & MOF_NBR_BAD_FIT == 0)
+    assert numpy.all(mof_flags & MOF_FOFMEM_BAD_FIT == 0)
+    assert numpy.array_equal(mixer._get_active_members(foflen,mb_obs_lists),
+                             [True,True,False,False,False,False])
+
+    # once 1 stays triaged nothing changes
+    mixer.prev_data = mixer.curr_data.copy()
+    assert mixer._check_convergence(foflen,4,None,mb_obs_lists)
+    mof_flags = mixer.curr_data['exp_mof_flags']
+    assert numpy.all(mof_flags == 0)
+    assert not numpy.any(mixer._get_active_members(foflen,mb_obs_lists))
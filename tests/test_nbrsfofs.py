@@ -0,0 +1,295 @@
+"""
+tests of the nbrs and fof code
+"""
+from __future__ import print_function
+import copy
+import numpy
+import pytest
+
+pytest.importorskip('ngmix')
+pytest.importorskip('meds')
+pytest.importorskip('fitsio')
+pytest.importorskip('esutil')
+
+from ngmixer import nbrsfofs
+from ngmixer.nbrsfofs import MedsNbrs, NbrsFoF, split_fofs
+
+NBRS_CONF = {
+    'buff_type':'min',
+    'buff_frac':0.25,
+    'maxsize_to_replace':128,
+    'new_maxsize':64,
+    'check_seg':False,
+}
+
+class FakeMeds(dict):
+    """
+    just the catalog columns of a MEDS file used for finding nbrs
+    """
+    @property
+    def size(self):
+        return len(self['number'])
+
+    def __reduce__(self):
+        raise TypeError('MEDS objects cannot be pickled')
+
+def make_fake_meds(nobj, seed, tile_size=2000, nbad=3):
+    rng = numpy.random.RandomState(seed)
+
+    m = FakeMeds()
+    m['number'] = numpy.arange(1,nobj+1)
+    m['id'] = m['number'] + 1000
+    m['box_size'] = rng.choice([32,48,64,128],size=nobj)
+    m['orig_start_row'] = rng.randint(0,tile_size,size=(nobj,1))
+    m['orig_start_col'] = rng.randint(0,tile_size,size=(nobj,1))
+
+    bad = rng.choice(nobj,size=nbad,replace=False)
+    m['orig_start_row'][bad,0] = -9999
+
+    return m
+
+def get_brute_force_nbrs(m, conf):
+    """
+    the nbrs from testing every pair of stamps
+    """
+    nobj = m.size
+    dsize = (conf['new_maxsize']-conf['maxsize_to_replace'])//2
+    sze = m['box_size'].copy()
+    l = m['orig_start_row'][:,0].copy()
+    b = m['orig_start_col'][:,0].copy()
+    q = sze == conf['maxsize_to_replace']
+    sze[q] = conf['new_maxsize']
+    l[q] -= dsize
+    b[q] -= dsize
+    r = m['orig_start_row'][:,0] + sze
+    t = m['orig_start_col'][:,0] + sze
+    good = (m['orig_start_row'][:,0] != -9999) & (m['orig_start_col'][:,0] != -9999)
+
+    nbrs = {}
+    for i in range(nobj):
+        nbrs[i+1] = []
+        if not good[i]:
+            continue
+
+        for j in range(nobj):
+            if i == j or not good[j]:
+                continue
+
+            if conf['buff_type'] == 'min':
+                buff = min(sze[i],sze[j])
+            elif conf['buff_type'] == 'max':
+                buff = max(sze[i],sze[j])
+            else:
+                buff = sze[i] + sze[j]
+            buff *= conf['buff_frac']
+            if not (l[i] > r[j]-buff or r[i] < l[j]+buff or
+                    t[i] < b[j]+buff or b[i] > t[j]-buff):
+                nbrs[i+1].append(j+1)
+
+    return nbrs
+
+def nbrs_data_to_dict(nbrs_data):
+    nbrs = {}
+    for number,nbr_number in zip(nbrs_data['number'],nbrs_data['nbr_number']):
+        nbrs.setdefault(number,[])
+        if nbr_number > 0:
+            nbrs[number].append(nbr_number)
+    return nbrs
+
+@pytest.mark.parametrize('seed',[10,11,12])
+@pytest.mark.parametrize('buff_type',['min','max','tot'])
+def test_nbrs_brute_force(seed, buff_type):
+    m = make_fake_meds(400,seed)
+    conf = dict(NBRS_CONF,buff_type=buff_type)
+
+    nbrs = MedsNbrs([m],conf)
+    nbrs_data = nbrs.get_nbrs()
+
+    assert numpy.all(numpy.diff(nbrs_data['number']) >= 0)
+    assert nbrs_data_to_dict(nbrs_data) == get_brute_force_nbrs(m,conf)
+
+def get_loop_fofs(nbrs_data):
+    """
+    the fofs from the original set-merging loop, as a set of frozensets of
+    numbers
+    """
+    nobj = len(numpy.unique(nbrs_data['number']))
+    linked = numpy.zeros(nobj,dtype='i8') - 1
+    fofs = {}
+
+    for mind in range(nobj):
+        q, = numpy.where((nbrs_data['number'] == mind+1) & (nbrs_data['nbr_number'] > 0))
+        nbrs = set(nbrs_data['nbr_number'][q]-1)
+
+        if linked[mind] == -1:
+            fofid = copy.copy(mind)
+            fofs[fofid] = set([mind])
+            linked[mind] = fofid
+        else:
+            fofid = copy.copy(linked[mind])
+
+        for nbr in nbrs:
+            if linked[nbr] == -1 or linked[nbr] == fofid:
+                fofs[fofid].add(nbr)
+                linked[nbr] = fofid
+            else:
+                fofs[linked[nbr]] |= fofs[fofid]
+                del fofs[fofid]
+                fofid = copy.copy(linked[nbr])
+                inds = numpy.array(list(fofs[fofid]),dtype=int)
+                linked[inds] = fofid
+
+    return set(frozenset(int(i)+1 for i in members) for members in fofs.values())
+
+def fof_data_to_sets(fof_data):
+    fofs = {}
+    for fofid,number in zip(fof_data['fofid'],fof_data['number']):
+        fofs.setdefault(fofid,set()).add(int(number))
+    return set(frozenset(members) for members in fofs.values())
+
+@pytest.mark.parametrize('seed',[20,21,22])
+@pytest.mark.parametrize('tile_size',[1000,2000,4000])
+def test_fofs_vs_loop(seed, tile_size):
+    m = make_fake_meds(400,seed,tile_size=tile_size)
+    nbrs_data = MedsNbrs([m],NBRS_CONF).get_nbrs()
+
+    fof_data = NbrsFoF(nbrs_data).get_fofs(verbose=False)
+
+    assert numpy.array_equal(fof_data['number'],numpy.arange(1,m.size+1))
+    assert fof_data_to_sets(fof_data) == get_loop_fofs(nbrs_data)
+
+    #fofids are dense and ordered by the smallest member
+    fofids = fof_data['fofid']
+    assert numpy.array_equal(numpy.unique(fofids),numpy.arange(fofids.max()+1))
+    first = numpy.array([fof_data['number'][fofids == i].min() for i in range(fofids.max()+1)])
+    assert numpy.all(numpy.diff(first) > 0)
+
+def add_fake_segs(m, seed, stamp_size=8):
+    """
+    seg cutouts, out of catalog order and with gaps between them, with the
+    object itself, some catalog nbrs and some seg ids larger than any
+    number in the catalog
+    """
+    rng = numpy.random.RandomState(seed)
+    nobj = m.size
+    m['ncutout'] = numpy.ones(nobj,dtype='i4')
+    m['ncutout'][0] = 0
+    m['box_size'] = numpy.zeros(nobj,dtype='i4') + stamp_size
+
+    npix = stamp_size*stamp_size
+    order = rng.permutation(nobj)
+    m['start_row'] = numpy.zeros((nobj,1),dtype='i8')
+    m['start_row'][order,0] = numpy.arange(nobj)*(npix+3)
+    seg_cutouts = numpy.zeros(nobj*(npix+3),dtype='i4') - 1
+
+    pairs = set()
+    for mindex in range(nobj):
+        number = m['number'][mindex]
+        ids = numpy.concatenate([[0,number],
+                                 rng.choice(m['number'],size=2),
+                                 rng.randint(nobj+1,20*nobj,size=1)])
+        seg = rng.choice(ids,size=(stamp_size,stamp_size))
+        start = m['start_row'][mindex,0]
+        seg_cutouts[start:start+npix] = seg.ravel()
+
+        if m['ncutout'][mindex] > 0:
+            for val in numpy.unique(seg):
+                if val > 0 and val != number:
+                    pairs.add((number,val))
+
+    m._fits = {'seg_cutouts':seg_cutouts}
+    return pairs
+
+@pytest.mark.parametrize('seg_block_size',[1,64,500,10000000])
+def test_seg_nbrs(seg_block_size):
+    m = make_fake_meds(200,30)
+    pairs = add_fake_segs(m,31)
+    conf = dict(NBRS_CONF,check_seg=True,seg_block_size=seg_block_size)
+
+    nbrs = MedsNbrs([m],conf)
+    nbrs._init_seg_nbrs()
+    seg_nbrs = nbrs.seg_nbrs
+
+    assert numpy.all(numpy.diff(seg_nbrs['number']) >= 0)
+    assert len(seg_nbrs) == len(pairs)
+    assert set(zip(seg_nbrs['number'],seg_nbrs['nbr_number'])) == pairs
+
+@pytest.mark.parametrize('buff_type',['min','tot'])
+def test_nbrs_parallel(buff_type):
+    m = make_fake_meds(400,40,tile_size=1500)
+    conf = dict(NBRS_CONF,buff_type=buff_type)
+
+    serial = MedsNbrs([m],conf).get_nbrs()
+    parallel = MedsNbrs([m],conf).get_nbrs(nprocs=3)
+
+    assert numpy.array_equal(serial,parallel)
+
+def test_nbrs_strip_index():
+    """
+    each strip only gets part of the index but finds all of its nbrs
+    """
+    m = make_fake_meds(400,41,tile_size=3000)
+    nbrs = MedsNbrs([m],NBRS_CONF)
+    serial = [nbrs._get_nbrs_mindex(mindex) for mindex in range(m.size)]
+
+    srt = numpy.argsort(nbrs.l[0],kind='mergesort')
+    for strip in numpy.array_split(srt,8):
+        sort_inds,sort_l = nbrs._get_strip_index(strip)
+        assert len(sort_inds[0]) < len(nbrs.sort_inds[0])
+
+        pool_nbrs = copy.copy(nbrs)
+        pool_nbrs.meds_list = None
+        nbrsfofs._init_pool_nbrs(pool_nbrs)
+        try:
+            strip_nbrs = nbrsfofs._get_strip_nbrs((strip,sort_inds,sort_l))
+        finally:
+            nbrsfofs._init_pool_nbrs(None)
+
+        for mindex,nbr in zip(strip,strip_nbrs):
+            assert numpy.array_equal(nbr,serial[mindex])
+
+def get_pairs(nbrs_data):
+    q, = numpy.where(nbrs_data['nbr_number'] > 0)
+    return set(zip(nbrs_data['number'][q],nbrs_data['nbr_number'][q]))
+
+@pytest.mark.parametrize('max_fof_size',[1,2,5,20])
+def test_split_fofs(max_fof_size):
+    m = make_fake_meds(400,50,tile_size=800)
+    nbrs = MedsNbrs([m],NBRS_CONF)
+    nbrs_data = nbrs.get_nbrs()
+    fof_data = NbrsFoF(nbrs_data).get_fofs(verbose=False)
+    counts = numpy.bincount(fof_data['fofid'])
+    assert counts.max() > max_fof_size
+
+    new_fof_data,new_nbrs_data,fixed_nbrs_data = split_fofs(fof_data,
+                                                            nbrs_data,
+                                                            max_fof_size,
+                                                            overlaps=nbrs.get_overlaps(nbrs_data))
+
+    #sizes are limited and small fofs are untouched
+    new_counts = numpy.bincount(new_fof_data['fofid'])
+    assert new_counts.max() <= max_fof_size
+    assert numpy.array_equal(new_fof_data['number'],fof_data['number'])
+    small = set(s for s in fof_data_to_sets(fof_data) if len(s) <= max_fof_size)
+    assert small <= fof_data_to_sets(new_fof_data)
+
+    #the new fofs only split the old ones
+    for fofid in numpy.unique(new_fof_data['fofid']):
+        q, = numpy.where(new_fof_data['fofid'] == fofid)
+        assert len(numpy.unique(fof_data['fofid'][q])) == 1
+
+    #every pair is either kept in a new fof or fixed
+    pairs = get_pairs(nbrs_data)
+    kept = get_pairs(new_nbrs_data)
+    fixed = get_pairs(fixed_nbrs_data)
+    assert kept | fixed == pairs
+    assert len(kept & fixed) == 0
+    assert len(kept) + len(fixed) == len(pairs)
+    for number,nbr_number in kept:
+        assert new_fof_data['fofid'][number-1] == new_fof_data['fofid'][nbr_number-1]
+    for number,nbr_number in fixed:
+        assert new_fof_data['fofid'][number-1] != new_fof_data['fofid'][nbr_number-1]
+
+    #every object is still in the nbrs data and the kept nbrs are the fofs
+    assert numpy.array_equal(numpy.unique(new_nbrs_data['number']),fof_data['number'])
+    assert fof_data_to_sets(NbrsFoF(new_nbrs_data).get_fofs(verbose=False)) == fof_data_to_sets(new_fof_data)
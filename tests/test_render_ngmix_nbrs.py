@@ -0,0 +1,160 @@
+"""
+tests of rendering and masking nbrs
+"""
+from __future__ import print_function
+import numpy
+import pytest
+
+pytest.importorskip('ngmix')
+pytest.importorskip('meds')
+pytest.importorskip('fitsio')
+pytest.importorskip('esutil')
+
+from ngmix.gmix import GMix
+from ngmix.jacobian import Jacobian
+from ngmixer.nbrsfofs import split_fofs
+from ngmixer.render_ngmix_nbrs import RenderNGmixNbrs
+
+def test_fixed_nbrs_masked():
+    """
+    a pair cut by split_fofs is masked in the stamp of the object
+    """
+    #a chain 1-2-3 which is split into (1,2) and (3)
+    fof_data = numpy.zeros(3,dtype=[('fofid','i8'),('number','i8')])
+    fof_data['number'] = [1,2,3]
+    nbrs_data = numpy.zeros(4,dtype=[('number','i8'),('nbr_number','i8')])
+    nbrs_data['number'] = [1,2,2,3]
+    nbrs_data['nbr_number'] = [2,1,3,2]
+    overlaps = numpy.array([2.0,2.0,1.0,1.0])
+
+    fof_data,nbrs_data,fixed_nbrs_data = split_fofs(fof_data,nbrs_data,2,overlaps=overlaps)
+    assert list(fof_data['fofid']) == [0,0,1]
+
+    q, = numpy.where(fixed_nbrs_data['number'] == 2)
+    fixed_nbrs_numbers = list(fixed_nbrs_data['nbr_number'][q])
+    assert fixed_nbrs_numbers == [3]
+
+    #object 2 with nbr 1 in the fof and 3 in the seg map
+    seg = numpy.zeros((16,16),dtype='i4')
+    seg[2:5,2:5] = 1
+    seg[6:10,6:10] = 2
+    seg[11:15,11:14] = 3
+
+    #fits are flagged so nothing is rendered
+    fit_data = numpy.zeros(3,dtype=[('number','i8'),('flags','i4'),
+                                    ('exp_max_flags','i4'),('exp_max_pars','f8',6)])
+    fit_data['number'] = [1,2,3]
+    fit_data['exp_max_flags'] = 1
+
+    for total in [False,True]:
+        cen_img,nbrs_imgs,nbrs_masks = RenderNGmixNbrs._render_nbrs('exp', 0, seg.shape,
+                                                                    1, None, None, seg,
+                                                                    [0], [0],
+                                                                    [None], [None],
+                                                                    'exp_max_pars', 'exp_max_flags', fit_data,
+                                                                    verbose=False,
+                                                                    total=total,
+                                                                    fixed_nbrs_numbers=fixed_nbrs_numbers)
+        assert cen_img is None
+        assert len(nbrs_masks) == 2
+
+        masked_pix = numpy.ones(seg.shape)
+        for msk in nbrs_masks:
+            masked_pix *= msk
+        assert numpy.array_equal(masked_pix == 0,(seg == 1) | (seg == 3))
+
+@pytest.mark.parametrize('render_tol',[1e-2,1e-4])
+def test_gmix_bbox_render(render_tol):
+    """
+    the render in the box is within render_tol of the full render everywhere
+    """
+    jac = Jacobian(row=31.3,
+                   col=29.8,
+                   dudrow=0.01,
+                   dudcol=0.263,
+                   dvdrow=0.265,
+                   dvdcol=-0.02)
+    area = abs(jac.get_dudcol()*jac.get_dvdrow()-jac.get_dudrow()*jac.get_dvdcol())
+
+    # a nbr off the center and a fainter one near the edge
+    pars = [60.0, 1.5,-2.0, 0.30, 0.05,0.25,
+            40.0, 1.3,-2.2, 1.20,-0.10,1.00,
+             5.0, 4.0, 3.0, 0.40, 0.00,0.40]
+    gmix = GMix(pars=pars)
+    img_shape = (64,64)
+
+    full = gmix.make_image(img_shape, jacobian=jac)
+    flux = pars[0]+pars[6]+pars[12]
+    if RenderNGmixNbrs._render_has_area():
+        assert numpy.isclose(full.sum(),flux,rtol=1e-3)
+    else:
+        assert numpy.isclose(full.sum()*area,flux,rtol=1e-3)
+
+    bbox = RenderNGmixNbrs._get_gmix_bbox(gmix, jac, img_shape, render_tol)
+    row_min, row_max, col_min, col_max = bbox
+    assert (row_max-row_min)*(col_max-col_min) < full.size
+
+    image = numpy.zeros(img_shape)
+    RenderNGmixNbrs._add_gmix_image(image, gmix, jac, bbox)
+    assert numpy.abs(image-full).max() <= render_tol
+
+class FakeJac(object):
+    def __init__(self, row0, col0, scale=0.263):
+        self.row0 = row0
+        self.col0 = col0
+        self.scale = scale
+
+    def get_cen(self):
+        return self.row0,self.col0
+
+    def get_dudrow(self):
+        return 0.0
+
+    def get_dudcol(self):
+        return self.scale
+
+    def get_dvdrow(self):
+        return self.scale
+
+    def get_dvdcol(self):
+        return 0.0
+
+class FakePSFGMix(object):
+    def get_full_pars(self):
+        return numpy.array([1.0,0.0,0.0,0.1,0.0,0.1])
+
+def test_render_single_cached(monkeypatch):
+    """
+    images are only reused for the same jacobian and shape, and cannot be
+    changed in place
+    """
+    nrender = []
+    def render_single(model, band, img_shape, pars_tag, fit_data, psf_gmix, jac, **kw):
+        nrender.append(1)
+        return numpy.zeros(img_shape) + jac.row0
+    monkeypatch.setattr(RenderNGmixNbrs,'_render_single',staticmethod(render_single))
+
+    fit_data = numpy.zeros(2,dtype=[('flags','i4'),('exp_max_flags','i4'),('exp_max_pars','f8',6)])
+    fit_data['exp_max_pars'] = 1.0
+    cache = {}
+
+    def render(jac, img_shape=(8,8)):
+        return RenderNGmixNbrs._render_single_cached(cache, 'nbr', 'exp', 0, img_shape,
+                                                     'exp_max_pars', 'exp_max_flags',
+                                                     fit_data, 1, FakePSFGMix(), jac,
+                                                     verbose=False)
+
+    image = render(FakeJac(3.0,4.0))
+    assert render(FakeJac(3.0,4.0)) is image
+    assert len(nrender) == 1
+    with pytest.raises(ValueError):
+        image += 1.0
+
+    for jac,img_shape in [(FakeJac(5.0,4.0),(8,8)),
+                          (FakeJac(5.0,4.5),(8,8)),
+                          (FakeJac(5.0,4.5,scale=0.27),(8,8)),
+                          (FakeJac(5.0,4.5,scale=0.27),(10,8))]:
+        image = render(jac,img_shape=img_shape)
+        assert image.shape == img_shape
+        assert numpy.all(image == jac.row0)
+    assert len(nrender) == 5